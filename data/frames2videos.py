@@ -9,6 +9,8 @@ from pathlib import Path
 import imageio.v2 as imageio
 import tqdm
 
+from openeqa.utils.manifest_utils import FramesManifest
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
@@ -53,13 +55,13 @@ def get_folders(args: argparse.Namespace) -> list:
     return folders
 
 
-def create_video(folder: Path, args: argparse.Namespace):
+def create_video(folder: Path, manifest: FramesManifest, args: argparse.Namespace):
     output_path = args.output_directory / (folder.name + "-0.mp4")
     if output_path.exists():
         print("WARNING: skipping {}; file already exists".format(output_path))
         return
 
-    files = sorted(folder.glob("*-rgb.png"))
+    files = manifest.get_frames("{}/{}".format(args.split, folder.name))
 
     writer = imageio.get_writer(
         output_path,
@@ -74,8 +76,9 @@ def create_video(folder: Path, args: argparse.Namespace):
 
 def main(args):
     folders = get_folders(args)
+    manifest = FramesManifest(args.frames_directory)
     for folder in folders:
-        create_video(folder, args)
+        create_video(folder, manifest, args)
 
 
 if __name__ == "__main__":
@@ -15,6 +15,13 @@ import tqdm
 from config import make_cfg
 from PIL import Image
 
+from openeqa.utils.embedding_utils import (
+    DEFAULT_EMBEDDING_MODEL,
+    build_embedding_index,
+    get_embedding_backend,
+)
+from openeqa.utils.store_utils import build_episode_store
+
 os.environ["MAGNUM_LOG"] = "quiet"
 os.environ["HABITAT_SIM_LOG"] = "quiet"
 
@@ -38,6 +45,41 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="only extract rgb frames (default: false)",
     )
+    parser.add_argument(
+        "--build-embedding-index",
+        action="store_true",
+        help="build frame embedding indices for retrieval (default: false)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="embedding index output path (default: data/index)",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=DEFAULT_EMBEDDING_MODEL,
+        help="frame embedding model (default: {})".format(DEFAULT_EMBEDDING_MODEL),
+    )
+    parser.add_argument(
+        "--build-frame-store",
+        action="store_true",
+        help="pack resized frames into a memory-mapped store (default: false)",
+    )
+    parser.add_argument(
+        "--store-directory",
+        type=Path,
+        default="data/store",
+        help="frame store output path (default: data/store)",
+    )
+    parser.add_argument(
+        "--store-image-sizes",
+        type=int,
+        nargs="+",
+        default=[512],
+        help="longest side of stored frames (default: 512)",
+    )
     args = parser.parse_args()
     return args
 
@@ -129,9 +171,25 @@ def extract_frames(folder: Path, args: argparse.Namespace) -> None:
 
 
 def main(args):
+    embedding_backend = None
+    if args.build_embedding_index:
+        embedding_backend = get_embedding_backend(model=args.embedding_model)
+
     folders = sorted(args.output_directory.glob("*"))
     for folder in tqdm.tqdm(folders):
         extract_frames(folder, args)
+        if embedding_backend is not None:
+            build_embedding_index(
+                sorted(folder.glob("*-rgb.png")),
+                args.index_directory / args.output_directory.name / folder.name,
+                embedding_backend,
+            )
+        if args.build_frame_store:
+            build_episode_store(
+                sorted(folder.glob("*-rgb.png")),
+                args.store_directory / args.output_directory.name / folder.name,
+                args.store_image_sizes,
+            )
 
 
 if __name__ == "__main__":
@@ -11,6 +11,13 @@ from typing import Dict
 import tqdm
 from SensorData import SensorData
 
+from openeqa.utils.embedding_utils import (
+    DEFAULT_EMBEDDING_MODEL,
+    build_embedding_index,
+    get_embedding_backend,
+)
+from openeqa.utils.store_utils import build_episode_store
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
@@ -43,6 +50,41 @@ def parse_args() -> argparse.Namespace:
         default=600,
         help="maximum frames to extract from a scene (default: 600)",
     )
+    parser.add_argument(
+        "--build-embedding-index",
+        action="store_true",
+        help="build frame embedding indices for retrieval (default: false)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="embedding index output path (default: data/index)",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=DEFAULT_EMBEDDING_MODEL,
+        help="frame embedding model (default: {})".format(DEFAULT_EMBEDDING_MODEL),
+    )
+    parser.add_argument(
+        "--build-frame-store",
+        action="store_true",
+        help="pack resized frames into a memory-mapped store (default: false)",
+    )
+    parser.add_argument(
+        "--store-directory",
+        type=Path,
+        default="data/store",
+        help="frame store output path (default: data/store)",
+    )
+    parser.add_argument(
+        "--store-image-sizes",
+        type=int,
+        nargs="+",
+        default=[512],
+        help="longest side of stored frames (default: 512)",
+    )
     args = parser.parse_args()
     args.output_directory.mkdir(parents=True, exist_ok=True)
     return args
@@ -91,11 +133,27 @@ def extract_frames(
 
 
 def main(args):
+    embedding_backend = None
+    if args.build_embedding_index:
+        embedding_backend = get_embedding_backend(model=args.embedding_model)
+
     folder_to_scene = get_folder_to_scene(args)
     for folder, scene in tqdm.tqdm(folder_to_scene.items()):
         output_folder = args.output_directory / folder
         scene_path = get_scene_path(args, scene)
         extract_frames(scene_path=scene_path, output_folder=output_folder, args=args)
+        if embedding_backend is not None:
+            build_embedding_index(
+                sorted(output_folder.glob("*-rgb.png")),
+                args.index_directory / folder,
+                embedding_backend,
+            )
+        if args.build_frame_store:
+            build_episode_store(
+                sorted(output_folder.glob("*-rgb.png")),
+                args.store_directory / folder,
+                args.store_image_sizes,
+            )
 
 
 if __name__ == "__main__":
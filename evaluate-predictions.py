@@ -117,6 +117,21 @@ def main(args: argparse.Namespace):
     scores = 100.0 * (np.clip(scores, 1, 5) - 1) / 4
     print("final score: {:.1f}".format(np.mean(scores)))
 
+    # break down scores by cascade stage (see --cascade-num-frames)
+    stage_to_scores = {}
+    for question_id, score in all_scores.items():
+        result = question_id_to_result.get(question_id, {})
+        if "cascade_stage" in result:
+            stage = result["cascade_stage"]
+            stage_to_scores.setdefault(stage, []).append(score)
+    for stage, stage_scores in sorted(stage_to_scores.items()):
+        stage_scores = 100.0 * (np.clip(stage_scores, 1, 5) - 1) / 4
+        print(
+            "cascade stage {}: {:.1f} ({:,} questions)".format(
+                stage, np.mean(stage_scores), len(stage_scores)
+            )
+        )
+
 
 if __name__ == "__main__":
     main(parse_args())
@@ -0,0 +1,152 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import collections
+import json
+import re
+from pathlib import Path
+from typing import List
+
+SHARD_PATTERN = re.compile(r"-shard-(\d+)-of-(\d+)$")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "results",
+        type=Path,
+        nargs="+",
+        help="paths to the results files of every shard",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=Path,
+        default="data/open-eqa-v0.json",
+        help="path to dataset (default: data/open-eqa-v0.json)",
+    )
+    parser.add_argument(
+        "--output-path",
+        type=Path,
+        help="merged results (default: first shard path without the shard suffix)",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="merge even if responses or shards are missing; duplicate or unknown "
+        "questions and shards are always errors (default: false)",
+    )
+    args = parser.parse_args()
+    assert args.dataset.exists()
+    if args.output_path is None:
+        path = args.results[0]
+        args.output_path = path.parent / (SHARD_PATTERN.sub("", path.stem) + ".json")
+    if args.output_path in args.results:
+        parser.error("output path is one of the inputs: {}".format(args.output_path))
+    return args
+
+
+def check_shards(paths: List[Path], force: bool = False) -> int:
+    """Checks that every shard index 0..N-1 of the same N is given exactly
+    once (a single unsharded file is also accepted). Returns the number of
+    errors; missing shards are only a warning with force."""
+    matches = [SHARD_PATTERN.search(path.stem) for path in paths]
+    if len(paths) == 1 and matches[0] is None:
+        return 0
+    num_errors = 0
+    shards = collections.defaultdict(list)
+    for path, match in zip(paths, matches):
+        if match is None:
+            print("ERROR: {} is not a shard results file".format(path))
+            num_errors += 1
+            continue
+        shards[int(match.group(2))].append(int(match.group(1)))
+    if len(shards) > 1:
+        print(
+            "ERROR: shards of runs with different --num-shards: {}".format(
+                sorted(shards)
+            )
+        )
+        return num_errors + 1
+    for num_shards, indices in shards.items():
+        counts = collections.Counter(indices)
+        for index, count in sorted(counts.items()):
+            if index >= num_shards:
+                print("ERROR: invalid shard {} of {}".format(index, num_shards))
+                num_errors += 1
+            elif count > 1:
+                print(
+                    "ERROR: shard {} of {} given {} times".format(
+                        index, num_shards, count
+                    )
+                )
+                num_errors += 1
+        missing = [i for i in range(num_shards) if i not in counts]
+        if missing:
+            print(
+                "{} shards {} of {} are missing".format(
+                    "WARNING:" if force else "ERROR:", missing, num_shards
+                )
+            )
+            if not force:
+                num_errors += len(missing)
+    return num_errors
+
+
+def main(args: argparse.Namespace):
+    dataset = json.load(args.dataset.open("r"))
+    dataset_question_ids = [item["question_id"] for item in dataset]
+    print("found {:,} questions".format(len(dataset)))
+
+    question_id_to_result = {}
+    question_id_to_path = {}
+    num_errors = check_shards(args.results, force=args.force)
+    for path in args.results:
+        results = json.load(path.open("r"))
+        print("found {:,} results in {}".format(len(results), path))
+        for result in results:
+            question_id = result["question_id"]
+            if question_id in question_id_to_result:
+                print(
+                    "ERROR: duplicate question {} in {} and {}".format(
+                        question_id, question_id_to_path[question_id], path
+                    )
+                )
+                num_errors += 1
+                continue
+            question_id_to_result[question_id] = result
+            question_id_to_path[question_id] = path
+
+    unknown = set(question_id_to_result) - set(dataset_question_ids)
+    for question_id in sorted(unknown):
+        print("ERROR: question {} is not in the dataset".format(question_id))
+    num_errors += len(unknown)
+
+    missing = [q for q in dataset_question_ids if q not in question_id_to_result]
+    if missing:
+        print(
+            "{} {:,} questions are missing".format(
+                "WARNING:" if args.force else "ERROR:", len(missing)
+            )
+        )
+        if not args.force:
+            num_errors += len(missing)
+
+    if num_errors:
+        raise SystemExit("not merging: found {:,} errors".format(num_errors))
+
+    # save in dataset order
+    merged = [
+        question_id_to_result[q]
+        for q in dataset_question_ids
+        if q in question_id_to_result
+    ]
+    json.dump(merged, args.output_path.open("w"), indent=2)
+    print("saving {:,} answers to {}".format(len(merged), args.output_path))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -4,20 +4,34 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
+import functools
 import os
-import traceback
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List, Optional
-
-import numpy as np
-import tqdm
+from typing import List, Optional, Union
 
 from openeqa.utils.anthropic_utils import (
+    AnthropicUsage,
+    PromptCacheGate,
     call_anthropic_api,
     prepare_anthropic_vision_messages,
+    stream_anthropic_api,
 )
+from openeqa.utils.batch_utils import format_numbered_questions
+from openeqa.utils.frame_utils import FrameCache, FrameTimings
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    add_prefetch_args,
+    add_runner_args,
+)
+from openeqa.utils.sampling_utils import add_sampling_args, get_samples_path
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import add_streaming_args, is_answer_complete
+from openeqa.utils.vision_utils import (
+    VisionPipeline,
+    add_frame_args,
+    check_frame_args,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -47,10 +61,10 @@ def parse_args() -> argparse.Namespace:
         help="number of frames (default: 20)",
     )
     parser.add_argument(
-        "--image-size",
-        type=int,
-        default=512,
-        help="image size (default: 512)",
+        "--temperature",
+        type=float,
+        default=0.2,
+        help="claude temperature (default: 0.2)",
     )
     parser.add_argument(
         "--max-tokens",
@@ -59,26 +73,33 @@ def parse_args() -> argparse.Namespace:
         help="gpt maximum tokens (default: 128)",
     )
     parser.add_argument(
-        "--output-directory",
-        type=Path,
-        default="data/results",
-        help="output directory (default: data/results)",
+        "--cache-images",
+        action="store_true",
+        help="send frames first and cache them across questions (default: false)",
     )
     parser.add_argument(
-        "--force",
-        action="store_true",
-        help="continue running on API errors (default: false)",
+        "--requests-per-minute",
+        type=float,
+        help="max API requests per minute across threads (default: none)",
     )
     parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
+        "--output-directory",
+        type=Path,
+        default="data/results",
+        help="output directory (default: data/results)",
     )
+    add_frame_args(parser)
+    add_runner_args(parser)
+    add_sampling_args(parser)
+    add_prefetch_args(parser)
+    add_streaming_args(parser)
     args = parser.parse_args()
+    check_frame_args(parser, args, "anthropic")
     args.output_directory.mkdir(parents=True, exist_ok=True)
     args.output_path = args.output_directory / (
         args.dataset.stem + "-{}.json".format(args.model)
     )
+    args.output_path = get_samples_path(args.output_path, args.num_samples)
     return args
 
 
@@ -92,86 +113,126 @@ def parse_claude_output(output: str) -> str:
     return output[start_idx:end_idx].replace("A:", "").strip()
 
 
-def ask_question(
+def prepare_messages(
+    question: Union[str, List[str]],
     image_paths: List,
-    question: str,
-    image_size: int,
+    image_size: int = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
+    cache_images: bool = False,
+    abstain: bool = False,
+) -> List:
+    prompt = load_prompt("claude3-vision")
+    prefix, suffix = prompt.split("User Query:")
+    if isinstance(question, list):
+        # ask several numbered questions about the same frames
+        multi_prompt = load_prompt("multi-question").format(num_questions=len(question))
+        prefix = prefix.rstrip("\n") + "\n" + multi_prompt + "\n"
+        question = format_numbered_questions(question)
+    suffix = "User Query:" + suffix.format(question=question)
+    if mosaic_size:
+        mosaic_prompt = load_prompt("mosaic").format(mosaic_size=mosaic_size)
+        prefix = prefix.rstrip("\n") + "\n" + mosaic_prompt + "\n"
+    if abstain:
+        prefix = prefix.rstrip("\n") + "\n" + load_prompt("cascade") + "\n"
+
+    return prepare_anthropic_vision_messages(
+        prefix=prefix,
+        suffix=suffix,
+        image_paths=image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        frame_cache=frame_cache,
+        num_workers=num_workers,
+        frame_timings=frame_timings,
+        mosaic_size=mosaic_size,
+        frame_store=frame_store,
+        cache_images=cache_images,
+    )
+
+
+def ask_question(
+    messages: List,
     anthropic_model: str,
     anthropic_max_tokens: int,
-    force: bool = False,
+    anthropic_temperature: float = 0.2,
+    usage: Optional[AnthropicUsage] = None,
+    raw: bool = False,
+    stream: bool = False,
+    latency: Optional[dict] = None,
 ) -> Optional[str]:
-    try:
-        prompt = load_prompt("claude3-vision")
-        prefix, suffix = prompt.split("User Query:")
-        suffix = "User Query:" + suffix.format(question=question)
-        stop_sequences = ["User Query:"]
-
-        messages = prepare_anthropic_vision_messages(
-            prefix=prefix, suffix=suffix, image_paths=image_paths, image_size=image_size
+    stop_sequences = ["User Query:"]
+    if stream:
+        # raw outputs (e.g., numbered answers) are read in full
+        output = stream_anthropic_api(
+            messages=messages,
+            model=anthropic_model,
+            max_tokens=anthropic_max_tokens,
+            temperature=anthropic_temperature,
+            stop_sequences=stop_sequences,
+            usage=usage,
+            stop_fn=None if raw else is_answer_complete,
+            latency=latency,
         )
-
+    else:
         output = call_anthropic_api(
             messages=messages,
             model=anthropic_model,
             max_tokens=anthropic_max_tokens,
+            temperature=anthropic_temperature,
             stop_sequences=stop_sequences,
+            usage=usage,
         )
-        return parse_claude_output(output)
-    except Exception as e:
-        if not force:
-            traceback.print_exc()
-            raise e
+    if raw:
+        return output  # parsed by the caller
+    return parse_claude_output(output)
 
 
 def main(args: argparse.Namespace):
     # check for anthropic api key
     assert "ANTHROPIC_API_KEY" in os.environ
 
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # extract scene paths
-        folder = args.frames_directory / item["episode_history"]
-        frames = sorted(folder.glob("*-rgb.png"))
-        indices = np.round(np.linspace(0, len(frames) - 1, args.num_frames)).astype(int)
-        paths = [str(frames[i]) for i in indices]
-
-        # generate answer
-        question = item["question"]
-        answer = ask_question(
-            image_paths=paths,
-            question=question,
-            image_size=args.image_size,
-            anthropic_model=args.model,
-            anthropic_max_tokens=args.max_tokens,
-            force=args.force,
-        )
-
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+    # report (cached) input tokens
+    usage = AnthropicUsage()
+    cache_gate = PromptCacheGate() if args.cache_images else None
+
+    def ask(
+        messages: List,
+        paths: List[str],
+        num_questions: int = 1,
+        raw: bool = False,
+        num_samples: int = 1,
+        latency: Optional[dict] = None,
+    ) -> Optional[str]:
+        hold = cache_gate.hold(tuple(paths)) if cache_gate else nullcontext()
+        with hold:
+            return ask_question(
+                messages=messages,
+                anthropic_model=args.model,
+                anthropic_max_tokens=args.max_tokens * num_questions,
+                anthropic_temperature=args.temperature,
+                usage=usage,
+                raw=raw,
+                stream=args.stream,
+                latency=latency,
+            )
+
+    pipeline = VisionPipeline(
+        args,
+        "anthropic",
+        functools.partial(prepare_messages, cache_images=args.cache_images),
+        ask,
+    )
+    pipeline.run()
+    usage.print_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from openeqa.utils.batch_utils import parse_numbered_answers
+from openeqa.utils.description_utils import (
+    DescriptionCache,
+    format_description,
+    get_description_version,
+)
+from openeqa.utils.episode_utils import EpisodeScheduler
+from openeqa.utils.frame_utils import FrameTimings
+from openeqa.utils.openai_utils import (
+    call_openai_api,
+    prepare_openai_messages,
+    prepare_openai_vision_messages,
+    set_openai_key,
+)
+from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import RateLimiter, add_runner_args, run_baseline
+from openeqa.utils.selection_utils import FRAME_SELECTION_METHODS, select_frames
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dataset",
+        type=Path,
+        default="data/open-eqa-v0.json",
+        help="path to EQA dataset (default: data/open-eqa-v0.json)",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="gpt-4-0613",
+        help="OpenAI model answering from descriptions (default: gpt-4-0613)",
+    )
+    parser.add_argument(
+        "--describe-model",
+        type=str,
+        default="gpt-4-vision-preview",
+        help="OpenAI model describing frames (default: gpt-4-vision-preview)",
+    )
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        default="data/frames/",
+        help="path image frames (default: data/frames/)",
+    )
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=50,
+        help="frames described per episode (default: 50)",
+    )
+    parser.add_argument(
+        "--frames-per-request",
+        type=int,
+        default=10,
+        help="frames described by one request (default: 10)",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=512,
+        help="image size (default: 512)",
+    )
+    parser.add_argument(
+        "--frame-selection",
+        choices=[m for m in FRAME_SELECTION_METHODS if m != "retrieval"],
+        default="uniform",
+        help="how frames are selected from an episode (default: uniform)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="per-episode frame indices for frame selection (default: data/index)",
+    )
+    parser.add_argument(
+        "--description-directory",
+        type=Path,
+        default="data/descriptions",
+        help="stored scene descriptions (default: data/descriptions)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1234,
+        help="gpt seed (default: 1234)",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.2,
+        help="gpt temperature (default: 0.2)",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=128,
+        help="gpt maximum tokens (default: 128)",
+    )
+    parser.add_argument(
+        "--caption-tokens",
+        type=int,
+        default=96,
+        help="maximum tokens per frame description (default: 96)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="threads for loading and encoding frames (default: 8)",
+    )
+    parser.add_argument(
+        "--max-live-episodes",
+        type=int,
+        default=2,
+        help="episodes whose frames are held in memory at once (default: 2)",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="max API requests per minute across threads (default: none)",
+    )
+    parser.add_argument(
+        "--output-directory",
+        type=Path,
+        default="data/results",
+        help="output directory (default: data/results)",
+    )
+    add_runner_args(parser)
+    args = parser.parse_args()
+    args.output_directory.mkdir(parents=True, exist_ok=True)
+    args.output_path = args.output_directory / (
+        args.dataset.stem
+        + "-describe-{}-{}-{}.json".format(args.describe_model, args.model, args.seed)
+    )
+    return args
+
+
+def parse_output(output: str) -> str:
+    start_idx = output.find("A:")
+    if start_idx == -1:
+        return output.strip()
+    end_idx = output.find("\n", start_idx)
+    if end_idx == -1:
+        return output[start_idx:].replace("A:", "").strip()
+    return output[start_idx:end_idx].replace("A:", "").strip()
+
+
+def describe_frames(
+    image_paths: List[str],
+    openai_model: str,
+    image_size: int = 512,
+    openai_seed: int = 1234,
+    caption_tokens: int = 96,
+    openai_temperature: float = 0.2,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+) -> List[Optional[str]]:
+    """Returns one description per frame (None if it could not be parsed)."""
+    prompt = load_prompt("describe-frames").format(num_frames=len(image_paths))
+    messages = prepare_openai_vision_messages(
+        prefix=prompt,
+        image_paths=image_paths,
+        image_size=image_size,
+        num_workers=num_workers,
+        frame_timings=frame_timings,
+    )
+    output = call_openai_api(
+        messages=messages,
+        model=openai_model,
+        seed=openai_seed,
+        max_tokens=caption_tokens * len(image_paths),
+        temperature=openai_temperature,
+    )
+    return parse_numbered_answers(output, len(image_paths))
+
+
+def ask_question(
+    question: str,
+    description: dict,
+    openai_model: str = "gpt-4-0613",
+    openai_seed: int = 1234,
+    openai_max_tokens: int = 128,
+    openai_temperature: float = 0.2,
+) -> str:
+    prompt = load_prompt("describe-answer").format(
+        description=format_description(description), question=question
+    )
+    output = call_openai_api(
+        messages=prepare_openai_messages(prompt),
+        model=openai_model,
+        seed=openai_seed,
+        max_tokens=openai_max_tokens,
+        temperature=openai_temperature,
+    )
+    return parse_output(output)
+
+
+def main(args: argparse.Namespace):
+    # check for openai api key
+    assert "OPENAI_API_KEY" in os.environ
+    set_openai_key()
+
+    frame_timings = FrameTimings()
+    rate_limiter = RateLimiter(args.requests_per_minute)
+
+    # group pending questions by episode to describe each episode once
+    scheduler = EpisodeScheduler(
+        args.frames_directory, max_live_episodes=args.max_live_episodes
+    )
+
+    # descriptions are re-used by later runs with the same model and settings
+    version = get_description_version(
+        args.describe_model,
+        load_prompt("describe-frames"),
+        num_frames=args.num_frames,
+        frames_per_request=args.frames_per_request,
+        image_size=args.image_size,
+        frame_selection=args.frame_selection,
+        caption_tokens=args.caption_tokens,
+        seed=args.seed,
+    )
+    descriptions = DescriptionCache(args.description_directory, version)
+
+    def describe(paths: List[str]) -> dict:
+        captions = []
+        for start in range(0, len(paths), args.frames_per_request):
+            rate_limiter.wait()
+            captions += describe_frames(
+                paths[start : start + args.frames_per_request],
+                openai_model=args.describe_model,
+                image_size=args.image_size,
+                openai_seed=args.seed,
+                caption_tokens=args.caption_tokens,
+                num_workers=args.num_workers,
+                frame_timings=frame_timings,
+            )
+        if not any(captions):
+            # not stored, so a later question (or --retry-failed) tries again
+            raise ValueError("no frame description could be parsed")
+        return {"frames": [Path(p).name for p in paths], "captions": captions}
+
+    # process data
+    def answer(item: dict) -> dict:
+        episode = item["episode_history"]
+        with scheduler.hold(episode) as frames:
+            paths = select_frames(
+                frames,
+                args.num_frames,
+                method=args.frame_selection,
+                index_directory=args.index_directory / episode,
+                num_workers=args.num_workers,
+            )
+            description = descriptions.get_or_create(
+                episode, paths, lambda: describe(paths)
+            )
+
+        rate_limiter.wait()
+        answer = ask_question(
+            question=item["question"],
+            description=description,
+            openai_model=args.model,
+            openai_seed=args.seed,
+            openai_max_tokens=args.max_tokens,
+            openai_temperature=args.temperature,
+        )
+        return {"answer": answer}
+
+    try:
+        run_baseline(args, answer, schedule_fn=scheduler.schedule)
+    finally:
+        scheduler.close()
+    descriptions.print_stats()
+    frame_timings.print_stats()
+
+
+if __name__ == "__main__":
+    main(parse_args())
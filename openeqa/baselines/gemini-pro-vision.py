@@ -4,19 +4,33 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
+import functools
 import os
-import traceback
 from pathlib import Path
-from typing import List, Optional
-
-import cv2
-import numpy as np
-import tqdm
-from PIL import Image, PngImagePlugin
-
-from openeqa.utils.google_utils import call_google_api, set_google_key
+from typing import List, Optional, Union
+
+from openeqa.utils.batch_utils import format_numbered_questions
+from openeqa.utils.frame_utils import FrameCache, FrameTimings
+from openeqa.utils.google_utils import (
+    FrameAssetManager,
+    call_google_api,
+    prepare_google_vision_messages,
+    set_google_key,
+    stream_google_api,
+)
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    add_prefetch_args,
+    add_runner_args,
+)
+from openeqa.utils.sampling_utils import add_sampling_args, get_samples_path
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import add_streaming_args, is_answer_complete
+from openeqa.utils.vision_utils import (
+    VisionPipeline,
+    add_frame_args,
+    check_frame_args,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -46,10 +60,14 @@ def parse_args() -> argparse.Namespace:
         help="number of frames (default: 15)",
     )
     parser.add_argument(
-        "--image-size",
-        type=int,
-        default=512,
-        help="image size (default: 512)",
+        "--upload-frames",
+        action="store_true",
+        help="upload frames once and refer to them in requests (default: false)",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="max API requests per minute across threads (default: none)",
     )
     parser.add_argument(
         "--output-directory",
@@ -57,21 +75,18 @@ def parse_args() -> argparse.Namespace:
         default="data/results",
         help="output directory (default: data/results)",
     )
-    parser.add_argument(
-        "--force",
-        action="store_true",
-        help="continue running on API errors (default: false)",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
-    )
+    add_frame_args(parser)
+    add_runner_args(parser)
+    add_sampling_args(parser)
+    add_prefetch_args(parser)
+    add_streaming_args(parser)
     args = parser.parse_args()
+    check_frame_args(parser, args, "google")
     args.output_directory.mkdir(parents=True, exist_ok=True)
     args.output_path = args.output_directory / (
         args.dataset.stem + "-{}.json".format(args.model)
     )
+    args.output_path = get_samples_path(args.output_path, args.num_samples)
     return args
 
 
@@ -85,93 +100,120 @@ def parse_gemini_output(input: str, output: str) -> str:
     return output[start_idx:end_idx].replace("A:", "").strip()
 
 
+def prepare_messages(
+    question: Union[str, List[str]],
+    image_paths: List,
+    image_size: int = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
+    frame_assets: Optional[FrameAssetManager] = None,
+    abstain: bool = False,
+) -> List:
+    prompt = load_prompt("gemini-pro-vision")
+    prefix, suffix = prompt.split("User Query:")
+    if isinstance(question, list):
+        # ask several numbered questions about the same frames
+        multi_prompt = load_prompt("multi-question").format(num_questions=len(question))
+        prefix = prefix.rstrip("\n") + "\n" + multi_prompt + "\n"
+        question = format_numbered_questions(question)
+    suffix = "User Query:" + suffix.format(question=question)
+    if mosaic_size:
+        mosaic_prompt = load_prompt("mosaic").format(mosaic_size=mosaic_size)
+        prefix = prefix.rstrip("\n") + "\n" + mosaic_prompt + "\n"
+    if abstain:
+        prefix = prefix.rstrip("\n") + "\n" + load_prompt("cascade") + "\n"
+
+    return prepare_google_vision_messages(
+        prefix=prefix,
+        suffix=suffix,
+        image_paths=image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        frame_cache=frame_cache,
+        num_workers=num_workers,
+        frame_timings=frame_timings,
+        mosaic_size=mosaic_size,
+        frame_store=frame_store,
+        frame_assets=frame_assets,
+    )
+
+
 def ask_question(
-    frame_paths: List,
-    question: str,
-    image_size: int,
+    messages: List,
     google_model: str,
     google_key: Optional[str] = None,
-    force: bool = False,
+    raw: bool = False,
+    stream: bool = False,
+    latency: Optional[dict] = None,
 ) -> Optional[str]:
-    try:
-        set_google_key(key=google_key)
-
-        frames = [cv2.imread(p) for p in frame_paths]
-        size = max(frames[0].shape)
-        frames = [
-            cv2.resize(img, dsize=None, fx=image_size / size, fy=image_size / size)
-            for img in frames
-        ]
-        frames = [Image.fromarray(img) for img in frames]
-
-        prompt = load_prompt("gemini-pro-vision")
-        prefix, suffix = prompt.split("User Query:")
-        suffix = "User Query:" + suffix.format(question=question)
-
-        messages = []
-        messages += [prefix]
-        messages += frames
-        messages += [suffix]
-
+    set_google_key(key=google_key)
+    stop_sequences = ["User Query:"]
+    if stream:
+        # raw outputs (e.g., numbered answers) are read in full
+        output = stream_google_api(
+            message=messages,
+            model=google_model,
+            stop_sequences=stop_sequences,
+            stop_fn=None if raw else is_answer_complete,
+            latency=latency,
+        )
+    else:
         output = call_google_api(
             message=messages,
             model=google_model,
+            stop_sequences=stop_sequences,
         )
-        return parse_gemini_output(input, output)
-    except Exception as e:
-        if not force:
-            traceback.print_exc()
-            raise e
+    if raw:
+        return output  # parsed by the caller
+    return parse_gemini_output(input, output)
 
 
 def main(args: argparse.Namespace):
     # check for google api key
     assert "GOOGLE_API_KEY" in os.environ
 
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # extract scene paths
-        folder = args.frames_directory / item["episode_history"]
-        frames = sorted(folder.glob("*-rgb.png"))
-        indices = np.round(np.linspace(0, len(frames) - 1, args.num_frames)).astype(int)
-        paths = [str(frames[i]) for i in indices]
-
-        # generate answer
-        question = item["question"]
-        answer = ask_question(
-            frame_paths=paths,
-            question=question,
-            image_size=args.image_size,
+    frame_assets = None
+    if args.upload_frames:
+        set_google_key()  # frames are uploaded before the first request
+        frame_assets = FrameAssetManager(num_workers=args.num_workers)
+
+    def ask(
+        messages: List,
+        paths: List[str],
+        num_questions: int = 1,
+        raw: bool = False,
+        num_samples: int = 1,
+        latency: Optional[dict] = None,
+    ) -> Optional[str]:
+        return ask_question(
+            messages=messages,
             google_model=args.model,
-            force=args.force,
+            raw=raw,
+            stream=args.stream,
+            latency=latency,
         )
 
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+    pipeline = VisionPipeline(
+        args,
+        "google",
+        functools.partial(prepare_messages, frame_assets=frame_assets),
+        ask,
+    )
+    try:
+        pipeline.run()
+    finally:
+        if frame_assets is not None:
+            frame_assets.close()
+    if frame_assets is not None:
+        frame_assets.print_stats()
 
 
 if __name__ == "__main__":
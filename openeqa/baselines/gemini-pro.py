@@ -4,16 +4,32 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
 import os
-import traceback
 from pathlib import Path
 from typing import Optional
 
-import tqdm
-
-from openeqa.utils.google_utils import call_google_api, set_google_key
+from openeqa.utils.google_utils import (
+    call_google_api,
+    set_google_key,
+    stream_google_api,
+)
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    QuestionDeduplicator,
+    add_runner_args,
+    run_baseline,
+)
+from openeqa.utils.sampling_utils import (
+    add_sampling_args,
+    get_samples_path,
+    majority_vote,
+    sample_parallel,
+)
+from openeqa.utils.stream_utils import (
+    StreamStats,
+    add_streaming_args,
+    is_answer_complete,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -36,16 +52,15 @@ def parse_args() -> argparse.Namespace:
         default="data/results",
         help="output directory (default: data/results)",
     )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
-    )
+    add_runner_args(parser)
+    add_sampling_args(parser)
+    add_streaming_args(parser)
     args = parser.parse_args()
     args.output_directory.mkdir(parents=True, exist_ok=True)
     args.output_path = args.output_directory / (
         args.dataset.stem + "-{}.json".format(args.model)
     )
+    args.output_path = get_samples_path(args.output_path, args.num_samples)
     return args
 
 
@@ -63,57 +78,60 @@ def ask_question(
     question: str,
     google_key: Optional[str] = None,
     google_model: str = "gemini-pro",
+    stream: bool = False,
+    latency: Optional[dict] = None,
 ) -> Optional[str]:
-    try:
-        prompt = load_prompt("blind-llm")
-        set_google_key(key=google_key)
-        message = prompt.format(question=question)
+    prompt = load_prompt("blind-llm")
+    set_google_key(key=google_key)
+    message = prompt.format(question=question)
+    # the few-shot prompt continues with an explanation and a new question
+    stop_sequences = ["\nExplanation:", "\nQ:"]
+    if stream:
+        output = stream_google_api(
+            message=message,
+            model=google_model,
+            stop_sequences=stop_sequences,
+            stop_fn=is_answer_complete,
+            latency=latency,
+        )
+    else:
         output = call_google_api(
             message=message,
             model=google_model,
+            stop_sequences=stop_sequences,
         )
-        return parse_gemini_output(message, output)
-    except Exception as e:
-        traceback.print_exc()
-        raise e
+    return parse_gemini_output(message, output)
 
 
 def main(args: argparse.Namespace):
     # check for google api key
     assert "GOOGLE_API_KEY" in os.environ
-
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # generate answer
-        question = item["question"]
-        answer = ask_question(question=question, google_model=args.model)
-
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+    stream_stats = StreamStats()
+
+    def ask(item: dict, latency: Optional[dict] = None) -> Optional[str]:
+        latency = {} if latency is None else latency
+        answer = ask_question(
+            question=item["question"],
+            google_model=args.model,
+            stream=args.stream,
+            latency=latency,
+        )
+        stream_stats.add(latency)
+        return answer
+
+    def answer(item: dict) -> dict:
+        if args.num_samples > 1:
+            samples = sample_parallel(lambda: ask(item), args.num_samples)
+            return {"answer": majority_vote(samples), "samples": samples}
+        latency = {}
+        answer = ask(item, latency)
+        return {"answer": answer, **latency}
+
+    # identical questions get identical prompts, so answer each once
+    answer = QuestionDeduplicator(answer)
+    run_baseline(args, answer)
+    answer.print_stats()
+    stream_stats.print_stats()
 
 
 if __name__ == "__main__":
@@ -4,20 +4,32 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
 import os
-import traceback
 from pathlib import Path
-from typing import Optional
-
-import tqdm
+from typing import List, Optional, Union
 
 from openeqa.utils.openai_utils import (
     call_openai_api,
     prepare_openai_messages,
     set_openai_key,
+    stream_openai_api,
 )
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    QuestionDeduplicator,
+    add_runner_args,
+    run_baseline,
+)
+from openeqa.utils.sampling_utils import (
+    add_sampling_args,
+    get_samples_path,
+    majority_vote,
+)
+from openeqa.utils.stream_utils import (
+    StreamStats,
+    add_streaming_args,
+    is_answer_complete,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -58,21 +70,17 @@ def parse_args() -> argparse.Namespace:
         default="data/results",
         help="output directory (default: data/results)",
     )
-    parser.add_argument(
-        "--force",
-        action="store_true",
-        help="continue running on API errors (default: false)",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
-    )
+    add_runner_args(parser)
+    add_sampling_args(parser)
+    add_streaming_args(parser)
     args = parser.parse_args()
+    if args.stream and args.num_samples > 1:
+        parser.error("--stream cannot be used with --num-samples")
     args.output_directory.mkdir(parents=True, exist_ok=True)
     args.output_path = args.output_directory / (
         args.dataset.stem + "-{}-{}.json".format(args.model, args.seed)
     )
+    args.output_path = get_samples_path(args.output_path, args.num_samples)
     return args
 
 
@@ -86,6 +94,20 @@ def parse_output(output: str) -> str:
     return output[start_idx:end_idx].replace("A:", "").strip()
 
 
+def parse_samples(outputs: List[str]) -> List[str]:
+    """Parses each sample, dropping the ones without an answer line, and
+    raises only if none of them has one."""
+    samples = []
+    for output in outputs:
+        try:
+            samples.append(parse_output(output))
+        except ValueError:
+            print("WARNING: dropping unparsed sample: {}".format(output))
+    if not samples:
+        raise ValueError("Invalid output strings: {}".format(outputs))
+    return samples
+
+
 def ask_question(
     question: str,
     openai_key: Optional[str] = None,
@@ -93,69 +115,70 @@ def ask_question(
     openai_seed: int = 1234,
     openai_max_tokens: int = 128,
     openai_temperature: float = 0.2,
-    force: bool = False,
-) -> Optional[str]:
-    try:
-        prompt = load_prompt("blind-llm")
-        set_openai_key(key=openai_key)
-        messages = prepare_openai_messages(prompt.format(question=question))
-        output = call_openai_api(
+    openai_n: int = 1,
+    stream: bool = False,
+    latency: Optional[dict] = None,
+) -> Optional[Union[str, List[str]]]:
+    prompt = load_prompt("blind-llm")
+    set_openai_key(key=openai_key)
+    messages = prepare_openai_messages(prompt.format(question=question))
+    # the few-shot prompt continues with an explanation and a new question
+    stop = ["\nExplanation:", "\nQ:"]
+    if stream:
+        output = stream_openai_api(
             messages=messages,
             model=openai_model,
             seed=openai_seed,
             max_tokens=openai_max_tokens,
             temperature=openai_temperature,
+            stop=stop,
+            stop_fn=is_answer_complete,
+            latency=latency,
         )
         return parse_output(output)
-    except Exception as e:
-        if not force:
-            traceback.print_exc()
-            raise e
+    output = call_openai_api(
+        messages=messages,
+        model=openai_model,
+        seed=openai_seed,
+        max_tokens=openai_max_tokens,
+        temperature=openai_temperature,
+        n=openai_n,
+        stop=stop,
+    )
+    if openai_n > 1:
+        return parse_samples(output)
+    return parse_output(output)
 
 
 def main(args: argparse.Namespace):
     # check for openai api key
     assert "OPENAI_API_KEY" in os.environ
+    stream_stats = StreamStats()
 
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # generate answer
-        question = item["question"]
+    def answer(item: dict) -> dict:
+        latency = {}
         answer = ask_question(
-            question=question,
+            question=item["question"],
             openai_model=args.model,
             openai_seed=args.seed,
             openai_max_tokens=args.max_tokens,
             openai_temperature=args.temperature,
-            force=args.force,
+            openai_n=args.num_samples,
+            stream=args.stream,
+            latency=latency,
         )
-
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+        if args.num_samples > 1:
+            # all samples come from one request
+            samples = answer or []
+            return {"answer": majority_vote(samples), "samples": samples}
+        stream_stats.add(latency)
+        return {"answer": answer, **latency}
+
+    # identical questions get identical prompts, so answer each once
+    answer = QuestionDeduplicator(answer)
+    run_baseline(args, answer)
+    answer.print_stats()
+    stream_stats.print_stats()
 
 
 if __name__ == "__main__":
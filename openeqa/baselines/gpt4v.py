@@ -4,21 +4,29 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
 import os
-import traceback
 from pathlib import Path
-from typing import List, Optional
-
-import numpy as np
-import tqdm
+from typing import List, Optional, Union
 
+from openeqa.utils.batch_utils import format_numbered_questions
+from openeqa.utils.frame_utils import FrameCache, FrameTimings
 from openeqa.utils.openai_utils import (
     call_openai_api,
     prepare_openai_vision_messages,
     set_openai_key,
 )
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    add_prefetch_args,
+    add_runner_args,
+)
+from openeqa.utils.sampling_utils import add_sampling_args, get_samples_path
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.vision_utils import (
+    VisionPipeline,
+    add_frame_args,
+    check_frame_args,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -47,12 +55,6 @@ def parse_args() -> argparse.Namespace:
         default=50,
         help="num frames in gpt4v (default: 50)",
     )
-    parser.add_argument(
-        "--image-size",
-        type=int,
-        default=512,
-        help="image size (default: 512)",
-    )
     parser.add_argument(
         "--seed",
         type=int,
@@ -71,116 +73,122 @@ def parse_args() -> argparse.Namespace:
         default=128,
         help="gpt maximum tokens (default: 128)",
     )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="max API requests per minute across threads (default: none)",
+    )
     parser.add_argument(
         "--output-directory",
         type=Path,
         default="data/results",
         help="output directory (default: data/results)",
     )
-    parser.add_argument(
-        "--force",
-        action="store_true",
-        help="continue running on API errors (default: false)",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
-    )
+    add_frame_args(parser)
+    add_runner_args(parser)
+    add_sampling_args(parser)
+    add_prefetch_args(parser)
     args = parser.parse_args()
+    check_frame_args(parser, args, "openai")
     args.output_directory.mkdir(parents=True, exist_ok=True)
     args.output_path = args.output_directory / (
         args.dataset.stem + "-{}-{}.json".format(args.model, args.seed)
     )
+    args.output_path = get_samples_path(args.output_path, args.num_samples)
     return args
 
 
-def ask_question(
-    question: str,
+def prepare_messages(
+    question: Union[str, List[str]],
     image_paths: List,
     image_size: int = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
+    abstain: bool = False,
+) -> List:
+    prompt = load_prompt("gpt4v")
+    prefix, suffix = prompt.split("User Query:")
+    if isinstance(question, list):
+        # ask several numbered questions about the same frames
+        multi_prompt = load_prompt("multi-question").format(num_questions=len(question))
+        prefix = prefix.rstrip("\n") + "\n" + multi_prompt + "\n"
+        question = format_numbered_questions(question)
+    suffix = "User Query:" + suffix.format(question=question)
+    if mosaic_size:
+        mosaic_prompt = load_prompt("mosaic").format(mosaic_size=mosaic_size)
+        prefix = prefix.rstrip("\n") + "\n" + mosaic_prompt + "\n"
+    if abstain:
+        prefix = prefix.rstrip("\n") + "\n" + load_prompt("cascade") + "\n"
+
+    return prepare_openai_vision_messages(
+        prefix=prefix,
+        suffix=suffix,
+        image_paths=image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        frame_cache=frame_cache,
+        num_workers=num_workers,
+        frame_timings=frame_timings,
+        mosaic_size=mosaic_size,
+        frame_store=frame_store,
+    )
+
+
+def ask_question(
+    messages: List,
     openai_key: Optional[str] = None,
     openai_model: str = "gpt-4-vision-preview",
     openai_seed: int = 1234,
     openai_max_tokens: int = 128,
     openai_temperature: float = 0.2,
-    force: bool = False,
-) -> Optional[str]:
-    try:
-        set_openai_key(key=openai_key)
-
-        prompt = load_prompt("gpt4v")
-        prefix, suffix = prompt.split("User Query:")
-        suffix = "User Query:" + suffix.format(question=question)
-
-        messages = prepare_openai_vision_messages(
-            prefix=prefix, suffix=suffix, image_paths=image_paths, image_size=image_size
-        )
-        output = call_openai_api(
-            messages=messages,
-            model=openai_model,
-            seed=openai_seed,
-            max_tokens=openai_max_tokens,
-            temperature=openai_temperature,
-        )
-        return output
-    except Exception as e:
-        if not force:
-            traceback.print_exc()
-            raise e
+    openai_n: int = 1,
+) -> Optional[Union[str, List[str]]]:
+    set_openai_key(key=openai_key)
+    output = call_openai_api(
+        messages=messages,
+        model=openai_model,
+        seed=openai_seed,
+        max_tokens=openai_max_tokens,
+        temperature=openai_temperature,
+        n=openai_n,
+    )
+    return output
 
 
 def main(args: argparse.Namespace):
     # check for openai api key
     assert "OPENAI_API_KEY" in os.environ
 
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # extract scene paths
-        folder = args.frames_directory / item["episode_history"]
-        frames = sorted(folder.glob("*-rgb.png"))
-        indices = np.round(np.linspace(0, len(frames) - 1, args.num_frames)).astype(int)
-        paths = [str(frames[i]) for i in indices]
-
-        # generate answer
-        question = item["question"]
-        answer = ask_question(
-            question=question,
-            image_paths=paths,
-            image_size=args.image_size,
+    def ask(
+        messages: List,
+        paths: List[str],
+        num_questions: int = 1,
+        raw: bool = False,
+        num_samples: int = 1,
+        latency: Optional[dict] = None,
+    ) -> Optional[Union[str, List[str]]]:
+        return ask_question(
+            messages=messages,
             openai_model=args.model,
             openai_seed=args.seed,
-            openai_max_tokens=args.max_tokens,
+            openai_max_tokens=args.max_tokens * num_questions,
             openai_temperature=args.temperature,
-            force=args.force,
+            openai_n=num_samples,
         )
 
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+    # openai returns all samples of a question from one request
+    pipeline = VisionPipeline(
+        args, "openai", prepare_messages, ask, samples_per_request=True
+    )
+    pipeline.run()
 
 
 if __name__ == "__main__":
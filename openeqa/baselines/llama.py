@@ -4,14 +4,17 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
-import json
+import threading
 from pathlib import Path
 from typing import Optional
 
-import tqdm
-
 from openeqa.utils.llama_utils import LLaMARunner, enable_full_determinism
 from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.runner_utils import (
+    QuestionDeduplicator,
+    add_runner_args,
+    run_baseline,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -68,16 +71,7 @@ def parse_args() -> argparse.Namespace:
         default="data/results",
         help="output directory (default: data/results)",
     )
-    parser.add_argument(
-        "--force",
-        action="store_true",
-        help="continue running on API errors (default: false)",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="only process the first 5 questions",
-    )
+    add_runner_args(parser)
     args = parser.parse_args()
     enable_full_determinism(args.seed)
     if args.model_name is None:
@@ -109,10 +103,6 @@ def ask_question(
 
 
 def main(args: argparse.Namespace):
-    # load dataset
-    dataset = json.load(args.dataset.open("r"))
-    print("found {:,} questions".format(len(dataset)))
-
     # load model
     model = LLaMARunner(
         args.model_path,
@@ -120,34 +110,16 @@ def main(args: argparse.Namespace):
         use_fast_kernels=args.use_fast_kernels,
     )
 
-    # load results
-    results = []
-    if args.output_path.exists():
-        results = json.load(args.output_path.open())
-        print("found {:,} existing results".format(len(results)))
-    completed = [item["question_id"] for item in results]
-
-    # process data
-    for idx, item in enumerate(tqdm.tqdm(dataset)):
-        if args.dry_run and idx >= 5:
-            break
-
-        # skip completed questions
-        question_id = item["question_id"]
-        if question_id in completed:
-            continue  # skip existing
-
-        # generate answer
-        question = item["question"]
-        answer = ask_question(model=model, question=question)
-
-        # store results
-        results.append({"question_id": question_id, "answer": answer})
-        json.dump(results, args.output_path.open("w"), indent=2)
-
-    # save at end (redundant)
-    json.dump(results, args.output_path.open("w"), indent=2)
-    print("saving {:,} answers".format(len(results)))
+    lock = threading.Lock()
+
+    def answer(item: dict) -> dict:
+        with lock:  # one generation at a time on the gpu
+            return {"answer": ask_question(model=model, question=item["question"])}
+
+    # identical questions get identical prompts, so answer each once
+    answer = QuestionDeduplicator(answer)
+    run_baseline(args, answer)
+    answer.print_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from openeqa.utils.episode_utils import EpisodeScheduler
+from openeqa.utils.frame_utils import FrameCache
+from openeqa.utils.openai_utils import (
+    call_openai_api,
+    prepare_openai_messages,
+    prepare_openai_vision_messages,
+    set_openai_key,
+)
+from openeqa.utils.prompt_utils import load_prompt
+from openeqa.utils.routing_utils import (
+    RouteStats,
+    get_route,
+    get_route_name,
+    load_policy,
+)
+from openeqa.utils.runner_utils import RateLimiter, add_runner_args, run_baseline
+from openeqa.utils.selection_utils import select_frames
+
+DEFAULT_MODELS = {"blind": "gpt-4-0613", "vision": "gpt-4-vision-preview"}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "policy",
+        type=Path,
+        help="routing policy (see openeqa/utils/routing_utils.py)",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=Path,
+        default="data/open-eqa-v0.json",
+        help="path to EQA dataset (default: data/open-eqa-v0.json)",
+    )
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        default="data/frames/",
+        help="path image frames (default: data/frames/)",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=512,
+        help="image size of vision routes without one (default: 512)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="per-episode frame indices for frame selection (default: data/index)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1234,
+        help="gpt seed (default: 1234)",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.2,
+        help="gpt temperature (default: 0.2)",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=128,
+        help="gpt maximum tokens (default: 128)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="threads for loading and encoding frames (default: 8)",
+    )
+    parser.add_argument(
+        "--max-live-episodes",
+        type=int,
+        default=2,
+        help="episodes whose frames are held in memory at once (default: 2)",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="max API requests per minute across threads (default: none)",
+    )
+    parser.add_argument(
+        "--output-directory",
+        type=Path,
+        default="data/results",
+        help="output directory (default: data/results)",
+    )
+    add_runner_args(parser)
+    args = parser.parse_args()
+    args.output_directory.mkdir(parents=True, exist_ok=True)
+    args.output_path = args.output_directory / (
+        args.dataset.stem + "-router-{}-{}.json".format(args.policy.stem, args.seed)
+    )
+    return args
+
+
+def parse_output(output: str) -> str:
+    start_idx = output.find("A:")
+    if start_idx == -1:
+        return output.strip()
+    end_idx = output.find("\n", start_idx)
+    if end_idx == -1:
+        return output[start_idx:].replace("A:", "").strip()
+    return output[start_idx:end_idx].replace("A:", "").strip()
+
+
+def main(args: argparse.Namespace):
+    policy = load_policy(args.policy)
+    routes = [policy["default"]] + list(policy.get("categories", {}).values())
+    if any(route["backend"] != "llama" for route in routes):
+        # check for openai api key
+        assert "OPENAI_API_KEY" in os.environ
+        set_openai_key()
+
+    frame_cache = FrameCache()
+    rate_limiter = RateLimiter(args.requests_per_minute)
+    route_stats = RouteStats()
+
+    # only questions routed to a vision model load their episode
+    scheduler = EpisodeScheduler(
+        args.frames_directory,
+        frame_cache=frame_cache,
+        max_live_episodes=args.max_live_episodes,
+    )
+
+    def schedule(items: List[dict]) -> List[dict]:
+        is_vision = [
+            get_route(policy, item["category"])["backend"] == "vision" for item in items
+        ]
+        vision_items = [item for item, v in zip(items, is_vision) if v]
+        text_items = [item for item, v in zip(items, is_vision) if not v]
+        return text_items + scheduler.schedule(vision_items)
+
+    # llama weights are loaded on first use
+    llama_models: Dict[str, object] = {}
+    llama_lock = threading.Lock()
+
+    def get_llama(model: str):
+        from openeqa.utils.llama_utils import LLaMARunner
+
+        with llama_lock:
+            if model not in llama_models:
+                llama_models[model] = LLaMARunner(model)
+            return llama_models[model]
+
+    def get_messages(item: dict, route: dict) -> list:
+        if route["backend"] != "vision":
+            prompt = load_prompt("blind-llm").format(question=item["question"])
+            return prepare_openai_messages(prompt)
+
+        with scheduler.hold(item["episode_history"]) as frames:
+            paths = select_frames(
+                frames,
+                route.get("num_frames", 50),
+                method=route.get("frame_selection", "uniform"),
+                index_directory=args.index_directory / item["episode_history"],
+                num_workers=args.num_workers,
+            )
+            prompt = load_prompt("gpt4v")
+            prefix, suffix = prompt.split("User Query:")
+            suffix = "User Query:" + suffix.format(question=item["question"])
+            return prepare_openai_vision_messages(
+                prefix=prefix,
+                suffix=suffix,
+                image_paths=paths,
+                image_size=route.get("image_size", args.image_size),
+                frame_cache=frame_cache,
+                num_workers=args.num_workers,
+            )
+
+    # process data
+    def answer(item: dict) -> dict:
+        route = get_route(policy, item["category"])
+        usage = {}
+        # latency covers preparing and answering the question, excluding
+        # loading llama weights and waiting for the gpu or the rate limit
+        if route["backend"] == "llama":
+            model = get_llama(route["model"])
+            start_time = time.perf_counter()
+            prompt = load_prompt("blind-llm").format(question=item["question"])
+            wait_time = time.perf_counter()
+            with llama_lock:  # one generation at a time on the gpu
+                wait_time = time.perf_counter() - wait_time
+                output = model(
+                    prompt, max_new_tokens=args.max_tokens, temperature=args.temperature
+                )
+        else:
+            start_time = time.perf_counter()
+            messages = get_messages(item, route)
+            wait_time = time.perf_counter()
+            rate_limiter.wait()
+            wait_time = time.perf_counter() - wait_time
+            output = call_openai_api(
+                messages=messages,
+                model=route.get("model", DEFAULT_MODELS[route["backend"]]),
+                seed=args.seed,
+                max_tokens=args.max_tokens,
+                temperature=args.temperature,
+                usage=usage,
+            )
+        seconds = time.perf_counter() - start_time - wait_time
+        route_stats.add(item["category"], route, seconds, usage)
+        return {"answer": parse_output(output), "route": get_route_name(route)}
+
+    try:
+        run_baseline(args, answer, schedule_fn=schedule)
+    finally:
+        scheduler.close()
+    route_stats.print_stats()
+
+
+if __name__ == "__main__":
+    main(parse_args())
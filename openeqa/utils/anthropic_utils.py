@@ -3,14 +3,24 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import base64
+import contextlib
 import os
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
 
-import cv2
 from anthropic import Anthropic
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from openeqa.utils.frame_utils import (
+    FrameCache,
+    FrameTimings,
+    get_frame_payloads,
+    get_mime_type,
+)
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import read_stream
+
 
 def prepare_anthropic_messages(content) -> List[Dict[str, str]]:
     return [{"role": "user", "content": content}]
@@ -21,34 +31,154 @@ def prepare_anthropic_vision_messages(
     suffix: Optional[str] = None,
     image_paths: Optional[List[str]] = None,
     image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
+    cache_images: bool = False,
 ):
+    """Returns a user message with the prefix, images, and suffix.
+
+    With cache_images, the images are moved to the start of the message and
+    marked with cache_control, so that questions about the same frames can
+    re-use the cached image prefix."""
     if image_paths is None:
         image_paths = []
 
     content = []
-    if prefix:
+    if prefix and not cache_images:
         content.append({"text": prefix, "type": "text"})
 
-    for path in image_paths:
-        frame = cv2.imread(path)
-        if image_size:
-            factor = image_size / max(frame.shape[:2])
-            frame = cv2.resize(frame, dsize=None, fx=factor, fy=factor)
-        _, buffer = cv2.imencode(".png", frame)
-        frame = base64.b64encode(buffer).decode("utf-8")
+    mime_type = get_mime_type(image_format)
+    frames = get_frame_payloads(
+        image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        cache=frame_cache,
+        num_workers=num_workers,
+        timings=frame_timings,
+        mosaic_size=mosaic_size,
+        store=frame_store,
+    )
+    for frame in frames:
         content.append(
             {
-                "source": {"data": frame, "media_type": "image/png", "type": "base64"},
+                "source": {"data": frame, "media_type": mime_type, "type": "base64"},
                 "type": "image",
             }
         )
+    if cache_images and frames:
+        content[-1]["cache_control"] = {"type": "ephemeral"}
 
+    if prefix and cache_images:
+        content.append({"text": prefix, "type": "text"})
     if suffix:
         content.append({"text": suffix, "type": "text"})
 
     return [{"role": "user", "content": content}]
 
 
+class AnthropicUsage:
+    """Token counts reported by the API, summed over requests."""
+
+    # input token price multipliers for cache writes and reads
+    CACHE_WRITE_COST = 1.25
+    CACHE_READ_COST = 0.1
+
+    def __init__(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage) -> None:
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += usage.input_tokens
+            self.cache_creation_input_tokens += (
+                getattr(usage, "cache_creation_input_tokens", None) or 0
+            )
+            self.cache_read_input_tokens += (
+                getattr(usage, "cache_read_input_tokens", None) or 0
+            )
+            self.output_tokens += usage.output_tokens
+
+    def print_stats(self) -> None:
+        if self.requests == 0:
+            return
+        total = (
+            self.input_tokens
+            + self.cache_creation_input_tokens
+            + self.cache_read_input_tokens
+        )
+        billed = (
+            self.input_tokens
+            + self.CACHE_WRITE_COST * self.cache_creation_input_tokens
+            + self.CACHE_READ_COST * self.cache_read_input_tokens
+        )
+        print(
+            "anthropic usage: {:,} requests, {:,} input tokens ({:,} cache writes, "
+            "{:,} cache reads), {:,} output tokens".format(
+                self.requests,
+                total,
+                self.cache_creation_input_tokens,
+                self.cache_read_input_tokens,
+                self.output_tokens,
+            )
+        )
+        if self.cache_creation_input_tokens or self.cache_read_input_tokens:
+            print(
+                "prompt cache: input billed as {:,.0f} tokens "
+                "({:.1f}% of uncached)".format(billed, 100.0 * billed / total)
+            )
+
+
+class PromptCacheGate:
+    """Holds back requests with the same cacheable prefix until the first one
+    has succeeded, so that concurrent questions read its cache entry instead
+    of each writing their own. If the first request fails, no entry was
+    written, so one of the waiting requests is sent next in its place."""
+
+    def __init__(self):
+        self._events: Dict[Hashable, threading.Event] = {}
+        self._cached = set()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def hold(self, key: Hashable):
+        while True:
+            with self._lock:
+                first = False
+                if key in self._cached:
+                    break
+                event = self._events.get(key)
+                if event is None:
+                    event = self._events[key] = threading.Event()
+                    first = True
+                    break
+            event.wait()
+
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            if first:
+                with self._lock:
+                    if succeeded:
+                        self._cached.add(key)
+                    del self._events[key]
+                event.set()
+
+
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
 def call_anthropic_api(
     messages: List[Dict[str, str]],
@@ -56,6 +186,7 @@ def call_anthropic_api(
     max_tokens: int = 32,
     temperature: float = 0.2,
     stop_sequences: Optional[List[str]] = None,
+    usage: Optional[AnthropicUsage] = None,
 ):
     client = Anthropic()
     message = client.messages.create(
@@ -65,10 +196,43 @@ def call_anthropic_api(
         stop_sequences=stop_sequences,
         temperature=temperature,
     )
+    if usage is not None:
+        usage.add(message.usage)
     assert len(message.content) == 1
     return message.content[0].text
 
 
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+def stream_anthropic_api(
+    messages: List[Dict[str, str]],
+    model: str = "claude-3-opus-20240229",
+    max_tokens: int = 32,
+    temperature: float = 0.2,
+    stop_sequences: Optional[List[str]] = None,
+    usage: Optional[AnthropicUsage] = None,
+    stop_fn: Optional[Callable[[str], bool]] = None,
+    latency: Optional[dict] = None,
+) -> str:
+    """Like call_anthropic_api, but streams the response and closes the
+    stream once stop_fn(text) is True (see read_stream)."""
+    client = Anthropic()
+    start_time = time.perf_counter()
+    with client.messages.stream(
+        max_tokens=max_tokens,
+        messages=messages,
+        model=model,
+        stop_sequences=stop_sequences,
+        temperature=temperature,
+    ) as stream:
+        text = read_stream(
+            stream.text_stream, start_time, stop_fn=stop_fn, latency=latency
+        )
+        if usage is not None:
+            # output tokens are only counted up to where the stream was closed
+            usage.add(stream.current_message_snapshot.usage)
+    return text
+
+
 if __name__ == "__main__":
     assert "ANTHROPIC_API_KEY" in os.environ
 
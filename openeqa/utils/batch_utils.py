@@ -0,0 +1,117 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import re
+import threading
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from openeqa.utils.episode_utils import group_by_episode
+
+# e.g. "1. A: red", "2) blue", "**3.** green", "Q4: yes"
+NUMBERED_ANSWER_PATTERN = re.compile(
+    r"^\s*[*_#]*\s*(?:Q(?:uestion)?\s*)?(\d+)\s*[*_]*\s*[.):\-]\s*[*_]*\s*"
+    r"(?:A(?:nswer)?\s*:\s*)?(.*?)\s*$",
+    re.IGNORECASE,
+)
+
+
+def format_numbered_questions(questions: List[str]) -> str:
+    return "\n".join("{}. {}".format(i + 1, q) for i, q in enumerate(questions))
+
+
+def parse_numbered_answers(
+    output: Optional[str], num_questions: int
+) -> List[Optional[str]]:
+    """Parses one "<number>. A: <answer>" line per question. Lines that do
+    not start with a number continue the previous answer. Returns None for
+    questions without a (non-empty) answer."""
+    answers: List[Optional[str]] = [None] * num_questions
+    if output is None:
+        return answers
+
+    current = None
+    for line in output.splitlines():
+        match = NUMBERED_ANSWER_PATTERN.match(line)
+        if match:
+            current = int(match.group(1)) - 1
+            if not 0 <= current < num_questions or answers[current] is not None:
+                current = None  # keep the first answer to a question
+                continue
+            answers[current] = match.group(2)
+        elif current is not None and line.strip():
+            answers[current] = (answers[current] + " " + line.strip()).strip()
+    return [(a or "").strip("*_ ") or None for a in answers]
+
+
+class QuestionBatcher:
+    """Answers up to batch_size questions of the same episode with a single
+    request, so that they share one set of frames.
+
+    Dispatch questions in the order returned by schedule(). get(item, ask_fn)
+    sends the request of the item's batch the first time it is called, where
+    ask_fn(items) returns one answer (or None) per item, and returns the
+    item's answer; other questions of the batch wait for that request.
+    Questions answered with None should fall back to single requests.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = max(1, batch_size)
+        self._batches: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_questions = 0
+        self.num_fallbacks = 0
+
+    def schedule(self, items: List[dict]) -> List[dict]:
+        """Splits each episode's questions into batches and returns items in
+        batch order."""
+        scheduled = []
+        for episode_items in group_by_episode(items).values():
+            for start in range(0, len(episode_items), self.batch_size):
+                batch = {
+                    "items": episode_items[start : start + self.batch_size],
+                    "lock": threading.Lock(),
+                    "answers": None,
+                }
+                for item in batch["items"]:
+                    self._batches[item["question_id"]] = batch
+                scheduled.extend(batch["items"])
+        return scheduled
+
+    def get_batch(self, item: dict) -> List[dict]:
+        return self._batches[item["question_id"]]["items"]
+
+    def get(
+        self,
+        item: dict,
+        ask_fn: Callable[[List[dict]], List[Optional[str]]],
+    ) -> Optional[str]:
+        batch = self._batches[item["question_id"]]
+        with batch["lock"]:
+            if batch["answers"] is None:
+                try:
+                    batch["answers"] = ask_fn(batch["items"])
+                except Exception:
+                    traceback.print_exc()
+                    batch["answers"] = [None] * len(batch["items"])
+                with self._lock:
+                    self.num_requests += 1
+        answer = batch["answers"][batch["items"].index(item)]
+        with self._lock:
+            self.num_questions += 1
+            self.num_fallbacks += answer is None
+            self._batches.pop(item["question_id"])
+        return answer
+
+    def print_stats(self) -> None:
+        if self.num_questions == 0:
+            return
+        print(
+            "multi-question: {:,} questions in {:,} requests, {:,} fell back "
+            "to single-question requests".format(
+                self.num_questions, self.num_requests, self.num_fallbacks
+            )
+        )
@@ -0,0 +1,117 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import re
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from openeqa.utils.decode_utils import get_frame_shape
+from openeqa.utils.sizing_utils import get_request_image_tokens
+
+ABSTAIN_ANSWERS = {"i don't know", "i do not know", "unknown", "unsure"}
+
+
+def parse_cascade_output(output: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """Parses an "A: <answer>" / "Confidence: <1-5>" response. Returns None
+    as the answer if the model abstained (or the output is missing)."""
+    if output is None:
+        return None, None
+
+    confidence = None
+    match = re.search(r"Confidence:\s*([1-5])", output)
+    if match:
+        confidence = int(match.group(1))
+        output = output[: match.start()]
+
+    start_idx = output.find("A:")
+    answer = output[start_idx + 2 :] if start_idx >= 0 else output
+    answer = answer.strip().split("\n")[0].strip()
+    if not answer or answer.lower().rstrip(".") in ABSTAIN_ANSWERS:
+        return None, confidence
+    return answer, confidence
+
+
+def run_cascade(
+    ask_fn: Callable[[List[str], bool], Optional[str]],
+    cascade_paths: List[str],
+    paths: List[str],
+    min_confidence: int = 4,
+) -> Tuple[Optional[str], List[List[str]]]:
+    """Asks with cascade_paths first, using a prompt that lets the model
+    abstain, and re-asks with the full set of paths only if the model
+    abstains or reports a confidence below min_confidence.
+
+    ask_fn(paths, abstain) returns the raw output when abstain is True and
+    the final answer otherwise. Returns the answer and the frame paths of
+    every request that was sent.
+    """
+    output = ask_fn(cascade_paths, True)
+    answer, confidence = parse_cascade_output(output)
+    if answer is not None and confidence is not None and confidence >= min_confidence:
+        return answer, [cascade_paths]
+    return ask_fn(paths, False), [cascade_paths, paths]
+
+
+class CascadeStats:
+    """Tracks frames and billed image tokens per question."""
+
+    def __init__(
+        self,
+        provider: str,
+        image_size: int = 512,
+        token_budget: Optional[int] = None,
+        mosaic_size: Optional[int] = None,
+    ):
+        self.provider = provider
+        self.image_size = image_size
+        self.token_budget = token_budget
+        self.mosaic_size = mosaic_size
+        self.num_questions = 0
+        self.num_escalated = 0
+        self.num_frames = 0
+        self.num_tokens = 0
+        self.num_full_tokens = 0
+        self._lock = threading.Lock()
+
+    def get_tokens(self, paths: List[str]) -> int:
+        return get_request_image_tokens(
+            self.provider,
+            get_frame_shape(paths[0]),
+            len(paths),
+            image_size=self.image_size,
+            token_budget=self.token_budget,
+            mosaic_size=self.mosaic_size,
+        )
+
+    def add(self, requests: List[List[str]], paths: List[str]) -> dict:
+        """Records the requests sent for one question, where paths is the
+        full frame set, and returns per-question stats to store."""
+        num_frames = sum(len(r) for r in requests)
+        num_tokens = sum(self.get_tokens(r) for r in requests)
+        num_full_tokens = self.get_tokens(paths)
+        with self._lock:
+            self.num_questions += 1
+            self.num_escalated += len(requests) > 1
+            self.num_frames += num_frames
+            self.num_tokens += num_tokens
+            self.num_full_tokens += num_full_tokens
+        return {
+            "cascade_stage": len(requests),
+            "num_frames": num_frames,
+            "image_tokens": num_tokens,
+        }
+
+    def print_stats(self) -> None:
+        if self.num_questions == 0:
+            return
+        print(
+            "cascade: {:.1f}% escalated, {:.1f} frames and {:,.0f} image tokens "
+            "per question ({:.1f}% of always using the full frame budget)".format(
+                100.0 * self.num_escalated / self.num_questions,
+                self.num_frames / self.num_questions,
+                self.num_tokens / self.num_questions,
+                100.0 * self.num_tokens / max(1, self.num_full_tokens),
+            )
+        )
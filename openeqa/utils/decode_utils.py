@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Frame decoding helpers shared by the frame cache (frame_utils) and the
+packed frame store (store_utils), which must not import each other.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+REDUCED_DECODE_SUFFIXES = (".jpg", ".jpeg")
+
+
+class FrameTimings:
+    """Thread-safe accumulator of per-stage frame preprocessing times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.counts[stage] += 1
+
+    def print_stats(self) -> None:
+        stages = [
+            "{} {:.1f} ms".format(
+                stage, 1000.0 * self.seconds[stage] / self.counts[stage]
+            )
+            for stage in self.seconds
+        ]
+        print("frame timings (mean per call): {}".format(", ".join(stages)))
+
+
+def measure(timings: Optional[FrameTimings], stage: str):
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.measure(stage)
+
+
+def get_frame_shape(path: str) -> Tuple[int, int]:
+    with Image.open(path) as image:  # only reads the header
+        width, height = image.size
+    return height, width
+
+
+def get_frame_mtimes(paths: List[Union[str, Path]]) -> np.ndarray:
+    return np.array([os.stat(p).st_mtime_ns for p in paths], dtype=np.int64)
+
+
+def get_reduced_decode_flag(shape: Tuple[int, int], image_size: int) -> int:
+    """Returns the most reduced imread flag that still decodes at least
+    image_size pixels along the longest side."""
+    for scale, flag in REDUCED_DECODE_FLAGS:
+        if max(shape) // scale >= image_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_frame(
+    path: str,
+    image_size: Optional[int] = 512,
+    timings: Optional[FrameTimings] = None,
+    reduced_decode: bool = True,
+) -> np.ndarray:
+    """Decodes a frame and resizes it so that its longest side is image_size
+    (kept at full resolution if image_size is None).
+
+    With reduced_decode, JPEG frames are decoded at a reduced resolution
+    (native libjpeg scaling) before the resize. Other formats are always
+    decoded at full resolution: OpenCV would decode them fully and then
+    subsample, which is no faster and less accurate.
+    """
+    flag = cv2.IMREAD_COLOR
+    if (
+        image_size
+        and reduced_decode
+        and Path(path).suffix.lower() in REDUCED_DECODE_SUFFIXES
+    ):
+        shape = get_frame_shape(path)
+        flag = get_reduced_decode_flag(shape, image_size)
+
+    with measure(timings, "decode"):
+        frame = cv2.imread(path, flag)
+    if frame is None:
+        raise ValueError("could not read frame: {}".format(path))
+
+    if image_size and flag != cv2.IMREAD_COLOR:
+        # match the output size of a full-resolution decode and resize
+        factor = image_size / max(shape)
+        dsize = (round(shape[1] * factor), round(shape[0] * factor))
+        with measure(timings, "resize"):
+            frame = cv2.resize(frame, dsize=dsize, interpolation=cv2.INTER_AREA)
+    elif image_size:
+        with measure(timings, "resize"):
+            factor = image_size / max(frame.shape[:2])
+            frame = cv2.resize(frame, dsize=None, fx=factor, fy=factor)
+    return frame
+
+
+_executors: Dict[int, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def map_frames(fn: Callable, items: list, num_workers: Optional[int] = None) -> list:
+    """Applies fn to every item, fanning out over a shared thread pool when
+    num_workers > 1. OpenCV releases the GIL while decoding, resizing, and
+    encoding, so threads scale with cores. Results keep the input order."""
+    if not num_workers or num_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with _executors_lock:
+        if num_workers not in _executors:
+            _executors[num_workers] = ThreadPoolExecutor(
+                max_workers=num_workers, thread_name_prefix="frames"
+            )
+        executor = _executors[num_workers]
+    return list(executor.map(fn, items))
@@ -0,0 +1,90 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+
+# bump when the format of stored descriptions changes
+DESCRIPTION_VERSION = 1
+
+
+def get_description_version(model: str, prompt: str, **settings) -> str:
+    """Returns a name for descriptions built by model with prompt and the
+    given settings (e.g., frame count and size)."""
+    settings = dict(settings, version=DESCRIPTION_VERSION, prompt=prompt)
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    return "{}-{}".format(model.replace("/", "-"), digest[:8])
+
+
+def get_frames_digest(frames: List[Union[str, Path]]) -> str:
+    """Returns a short hash of the names of the described frames."""
+    names = [Path(f).name for f in frames]
+    return hashlib.sha1(json.dumps(names).encode()).hexdigest()[:8]
+
+
+def format_description(description: dict) -> str:
+    return "\n".join(
+        "Frame {}: {}".format(i + 1, caption)
+        for i, caption in enumerate(description["captions"])
+        if caption
+    )
+
+
+class DescriptionCache:
+    """Scene descriptions stored as <directory>/<version>/<episode>-<frames>.json,
+    where <frames> hashes the names of the described frames.
+
+    Descriptions of different models, settings, or frames are stored under
+    different paths, so changing any of them builds new descriptions instead
+    of re-using stale ones. get_or_create describes each episode once, even if several
+    of its questions ask for it at the same time.
+    """
+
+    def __init__(self, directory: Union[str, Path], version: str):
+        self.directory = Path(directory) / version
+        self.version = version
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.num_created = 0
+        self.num_reused = 0
+
+    def get_path(self, episode: str, frames: List[Union[str, Path]]) -> Path:
+        return self.directory / "{}-{}.json".format(episode, get_frames_digest(frames))
+
+    def get_or_create(
+        self,
+        episode: str,
+        frames: List[Union[str, Path]],
+        create_fn: Callable[[], dict],
+    ) -> dict:
+        with self._lock:
+            lock = self._locks.setdefault(episode, threading.Lock())
+        with lock:
+            path = self.get_path(episode, frames)
+            if path.exists():
+                with self._lock:
+                    self.num_reused += 1
+                return json.load(path.open("r"))
+
+            description = dict(create_fn(), version=self.version)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            json.dump(description, tmp_path.open("w"), indent=2)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self.num_created += 1
+            return description
+
+    def print_stats(self) -> None:
+        print(
+            "descriptions: {:,} episodes described, {:,} questions used a "
+            "stored description ({})".format(
+                self.num_created, self.num_reused, self.directory
+            )
+        )
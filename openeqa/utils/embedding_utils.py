@@ -0,0 +1,247 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import abc
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Type, Union
+
+import cv2
+import numpy as np
+import tqdm
+
+from openeqa.utils.decode_utils import decode_frame, get_frame_mtimes
+
+DEFAULT_EMBEDDING_MODEL = "openai/clip-vit-base-patch32"
+
+_embedding_cache: Dict[str, np.ndarray] = {}
+_embedding_locks: Dict[str, threading.Lock] = {}
+_embedding_cache_lock = threading.Lock()
+
+
+class EmbeddingBackend(abc.ABC):
+    """Embeds frames and text into a shared space (rows are L2-normalized).
+
+    Backends run on the CPU so that indices can be built on the extraction
+    machines; new backends are added to EMBEDDING_BACKENDS.
+    """
+
+    name: str = ""
+
+    @abc.abstractmethod
+    def embed_images(self, frames: List[np.ndarray]) -> np.ndarray:
+        pass
+
+    @abc.abstractmethod
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        pass
+
+
+class CLIPBackend(EmbeddingBackend):
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL, device: str = "cpu"):
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+
+        self.torch = torch
+        self.device = device
+        self.model = CLIPModel.from_pretrained(model).to(device).eval()
+        self.processor = CLIPProcessor.from_pretrained(model)
+        self.name = "clip-" + model.strip("/").replace("/", "--")
+
+    def _normalize(self, features) -> np.ndarray:
+        features = features / features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy().astype(np.float32)
+
+    def embed_images(self, frames: List[np.ndarray]) -> np.ndarray:
+        images = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames]
+        batch = self.processor(images=images, return_tensors="pt").to(self.device)
+        with self.torch.no_grad():
+            return self._normalize(self.model.get_image_features(**batch))
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        batch = self.processor(
+            text=texts, padding=True, truncation=True, return_tensors="pt"
+        ).to(self.device)
+        with self.torch.no_grad():
+            return self._normalize(self.model.get_text_features(**batch))
+
+
+EMBEDDING_BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    "clip": CLIPBackend,
+}
+
+
+def get_embedding_backend(
+    name: str = "clip", model: Optional[str] = None, **kwargs
+) -> EmbeddingBackend:
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError("invalid embedding backend: {}".format(name))
+    if model is not None:
+        kwargs["model"] = model
+    return EMBEDDING_BACKENDS[name](**kwargs)
+
+
+def get_embedding_index_paths(index_directory: Path, backend: EmbeddingBackend):
+    stem = "frame-embeddings-{}".format(backend.name)
+    return index_directory / (stem + ".npy"), index_directory / (stem + ".json")
+
+
+def build_embedding_index(
+    frames: List[Union[str, Path]],
+    index_directory: Optional[Path],
+    backend: EmbeddingBackend,
+    image_size: int = 224,
+    batch_size: int = 32,
+) -> np.ndarray:
+    """Embeds every frame of an episode and writes an (N, D) float32 matrix
+    (<index_directory>/frame-embeddings-<backend>.npy) plus the names and
+    modification times of the frames it covers. Nothing is written if index_directory is None.
+    """
+    frames = [Path(f) for f in frames]
+    embeddings = []
+    for start in range(0, len(frames), batch_size):
+        batch = [
+            decode_frame(str(f), image_size=image_size)
+            for f in frames[start : start + batch_size]
+        ]
+        embeddings.append(backend.embed_images(batch))
+    embeddings = np.concatenate(embeddings, axis=0)
+    if index_directory is None:
+        return embeddings
+
+    index_directory = Path(index_directory)
+    index_directory.mkdir(parents=True, exist_ok=True)
+    matrix_path, names_path = get_embedding_index_paths(index_directory, backend)
+    # write then rename, so readers never see a partial index; the frame
+    # list is written last as it marks the matrix as valid
+    suffix = ".tmp{}".format(threading.get_ident())
+    tmp_path = matrix_path.with_suffix(suffix)
+    with tmp_path.open("wb") as f:
+        np.save(f, embeddings)
+    os.replace(tmp_path, matrix_path)
+    tmp_path = names_path.with_suffix(suffix)
+    names = {
+        "names": [f.name for f in frames],
+        "mtimes": get_frame_mtimes(frames).tolist(),
+    }
+    json.dump(names, tmp_path.open("w"))
+    os.replace(tmp_path, names_path)
+    return embeddings
+
+
+def load_embedding_index(
+    frames: List[Union[str, Path]],
+    index_directory: Optional[Path],
+    backend: EmbeddingBackend,
+) -> np.ndarray:
+    """Returns a memory-mapped (N, D) embedding matrix for the frames,
+    building the index first if it is missing or its frame list or
+    modification times changed. Each episode's index is checked (or built)
+    once; in-memory entries are trusted for the lifetime of the process."""
+    if index_directory is None:
+        return build_embedding_index(frames, None, backend)
+    frames = [Path(f) for f in frames]
+    cache_key = "{}:{}".format(frames[0].parent if frames else "", backend.name)
+    with _embedding_cache_lock:
+        lock = _embedding_locks.setdefault(cache_key, threading.Lock())
+    with lock:  # other questions of the episode wait for the first build
+        with _embedding_cache_lock:
+            cached = _embedding_cache.get(cache_key)
+        if cached is not None and len(cached) == len(frames):
+            return cached
+
+        index_directory = Path(index_directory)
+        matrix_path, names_path = get_embedding_index_paths(index_directory, backend)
+        names = {
+            "names": [f.name for f in frames],
+            "mtimes": get_frame_mtimes(frames).tolist(),
+        }
+        exists = matrix_path.exists() and names_path.exists()
+        if not exists or json.load(names_path.open("r")) != names:
+            build_embedding_index(frames, index_directory, backend)
+        embeddings = np.load(matrix_path, mmap_mode="r")
+        with _embedding_cache_lock:
+            _embedding_cache[cache_key] = embeddings
+        return embeddings
+
+
+def release_embedding_index(folder: Union[str, Path]) -> None:
+    """Drops the in-memory embedding indices of the episode frames in folder."""
+    prefix = "{}:".format(Path(folder))
+    with _embedding_cache_lock:
+        for key in [k for k in _embedding_cache if k.startswith(prefix)]:
+            del _embedding_cache[key]
+
+
+def build_embedding_indices(
+    frames_directory: Path,
+    index_directory: Path,
+    backend: EmbeddingBackend,
+    batch_size: int = 32,
+    force: bool = False,
+) -> None:
+    folders = sorted(p.parent for p in frames_directory.glob("*/*/*-rgb.png"))
+    folders = sorted(set(folders))
+    print("found {:,} episodes".format(len(folders)))
+    for folder in tqdm.tqdm(folders):
+        episode_index_directory = index_directory / folder.relative_to(frames_directory)
+        matrix_path, _ = get_embedding_index_paths(episode_index_directory, backend)
+        if matrix_path.exists() and not force:
+            continue  # skip existing
+        frames = sorted(folder.glob("*-rgb.png"))
+        build_embedding_index(
+            frames, episode_index_directory, backend, batch_size=batch_size
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build frame embedding indices")
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        default="data/frames",
+        help="path episode histories (default: data/frames)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="output directory (default: data/index)",
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=list(EMBEDDING_BACKENDS),
+        default="clip",
+        help="embedding backend (default: clip)",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=DEFAULT_EMBEDDING_MODEL,
+        help="embedding model (default: {})".format(DEFAULT_EMBEDDING_MODEL),
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="frames per forward pass (default: 32)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild existing indices (default: false)",
+    )
+    args = parser.parse_args()
+    backend = get_embedding_backend(args.embedding_backend, args.embedding_model)
+    build_embedding_indices(
+        args.frames_directory,
+        args.index_directory,
+        backend,
+        batch_size=args.batch_size,
+        force=args.force,
+    )
@@ -0,0 +1,127 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import collections
+import contextlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from openeqa.utils.frame_utils import FrameCache
+from openeqa.utils.manifest_utils import FramesManifest
+from openeqa.utils.selection_utils import release_index
+from openeqa.utils.store_utils import FrameStore
+
+
+def group_by_episode(items: List[dict]) -> Dict[str, List[dict]]:
+    """Groups questions by episode_history, keeping the order in which
+    episodes (and questions within an episode) first appear."""
+    groups: Dict[str, List[dict]] = collections.OrderedDict()
+    for item in items:
+        groups.setdefault(item["episode_history"], []).append(item)
+    return groups
+
+
+class EpisodeScheduler:
+    """Dispatches questions episode by episode so that each episode's frames
+    are listed (through the frames manifest), loaded and encoded once and
+    then shared by all its questions.
+
+    At most max_live_episodes episodes are held at a time: acquire() blocks
+    on a new episode until enough live episodes have been released, and an
+    episode's in-memory frames and indices are dropped once release() has
+    been called for every one of its scheduled questions.
+    """
+
+    def __init__(
+        self,
+        frames_directory: Path,
+        frame_cache: Optional[FrameCache] = None,
+        frame_store: Optional[FrameStore] = None,
+        max_live_episodes: int = 2,
+    ):
+        self.frames_directory = Path(frames_directory)
+        self.manifest = FramesManifest(frames_directory)
+        self.frame_cache = frame_cache
+        self.frame_store = frame_store
+        self.max_live_episodes = max(1, max_live_episodes)
+        self._pending: Dict[str, int] = {}
+        self._frames: Dict[str, List[Path]] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.num_episodes = 0
+        self.max_live = 0
+
+    def schedule(self, items: List[dict]) -> List[dict]:
+        """Returns items grouped by episode; dispatch them in this order."""
+        groups = group_by_episode(items)
+        with self._cond:
+            for episode, episode_items in groups.items():
+                self._pending[episode] = self._pending.get(episode, 0) + len(
+                    episode_items
+                )
+        return [item for episode_items in groups.values() for item in episode_items]
+
+    def acquire(self, episode: str) -> List[Path]:
+        """Returns the sorted frame paths of an episode, making it live. Frame
+        modification times from the manifest are passed to the frame cache,
+        so that its keys do not stat every frame."""
+        with self._cond:
+            while (
+                not self._closed
+                and episode not in self._frames
+                and len(self._frames) >= self.max_live_episodes
+            ):
+                self._cond.wait()
+            if self._closed and episode not in self._frames:
+                raise RuntimeError("episode scheduler is closed")
+            if episode not in self._frames:
+                self._frames[episode] = self.manifest.get_frames(episode)
+                mtimes = self.manifest.get_mtimes(episode)
+                if self.frame_cache is not None and mtimes is not None:
+                    self.frame_cache.set_mtimes(self._frames[episode], mtimes)
+                self.num_episodes += 1
+                self.max_live = max(self.max_live, len(self._frames))
+            return self._frames[episode]
+
+    def release(self, episode: str) -> None:
+        """Marks one question of an episode as done."""
+        with self._cond:
+            self._pending[episode] -= 1
+            if self._pending[episode] > 0:
+                return
+            del self._pending[episode]
+            self._frames.pop(episode, None)
+            self._cond.notify_all()
+
+        folder = self.frames_directory / episode
+        if self.frame_cache is not None:
+            self.frame_cache.release(folder)
+        if self.frame_store is not None:
+            self.frame_store.release(folder)
+        release_index(folder)
+
+    @contextlib.contextmanager
+    def hold(self, episode: str):
+        """Acquires an episode for one question and releases it afterwards."""
+        frames = self.acquire(episode)
+        try:
+            yield frames
+        finally:
+            self.release(episode)
+
+    def close(self) -> None:
+        """Fails pending acquire() calls, e.g. once questions were cancelled
+        and their episodes will never be released."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def print_stats(self) -> None:
+        print(
+            "episodes: {:,} loaded ({:,} not in manifest), at most {:,} live".format(
+                self.num_episodes, self.manifest.num_stale, self.max_live
+            )
+        )
@@ -0,0 +1,632 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from openeqa.utils.decode_utils import (
+    FrameTimings,
+    decode_frame,
+    get_frame_shape,
+    map_frames,
+    measure,
+)
+from openeqa.utils.sizing_utils import get_mosaic_grid, get_mosaic_shape
+from openeqa.utils.store_utils import FrameStore
+
+FrameKey = Tuple[str, int, Optional[int], str, Optional[int], bool]
+Payload = Union[str, bytes]
+
+IMAGE_FORMAT_TO_MIME_TYPE = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+DEFAULT_IMAGE_QUALITY = 90
+MIN_IMAGE_QUALITY = 10
+
+
+def load_frame(
+    path: str,
+    image_size: Optional[int] = 512,
+    timings: Optional[FrameTimings] = None,
+    reduced_decode: bool = True,
+    store: Optional[FrameStore] = None,
+) -> np.ndarray:
+    if store is not None:
+        with measure(timings, "store"):
+            frame = store.get_frame(path, image_size)
+        if frame is not None:
+            return frame
+    return decode_frame(path, image_size, timings, reduced_decode)
+
+
+def get_mime_type(image_format: str) -> str:
+    if image_format not in IMAGE_FORMAT_TO_MIME_TYPE:
+        raise ValueError("invalid image format: {}".format(image_format))
+    return IMAGE_FORMAT_TO_MIME_TYPE[image_format]
+
+
+def get_image_quality(
+    image_format: str, image_quality: Optional[int] = None
+) -> Optional[int]:
+    if image_format == "png":
+        return None  # lossless
+    if image_quality is None:
+        return DEFAULT_IMAGE_QUALITY
+    return image_quality
+
+
+def encode_frame(
+    frame: np.ndarray,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+) -> bytes:
+    get_mime_type(image_format)  # validate format
+    image_quality = get_image_quality(image_format, image_quality)
+    params = []
+    if image_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, image_quality]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, image_quality]
+    success, buffer = cv2.imencode("." + image_format, frame, params)
+    if not success:
+        raise ValueError("could not encode frame as {}".format(image_format))
+    return buffer.tobytes()
+
+
+def get_frame_key(
+    path: str,
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    raw: bool = False,
+    mtime: Optional[int] = None,
+) -> FrameKey:
+    path = os.path.abspath(path)
+    if mtime is None:
+        mtime = os.stat(path).st_mtime_ns
+    return (path, mtime, image_size, image_format, image_quality, raw)
+
+
+def get_mosaic_key(
+    paths: List[str],
+    labels: Optional[List[str]] = None,
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    raw: bool = False,
+    mtimes: Optional[List[int]] = None,
+) -> FrameKey:
+    paths = [os.path.abspath(p) for p in paths]
+    if mtimes is None:
+        mtimes = [os.stat(p).st_mtime_ns for p in paths]
+    mtime = max(mtimes)
+    name = "mosaic:" + "|".join(paths)
+    if labels:
+        name += "#" + ",".join(labels)
+    return (name, mtime, image_size, image_format, image_quality, raw)
+
+
+class FrameCache:
+    """Two-level (memory + disk) cache of base64-encoded frame payloads, or of
+    the encoded bytes themselves for keys with raw set.
+
+    The in-memory level is an LRU bounded by the total size of the cached
+    payloads. The optional on-disk level persists payloads across runs.
+    Keys include the frame modification time, taken from set_mtimes (e.g.
+    the frames manifest) when known instead of a stat per frame.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 1 << 30,
+        cache_directory: Optional[Union[str, Path]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_directory = None
+        if cache_directory is not None:
+            self.cache_directory = Path(cache_directory)
+            self.cache_directory.mkdir(parents=True, exist_ok=True)
+        self._entries: Dict[FrameKey, Payload] = collections.OrderedDict()
+        self._num_bytes = 0
+        self._mtimes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_disk_path(self, key: FrameKey) -> Path:
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        suffix = ".bin" if key[5] else ".b64"
+        return self.cache_directory / name[:2] / (name + suffix)
+
+    def _insert(self, key: FrameKey, payload: Payload) -> None:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = payload
+        self._num_bytes += len(payload)
+        while self._num_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._num_bytes -= len(evicted)
+
+    def get(self, key: FrameKey) -> Optional[Payload]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self.bytes_saved += len(payload)
+                return payload
+
+        if self.cache_directory is not None:
+            path = self._get_disk_path(key)
+            if path.exists():
+                payload = path.read_bytes() if key[5] else path.read_text()
+                with self._lock:
+                    self._insert(key, payload)
+                    self.disk_hits += 1
+                    self.bytes_saved += len(payload)
+                return payload
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: FrameKey, payload: Payload) -> None:
+        with self._lock:
+            self._insert(key, payload)
+
+        if self.cache_directory is not None:
+            path = self._get_disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp{}".format(threading.get_ident()))
+            if isinstance(payload, bytes):
+                tmp_path.write_bytes(payload)
+            else:
+                tmp_path.write_text(payload)
+            os.replace(tmp_path, path)
+
+    def set_mtimes(self, paths: List[Union[str, Path]], mtimes: List[int]) -> None:
+        with self._lock:
+            for path, mtime in zip(paths, mtimes):
+                self._mtimes[os.path.abspath(path)] = mtime
+
+    def get_mtime(self, path: Union[str, Path]) -> int:
+        path = os.path.abspath(path)
+        with self._lock:
+            mtime = self._mtimes.get(path)
+        return os.stat(path).st_mtime_ns if mtime is None else mtime
+
+    def release(self, folder: Union[str, Path]) -> int:
+        """Drops in-memory payloads (and recorded mtimes) of frames and mosaics
+        under folder, e.g. once every question of an episode has been
+        answered. The on-disk level is kept. Returns the number of bytes
+        freed."""
+        prefix = os.path.join(os.path.abspath(folder), "")
+        num_bytes = 0
+        with self._lock:
+            for path in [p for p in self._mtimes if p.startswith(prefix)]:
+                del self._mtimes[path]
+            for key in list(self._entries):
+                if key[0].startswith(prefix) or key[0].startswith("mosaic:" + prefix):
+                    num_bytes += len(self._entries.pop(key))
+            self._num_bytes -= num_bytes
+        return num_bytes
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "memory_bytes": self._num_bytes,
+            "memory_entries": len(self._entries),
+        }
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(
+            "frame cache: {:,} lookups, {:.1f}% hit rate "
+            "({:,} memory / {:,} disk), {:.1f} MB saved".format(
+                stats["lookups"],
+                100.0 * stats["hit_rate"],
+                stats["memory_hits"],
+                stats["disk_hits"],
+                stats["bytes_saved"] / 1e6,
+            )
+        )
+
+
+def tile_frames(
+    frames: List[np.ndarray],
+    num_rows: int,
+    num_columns: int,
+    labels: Optional[List[str]] = None,
+) -> np.ndarray:
+    """Composes frames of the same shape into a row-major grid image, with
+    optional labels drawn in the top-left corner of each tile."""
+    height, width, channels = frames[0].shape
+    tiles = np.zeros((num_rows * num_columns, height, width, channels), np.uint8)
+    tiles[: len(frames)] = np.stack(frames)
+
+    if labels:
+        scale = max(height, width) / 640
+        thickness = max(1, round(2 * scale))
+        for tile, label in zip(tiles, labels):
+            (w, h), baseline = cv2.getTextSize(
+                label, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness
+            )
+            pad = max(2, round(4 * scale))
+            tile[: h + baseline + 2 * pad, : w + 2 * pad] = 0
+            origin = (pad, h + pad)
+            cv2.putText(
+                tile,
+                label,
+                origin,
+                cv2.FONT_HERSHEY_SIMPLEX,
+                scale,
+                (255, 255, 255),
+                thickness,
+                cv2.LINE_AA,
+            )
+
+    tiles = tiles.reshape(num_rows, num_columns, height, width, channels)
+    tiles = tiles.transpose(0, 2, 1, 3, 4)
+    return tiles.reshape(num_rows * height, num_columns * width, channels)
+
+
+def load_mosaic(
+    paths: List[str],
+    image_size: Optional[int] = 512,
+    mosaic_size: Optional[int] = None,
+    labels: Optional[List[str]] = None,
+    timings: Optional[FrameTimings] = None,
+    store: Optional[FrameStore] = None,
+) -> np.ndarray:
+    """Loads up to mosaic_size frames into a grid whose longest side is at
+    most image_size (missing tiles at the end are left black). Tiles are kept
+    at full resolution if image_size is None."""
+    mosaic_size = mosaic_size or len(paths)
+    shape = get_frame_shape(paths[0])
+    num_rows, num_columns = get_mosaic_grid(mosaic_size)
+    mosaic_shape = get_mosaic_shape(shape, mosaic_size)
+    tile_size = None
+    if image_size:
+        tile_size = int(image_size * max(shape) / max(mosaic_shape))
+    frames = [
+        load_frame(p, image_size=tile_size, timings=timings, store=store) for p in paths
+    ]
+    with measure(timings, "mosaic"):
+        return tile_frames(frames, num_rows, num_columns, labels=labels)
+
+
+def encode_payload(
+    frame: np.ndarray,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    timings: Optional[FrameTimings] = None,
+    raw: bool = False,
+) -> Payload:
+    with measure(timings, "encode"):
+        buffer = encode_frame(frame, image_format, image_quality)
+        if raw:
+            return buffer
+        return base64.b64encode(buffer).decode("utf-8")
+
+
+def get_frame_payload(
+    path: str,
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    cache: Optional[FrameCache] = None,
+    frame: Optional[np.ndarray] = None,
+    timings: Optional[FrameTimings] = None,
+    store: Optional[FrameStore] = None,
+    raw: bool = False,
+) -> Payload:
+    image_quality = get_image_quality(image_format, image_quality)
+
+    key = None
+    if cache is not None:
+        mtime = cache.get_mtime(path)
+        key = get_frame_key(path, image_size, image_format, image_quality, raw, mtime)
+        payload = cache.get(key)
+        if payload is not None:
+            return payload
+
+    if frame is None:
+        frame = load_frame(path, image_size=image_size, timings=timings, store=store)
+    payload = encode_payload(frame, image_format, image_quality, timings, raw)
+
+    if cache is not None:
+        cache.put(key, payload)
+    return payload
+
+
+def get_mosaic_payload(
+    paths: List[str],
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    mosaic_size: Optional[int] = None,
+    labels: Optional[List[str]] = None,
+    cache: Optional[FrameCache] = None,
+    frame: Optional[np.ndarray] = None,
+    timings: Optional[FrameTimings] = None,
+    store: Optional[FrameStore] = None,
+    raw: bool = False,
+) -> Payload:
+    image_quality = get_image_quality(image_format, image_quality)
+
+    key = None
+    if cache is not None:
+        mtimes = [cache.get_mtime(p) for p in paths]
+        key = get_mosaic_key(
+            paths, labels, image_size, image_format, image_quality, raw, mtimes
+        )
+        payload = cache.get(key)
+        if payload is not None:
+            return payload
+
+    if frame is None:
+        frame = load_mosaic(paths, image_size, mosaic_size, labels, timings, store)
+    payload = encode_payload(frame, image_format, image_quality, timings, raw)
+
+    if cache is not None:
+        cache.put(key, payload)
+    return payload
+
+
+def get_base64_size(payload: Payload) -> int:
+    if isinstance(payload, bytes):
+        return 4 * math.ceil(len(payload) / 3)
+    return len(payload)
+
+
+def get_frame_payloads(
+    paths: List[str],
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    store: Optional[FrameStore] = None,
+    raw: bool = False,
+) -> List[Payload]:
+    """Returns base64-encoded frames (or the encoded bytes if raw, for clients
+    that send bytes), lowering the quality of lossy formats until the combined
+    base64 payload fits in max_payload_bytes (if given).
+
+    With mosaic_size, every mosaic_size consecutive frames are tiled into one
+    image (see load_mosaic) labeled with the frame numbers 1, 2, ...
+    """
+    image_quality = get_image_quality(image_format, image_quality)
+
+    groups = [[p] for p in paths]
+    if mosaic_size:
+        groups = [paths[i : i + mosaic_size] for i in range(0, len(paths), mosaic_size)]
+    frames = [None] * len(groups)  # re-used when re-encoding at lower quality
+
+    def get_labels(idx: int) -> List[str]:
+        start = idx * mosaic_size + 1
+        return [str(start + i) for i in range(len(groups[idx]))]
+
+    def prepare(idx: int) -> Payload:
+        if mosaic_size:
+            return get_mosaic_payload(
+                groups[idx],
+                image_size=image_size,
+                image_format=image_format,
+                image_quality=image_quality,
+                mosaic_size=mosaic_size,
+                labels=get_labels(idx),
+                cache=cache,
+                frame=frames[idx],
+                timings=timings,
+                store=store,
+                raw=raw,
+            )
+        return get_frame_payload(
+            groups[idx][0],
+            image_size=image_size,
+            image_format=image_format,
+            image_quality=image_quality,
+            cache=cache,
+            frame=frames[idx],
+            timings=timings,
+            store=store,
+            raw=raw,
+        )
+
+    def load(idx: int) -> None:
+        if mosaic_size:
+            frames[idx] = load_mosaic(
+                groups[idx], image_size, mosaic_size, get_labels(idx), timings, store
+            )
+        else:
+            frames[idx] = load_frame(
+                groups[idx][0], image_size, timings=timings, store=store
+            )
+
+    while True:
+        with measure(timings, "request"):
+            payloads = map_frames(prepare, range(len(groups)), num_workers)
+
+        total_bytes = sum(get_base64_size(p) for p in payloads)
+        if max_payload_bytes is None or total_bytes <= max_payload_bytes:
+            return payloads
+        if image_quality is None or image_quality <= MIN_IMAGE_QUALITY:
+            print(
+                "WARNING: frame payload ({:,} bytes) exceeds budget ({:,} bytes)".format(
+                    total_bytes, max_payload_bytes
+                )
+            )
+            return payloads
+
+        # payload size shrinks roughly linearly with quality; step at least 5
+        ratio = max_payload_bytes / total_bytes
+        image_quality = min(image_quality - 5, int(image_quality * ratio))
+        image_quality = max(image_quality, MIN_IMAGE_QUALITY)
+        if frames[0] is None:
+            map_frames(load, range(len(groups)), num_workers)
+
+
+def get_codec_name(image_format: str, image_quality: Optional[int] = None) -> str:
+    image_quality = get_image_quality(image_format, image_quality)
+    if image_quality is None:
+        return image_format
+    return "{}-{}".format(image_format, image_quality)
+
+
+def load_llm_match_score(path: Path) -> float:
+    scores = np.array(list(json.load(path.open("r")).values()))
+    return np.mean(100.0 * (np.clip(scores, 1, 5) - 1) / 4)
+
+
+def compare_reduced_decode(path: str, image_size: int = 512) -> Tuple[float, int]:
+    """Returns the mean and max absolute pixel difference between the
+    reduced-decode path and a full-resolution decode and resize."""
+    full = load_frame(path, image_size=image_size, reduced_decode=False)
+    reduced = load_frame(path, image_size=image_size, reduced_decode=True)
+    assert full.shape == reduced.shape
+    diff = np.abs(full.astype(np.int16) - reduced.astype(np.int16))
+    return float(diff.mean()), int(diff.max())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="benchmark frame decoding and payload codecs"
+    )
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        required=True,
+        help="path to an episode history folder",
+    )
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        default=50,
+        help="number of frames (default: 50)",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=512,
+        help="image size (default: 512)",
+    )
+    parser.add_argument(
+        "--qualities",
+        type=int,
+        nargs="+",
+        default=[90, 75, 50],
+        help="jpeg/webp qualities (default: 90 75 50)",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="*",
+        default=[],
+        help="LLM-Match metrics files as <codec>=<path>, e.g. jpeg-75=metrics.json",
+    )
+    parser.add_argument(
+        "--max-pixel-error",
+        type=float,
+        default=2.0,
+        help="max mean abs pixel error of reduced decoding (default: 2.0)",
+    )
+    args = parser.parse_args()
+
+    frame_paths = sorted(args.frames_directory.glob("*-rgb.png"))
+    indices = np.round(np.linspace(0, len(frame_paths) - 1, args.num_frames))
+    frame_paths = [str(frame_paths[i]) for i in indices.astype(int)]
+    print("loaded {:,} frames from {}".format(len(frame_paths), args.frames_directory))
+
+    for reduced_decode in [False, True]:
+        start_time = time.perf_counter()
+        frames = [
+            load_frame(p, image_size=args.image_size, reduced_decode=reduced_decode)
+            for p in frame_paths
+        ]
+        load_time = (time.perf_counter() - start_time) / len(frames)
+        print(
+            "{} decode: {:.1f} ms per frame".format(
+                "reduced" if reduced_decode else "full", 1000.0 * load_time
+            )
+        )
+
+    errors = [compare_reduced_decode(p, args.image_size) for p in frame_paths]
+    mean_error = max(e[0] for e in errors)
+    print(
+        "reduced decode pixel error: {:.2f} mean (worst frame), {} max".format(
+            mean_error, max(e[1] for e in errors)
+        )
+    )
+    if mean_error > args.max_pixel_error:
+        raise ValueError(
+            "reduced decode error ({:.2f}) exceeds {:.2f}".format(
+                mean_error, args.max_pixel_error
+            )
+        )
+
+    codec_to_score = {}
+    for item in args.metrics:
+        codec, path = item.split("=", 1)
+        codec_to_score[codec] = load_llm_match_score(Path(path))
+
+    codecs = [("png", None)]
+    for image_format in ["jpeg", "webp"]:
+        codecs += [(image_format, q) for q in args.qualities]
+
+    print(
+        "{:<10} {:>12} {:>14} {:>16} {:>10}".format(
+            "codec", "encode (ms)", "frame (KB)", "request (MB)", "score"
+        )
+    )
+    for image_format, image_quality in codecs:
+        start_time = time.perf_counter()
+        payloads = [
+            base64.b64encode(encode_frame(f, image_format, image_quality))
+            for f in frames
+        ]
+        encode_time = (time.perf_counter() - start_time) / len(frames)
+        num_bytes = sum(len(p) for p in payloads)
+        codec = get_codec_name(image_format, image_quality)
+        score = codec_to_score.get(codec)
+        print(
+            "{:<10} {:>12.1f} {:>14.1f} {:>16.2f} {:>10}".format(
+                codec,
+                1000.0 * encode_time,
+                num_bytes / len(frames) / 1e3,
+                num_bytes / 1e6,
+                "-" if score is None else "{:.1f}".format(score),
+            )
+        )
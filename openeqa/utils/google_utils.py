@@ -3,14 +3,28 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import hashlib
+import io
 import os
+import threading
+import time
 import traceback
-from typing import Any, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import google.generativeai as genai
 from PIL.Image import Image
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from openeqa.utils.frame_utils import (
+    FrameCache,
+    FrameTimings,
+    get_frame_payloads,
+    get_mime_type,
+)
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import read_stream
+
 
 def set_google_key(key: Optional[str] = None) -> None:
     if key is None:
@@ -19,14 +33,186 @@ def set_google_key(key: Optional[str] = None) -> None:
     genai.configure(api_key=key)
 
 
+class GoogleFileUploader:
+    """Uploads files through the Gemini File API."""
+
+    def upload(
+        self, data: bytes, mime_type: str, display_name: str
+    ) -> Tuple[Any, float]:
+        """Returns a handle to use in requests and its expiration time."""
+        file = genai.upload_file(
+            io.BytesIO(data), mime_type=mime_type, display_name=display_name
+        )
+        return file, file.expiration_time.timestamp()
+
+
+class LocalFileUploader:
+    """Offline stand-in for GoogleFileUploader that keeps uploaded files in
+    memory and expires them ttl seconds (of clock time) after the upload."""
+
+    def __init__(self, ttl: float = 48 * 3600, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.files: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def upload(
+        self, data: bytes, mime_type: str, display_name: str
+    ) -> Tuple[Any, float]:
+        with self._lock:
+            uri = "local://files/{}-{}".format(len(self.files), display_name)
+            self.files[uri] = data
+        handle = {"file_data": {"mime_type": mime_type, "file_uri": uri}}
+        return handle, self.clock() + self.ttl
+
+
+class FrameAssetManager:
+    """Uploads every distinct frame payload once and refers to the returned
+    handle in later requests until the upload is about to expire.
+
+    Payloads are keyed by their content hash, so a frame is re-used by every
+    question that sends it, however it was selected, tiled or encoded.
+    Concurrent requests for the same payload wait for a single upload.
+    Uploads run on their own num_workers threads, so that waiting on the
+    network does not hold up the shared frame decoding pool.
+    """
+
+    def __init__(
+        self,
+        uploader: Optional[Any] = None,
+        expiry_margin: float = 3600,
+        num_workers: Optional[int] = 8,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.uploader = uploader or GoogleFileUploader()
+        self.expiry_margin = expiry_margin
+        self.clock = clock
+        self._assets: Dict[str, Tuple[Any, float]] = {}
+        self._uploading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.num_uploads = 0
+        self.num_reuses = 0
+        self.bytes_uploaded = 0
+        self.bytes_reused = 0
+        self._executor = None
+        if num_workers and num_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=num_workers, thread_name_prefix="uploads"
+            )
+
+    def get_handle(self, data: bytes, mime_type: str) -> Any:
+        key = hashlib.sha1(data).hexdigest()
+        while True:
+            with self._lock:
+                asset = self._assets.get(key)
+                if asset is not None and asset[1] - self.expiry_margin > self.clock():
+                    self.num_reuses += 1
+                    self.bytes_reused += len(data)
+                    return asset[0]
+                event = self._uploading.get(key)
+                if event is None:
+                    event = self._uploading[key] = threading.Event()
+                    break
+            event.wait()  # uploaded by another thread (or retry if it failed)
+
+        try:
+            handle, expiration_time = self.uploader.upload(data, mime_type, key)
+            with self._lock:
+                self._assets[key] = (handle, expiration_time)
+                self.num_uploads += 1
+                self.bytes_uploaded += len(data)
+            return handle
+        finally:
+            with self._lock:
+                self._uploading.pop(key)
+            event.set()
+
+    def get_handles(self, payloads: List[bytes], mime_type: str) -> List[Any]:
+        if self._executor is None or len(payloads) <= 1:
+            return [self.get_handle(data, mime_type) for data in payloads]
+        return list(
+            self._executor.map(lambda data: self.get_handle(data, mime_type), payloads)
+        )
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def print_stats(self) -> None:
+        if self.num_uploads + self.num_reuses == 0:
+            return
+        print(
+            "frame assets: {:,} uploads ({:.1f} MB), {:,} re-used ({:.1f} MB "
+            "not uploaded again)".format(
+                self.num_uploads,
+                self.bytes_uploaded / 1e6,
+                self.num_reuses,
+                self.bytes_reused / 1e6,
+            )
+        )
+
+
+def prepare_google_vision_messages(
+    prefix: Optional[str] = None,
+    suffix: Optional[str] = None,
+    image_paths: Optional[List[str]] = None,
+    image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
+    frame_assets: Optional[FrameAssetManager] = None,
+) -> List[Union[str, dict]]:
+    """Returns the prefix, frames, and suffix of a request. Frames are sent
+    inline, or as handles to uploaded files if frame_assets is given."""
+    if image_paths is None:
+        image_paths = []
+
+    messages = []
+    if prefix:
+        messages.append(prefix)
+
+    mime_type = get_mime_type(image_format)
+    frames = get_frame_payloads(
+        image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        cache=frame_cache,
+        num_workers=num_workers,
+        timings=frame_timings,
+        mosaic_size=mosaic_size,
+        store=frame_store,
+        raw=True,  # sent as bytes, so skip base64
+    )
+    if frame_assets is not None:
+        messages.extend(frame_assets.get_handles(frames, mime_type))
+    else:
+        messages.extend({"mime_type": mime_type, "data": frame} for frame in frames)
+
+    if suffix:
+        messages.append(suffix)
+
+    return messages
+
+
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
 def call_google_api(
-    message: Union[str, List[Union[Any, Image]]],
+    message: Union[str, List[Union[Any, Image, dict]]],
     model: str = "gemini-pro",  # gemini-pro, gemini-pro-vision
+    stop_sequences: Optional[List[str]] = None,
 ) -> str:
     try:
         model = genai.GenerativeModel(model)
-        response = model.generate_content(message)
+        response = model.generate_content(
+            message,
+            generation_config=genai.GenerationConfig(stop_sequences=stop_sequences),
+        )
         response.resolve()
         return response.text
     except Exception as e:
@@ -34,6 +220,62 @@ def call_google_api(
         raise e
 
 
+_cancel_warned = threading.Event()
+
+
+def cancel_stream(response: Any) -> bool:
+    """Cancels the grpc (or rest) call behind a streamed response, so that
+    the rest of the answer is not generated after read_stream stopped.
+
+    The SDK cannot close a response, so this uses its private _iterator. If
+    that attribute is missing or cancel fails (e.g. after an SDK upgrade),
+    a warning is printed once and the call is left to finish on its own,
+    which costs the remaining output tokens but not correctness.
+    """
+    iterator = getattr(response, "_iterator", None)
+    cancel = getattr(iterator, "cancel", None)
+    if cancel is not None:
+        try:
+            cancel()
+            return True
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+    else:
+        error = "response has no cancellable iterator"
+    if not _cancel_warned.is_set():
+        _cancel_warned.set()
+        print("WARNING: could not cancel streamed response ({})".format(error))
+    return False
+
+
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+def stream_google_api(
+    message: Union[str, List[Union[Any, Image, dict]]],
+    model: str = "gemini-pro",  # gemini-pro, gemini-pro-vision
+    stop_sequences: Optional[List[str]] = None,
+    stop_fn: Optional[Callable[[str], bool]] = None,
+    latency: Optional[dict] = None,
+) -> str:
+    """Like call_google_api, but streams the response and cancels it once
+    stop_fn(text) is True (see read_stream)."""
+    try:
+        model = genai.GenerativeModel(model)
+        start_time = time.perf_counter()
+        response = model.generate_content(
+            message,
+            generation_config=genai.GenerationConfig(stop_sequences=stop_sequences),
+            stream=True,
+        )
+        try:
+            chunks = (chunk.text for chunk in response if chunk.parts)
+            return read_stream(chunks, start_time, stop_fn=stop_fn, latency=latency)
+        finally:
+            cancel_stream(response)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}")
+        raise e
+
+
 if __name__ == "__main__":
     set_google_key(key=None)
 
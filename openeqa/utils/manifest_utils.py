@@ -0,0 +1,168 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import tqdm
+
+from openeqa.utils.decode_utils import get_frame_mtimes, get_frame_shape, map_frames
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def get_episode_mtime(folder: Path) -> int:
+    # adding, removing or renaming frames updates the directory mtime
+    return os.stat(folder).st_mtime_ns
+
+
+def hash_frame(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def get_episode_entry(
+    folder: Path, hashes: bool = False, num_workers: Optional[int] = None
+) -> dict:
+    mtime = get_episode_mtime(folder)
+    frames = sorted(folder.glob("*-rgb.png"))
+    entry = {
+        "mtime_ns": mtime,
+        "frames": [f.name for f in frames],
+        "mtimes": get_frame_mtimes(frames).tolist(),
+        "shape": None,
+    }
+    if frames:
+        entry["shape"] = list(get_frame_shape(str(frames[0])))
+    if hashes:
+        entry["hashes"] = map_frames(hash_frame, frames, num_workers)
+    return entry
+
+
+def get_episode_folders(frames_directory: Path) -> List[Path]:
+    # episodes are stored as <frames-directory>/<split>/<episode>
+    return sorted(p for p in frames_directory.glob("*/*") if p.is_dir())
+
+
+def build_manifest(
+    frames_directory: Path,
+    hashes: bool = False,
+    num_workers: Optional[int] = None,
+    force: bool = False,
+) -> dict:
+    """Writes <frames_directory>/manifest.json with the ordered frame names,
+    frame modification times, frame shape (and optionally content hashes) of
+    every episode. Entries of an existing manifest are kept unless their
+    episode changed."""
+    frames_directory = Path(frames_directory)
+    manifest_path = frames_directory / MANIFEST_NAME
+    episodes = {}
+    if manifest_path.exists() and not force:
+        episodes = json.load(manifest_path.open("r"))["episodes"]
+
+    folders = get_episode_folders(frames_directory)
+    print("found {:,} episodes".format(len(folders)))
+    for folder in tqdm.tqdm(folders):
+        episode = folder.relative_to(frames_directory).as_posix()
+        entry = episodes.get(episode)
+        if (
+            entry is not None
+            and entry["mtime_ns"] == get_episode_mtime(folder)
+            and "mtimes" in entry
+            and (not hashes or "hashes" in entry)
+        ):
+            continue  # skip unchanged
+        episodes[episode] = get_episode_entry(folder, hashes, num_workers)
+
+    manifest = {"version": MANIFEST_VERSION, "episodes": episodes}
+    tmp_path = manifest_path.with_suffix(".tmp")
+    json.dump(manifest, tmp_path.open("w"), separators=(",", ":"))
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+class FramesManifest:
+    """Reads episode frame lists from <frames_directory>/manifest.json.
+
+    Listing an episode costs one stat of its directory instead of a glob
+    over hundreds of files. Episodes missing from the manifest, or whose
+    directory mtime no longer matches, are listed from disk (once per
+    process) instead.
+    """
+
+    def __init__(self, frames_directory: Union[str, Path]):
+        self.frames_directory = Path(frames_directory)
+        self.episodes: Dict[str, dict] = {}
+        self.num_stale = 0
+        self._lock = threading.Lock()
+        path = self.frames_directory / MANIFEST_NAME
+        if path.exists():
+            manifest = json.load(path.open("r"))
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.episodes = manifest["episodes"]
+
+    def get_entry(self, episode: str) -> dict:
+        folder = self.frames_directory / episode
+        with self._lock:
+            entry = self.episodes.get(episode)
+        if entry is not None and entry["mtime_ns"] == get_episode_mtime(folder):
+            return entry
+        if entry is not None:
+            print("WARNING: stale manifest entry for {}".format(episode))
+        entry = get_episode_entry(folder)
+        with self._lock:
+            self.num_stale += 1
+            self.episodes[episode] = entry
+        return entry
+
+    def get_frames(self, episode: str) -> List[Path]:
+        folder = self.frames_directory / episode
+        return [folder / name for name in self.get_entry(episode)["frames"]]
+
+    def get_mtimes(self, episode: str) -> Optional[List[int]]:
+        # missing from manifests built before frame mtimes were recorded
+        return self.get_entry(episode).get("mtimes")
+
+    def get_shape(self, episode: str) -> Optional[Tuple[int, int]]:
+        shape = self.get_entry(episode)["shape"]
+        return tuple(shape) if shape is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build a frames manifest")
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        default="data/frames",
+        help="path episode histories (default: data/frames)",
+    )
+    parser.add_argument(
+        "--hashes",
+        action="store_true",
+        help="also record frame content hashes (default: false)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="threads for reading frames (default: 8)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild every entry (default: false)",
+    )
+    args = parser.parse_args()
+    build_manifest(
+        args.frames_directory,
+        hashes=args.hashes,
+        num_workers=args.num_workers,
+        force=args.force,
+    )
@@ -3,14 +3,22 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import base64
 import os
-from typing import List, Optional
+import time
+from typing import Callable, List, Optional
 
-import cv2
 import openai
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from openeqa.utils.frame_utils import (
+    FrameCache,
+    FrameTimings,
+    get_frame_payloads,
+    get_mime_type,
+)
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import read_stream
+
 
 def set_openai_key(key: Optional[str] = None):
     if key is None:
@@ -28,6 +36,14 @@ def prepare_openai_vision_messages(
     suffix: Optional[str] = None,
     image_paths: Optional[List[str]] = None,
     image_size: Optional[int] = 512,
+    image_format: str = "png",
+    image_quality: Optional[int] = None,
+    max_payload_bytes: Optional[int] = None,
+    frame_cache: Optional[FrameCache] = None,
+    num_workers: Optional[int] = None,
+    frame_timings: Optional[FrameTimings] = None,
+    mosaic_size: Optional[int] = None,
+    frame_store: Optional[FrameStore] = None,
 ):
     if image_paths is None:
         image_paths = []
@@ -37,16 +53,23 @@ def prepare_openai_vision_messages(
     if prefix:
         content.append({"text": prefix, "type": "text"})
 
-    for path in image_paths:
-        frame = cv2.imread(path)
-        if image_size:
-            factor = image_size / max(frame.shape[:2])
-            frame = cv2.resize(frame, dsize=None, fx=factor, fy=factor)
-        _, buffer = cv2.imencode(".png", frame)
-        frame = base64.b64encode(buffer).decode("utf-8")
+    mime_type = get_mime_type(image_format)
+    frames = get_frame_payloads(
+        image_paths,
+        image_size=image_size,
+        image_format=image_format,
+        image_quality=image_quality,
+        max_payload_bytes=max_payload_bytes,
+        cache=frame_cache,
+        num_workers=num_workers,
+        timings=frame_timings,
+        mosaic_size=mosaic_size,
+        store=frame_store,
+    )
+    for frame in frames:
         content.append(
             {
-                "image_url": {"url": f"data:image/png;base64,{frame}"},
+                "image_url": {"url": f"data:{mime_type};base64,{frame}"},
                 "type": "image_url",
             }
         )
@@ -65,7 +88,13 @@ def call_openai_api(
     max_tokens: int = 32,
     temperature: float = 0.2,
     verbose: bool = False,
+    usage: Optional[dict] = None,
+    n: int = 1,
+    stop: Optional[List[str]] = None,
 ):
+    """Returns the response text, or a list of n texts if n > 1. If usage is
+    given, it is updated with the prompt and completion tokens of the
+    request."""
     client = openai.OpenAI()
     completion = client.chat.completions.create(
         model=model,
@@ -73,13 +102,51 @@ def call_openai_api(
         seed=seed,
         max_tokens=max_tokens,
         temperature=temperature,
+        n=n,
+        stop=stop,
     )
     if verbose:
         print("openai api response: {}".format(completion))
-    assert len(completion.choices) == 1
+    if usage is not None and completion.usage is not None:
+        usage["prompt_tokens"] = completion.usage.prompt_tokens
+        usage["completion_tokens"] = completion.usage.completion_tokens
+    assert len(completion.choices) == n
+    if n > 1:
+        return [choice.message.content for choice in completion.choices]
     return completion.choices[0].message.content
 
 
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+def stream_openai_api(
+    messages: list,
+    model: str = "gpt-4",
+    seed: Optional[int] = None,
+    max_tokens: int = 32,
+    temperature: float = 0.2,
+    stop: Optional[List[str]] = None,
+    stop_fn: Optional[Callable[[str], bool]] = None,
+    latency: Optional[dict] = None,
+) -> str:
+    """Like call_openai_api, but streams the response and closes the stream
+    once stop_fn(text) is True (see read_stream)."""
+    client = openai.OpenAI()
+    start_time = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        seed=seed,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stop=stop,
+        stream=True,
+    )
+    try:
+        chunks = (c.choices[0].delta.content for c in stream if c.choices)
+        return read_stream(chunks, start_time, stop_fn=stop_fn, latency=latency)
+    finally:
+        stream.response.close()
+
+
 if __name__ == "__main__":
     set_openai_key(key=None)
 
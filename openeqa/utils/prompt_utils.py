@@ -14,6 +14,11 @@ PROMPT_NAME_TO_PATH = {
     "gpt4v": DEFAULT_DATA_DIR / Path("gpt4v.txt"),
     "claude3-vision": DEFAULT_DATA_DIR / Path("claude3-vision.txt"),
     "gemini-pro-vision": DEFAULT_DATA_DIR / Path("gemini-pro-vision.txt"),
+    "mosaic": DEFAULT_DATA_DIR / Path("mosaic.txt"),
+    "cascade": DEFAULT_DATA_DIR / Path("cascade.txt"),
+    "multi-question": DEFAULT_DATA_DIR / Path("multi-question.txt"),
+    "describe-frames": DEFAULT_DATA_DIR / Path("describe-frames.txt"),
+    "describe-answer": DEFAULT_DATA_DIR / Path("describe-answer.txt"),
 }
 
 
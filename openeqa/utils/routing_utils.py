@@ -0,0 +1,262 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Per-category routing policies.
+
+A policy is a JSON file that maps question categories to routes, plus a
+default route for other categories:
+
+    {
+        "default": {"backend": "vision", "num_frames": 50},
+        "categories": {
+            "world knowledge": {"backend": "blind", "prices": [30, 60]},
+            "object recognition": {"backend": "vision", "num_frames": 15}
+        }
+    }
+
+Routes are answered by one of ROUTE_BACKENDS: "blind" (text-only OpenAI
+model), "vision" (OpenAI model with num_frames frames), or "llama" (local
+LLaMA weights, text-only). A route may set "prices", the USD per million
+input and output tokens, to report costs and rank routes by them, or
+"cost", its USD per question, to rank it by that instead. Policies
+can also be learned from the metrics files of candidate routes (see
+learn_policy).
+"""
+
+import argparse
+import collections
+import json
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from openeqa.utils.sizing_utils import get_request_image_tokens
+
+ROUTE_BACKENDS = ["blind", "vision", "llama"]
+
+# rough prompt and answer tokens of a question, used to rank routes
+# without a "cost"
+TEXT_TOKENS = 300
+ANSWER_TOKENS = 30
+
+
+def check_route(route: dict) -> dict:
+    if route.get("backend") not in ROUTE_BACKENDS:
+        raise ValueError("invalid route backend: {}".format(route))
+    if route["backend"] == "llama" and "model" not in route:
+        raise ValueError("llama routes require a model path: {}".format(route))
+    return route
+
+
+def load_policy(path: Path) -> dict:
+    policy = json.load(Path(path).open("r"))
+    if "default" not in policy:
+        raise ValueError("policy has no default route: {}".format(path))
+    check_route(policy["default"])
+    for route in policy.get("categories", {}).values():
+        check_route(route)
+    return policy
+
+
+def get_route(policy: dict, category: str) -> dict:
+    return policy.get("categories", {}).get(category, policy["default"])
+
+
+def get_route_name(route: dict) -> str:
+    if "name" in route:
+        return route["name"]
+    name = "{}-{}".format(route["backend"], Path(route.get("model", "default")).name)
+    if route["backend"] == "vision":
+        name += "-{}".format(route.get("num_frames", 50))
+    return name
+
+
+def get_route_cost(
+    route: dict, shape: Tuple[int, int] = (1080, 1920), image_size: int = 512
+) -> float:
+    """Returns the route's "cost" (USD per question), or else its estimated
+    USD per question from its "prices" (0 for local llama routes), or else
+    its estimated input tokens."""
+    if "cost" in route:
+        return route["cost"]
+    if route["backend"] == "llama":
+        return 0.0
+    tokens = TEXT_TOKENS
+    if route["backend"] == "vision":
+        tokens += get_request_image_tokens(
+            "openai",
+            shape,
+            route.get("num_frames", 50),
+            image_size=route.get("image_size", image_size),
+        )
+    if "prices" in route:
+        input_price, output_price = route["prices"]
+        return (tokens * input_price + ANSWER_TOKENS * output_price) / 1e6
+    return tokens
+
+
+def load_scores(path: Path) -> Dict[str, float]:
+    """Loads LLM-Match scores (see evaluate-predictions.py) scaled to 0-100."""
+    scores = json.load(Path(path).open("r"))
+    return {
+        question_id: 100.0 * (np.clip(score, 1, 5) - 1) / 4
+        for question_id, score in scores.items()
+    }
+
+
+def learn_policy(
+    candidates: Dict[str, dict],
+    dataset: list,
+    max_score_drop: float = 0.0,
+) -> dict:
+    """Routes each category to the cheapest candidate whose mean score on the
+    category's questions is within max_score_drop points of the best one.
+
+    candidates maps names to routes with a "metrics" path. Only questions
+    scored by every candidate are compared. Costs are compared in USD if
+    any route sets "prices" or "cost", in which case every API route must
+    set one of them, and in estimated input tokens otherwise (see
+    get_route_cost). The default route is the candidate with the best
+    overall score.
+    """
+    unpriced = [
+        name
+        for name, route in candidates.items()
+        if route["backend"] != "llama" and "cost" not in route and "prices" not in route
+    ]
+    in_usd = any("prices" in r or "cost" in r for r in candidates.values())
+    if unpriced and in_usd:
+        # token estimates cannot be compared with USD
+        raise ValueError("candidates without prices or cost: {}".format(unpriced))
+    scores = {name: load_scores(r["metrics"]) for name, r in candidates.items()}
+    category_to_question_ids = collections.defaultdict(list)
+    for item in dataset:
+        if all(item["question_id"] in s for s in scores.values()):
+            category_to_question_ids[item["category"]].append(item["question_id"])
+
+    def make_route(name: str, question_ids: list) -> dict:
+        route = {k: v for k, v in candidates[name].items() if k != "metrics"}
+        route["name"] = name
+        route["score"] = round(np.mean([scores[name][q] for q in question_ids]), 1)
+        return route
+
+    all_question_ids = sum(category_to_question_ids.values(), [])
+    if not all_question_ids:
+        raise ValueError("no question is scored by every candidate")
+    best = max(
+        candidates, key=lambda n: np.mean([scores[n][q] for q in all_question_ids])
+    )
+    policy = {"default": make_route(best, all_question_ids), "categories": {}}
+    for category, question_ids in sorted(category_to_question_ids.items()):
+        means = {n: np.mean([scores[n][q] for q in question_ids]) for n in candidates}
+        adequate = [
+            n for n in candidates if means[n] >= max(means.values()) - max_score_drop
+        ]
+        name = min(adequate, key=lambda n: (get_route_cost(candidates[n]), -means[n]))
+        policy["categories"][category] = make_route(name, question_ids)
+    return policy
+
+
+class RouteStats:
+    """Tracks questions, latency, and tokens per category and route."""
+
+    def __init__(self):
+        self.stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        category: str,
+        route: dict,
+        seconds: float,
+        usage: Optional[dict] = None,
+    ) -> None:
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cost = 0.0
+        if "prices" in route:
+            input_price, output_price = route["prices"]
+            cost = (
+                prompt_tokens * input_price + completion_tokens * output_price
+            ) / 1e6
+        with self._lock:
+            key = (category, get_route_name(route))
+            stats = self.stats.setdefault(key, collections.Counter())
+            stats["questions"] += 1
+            stats["seconds"] += seconds
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += cost
+
+    def print_stats(self) -> None:
+        if not self.stats:
+            return
+        print(
+            "{:<26} {:<32} {:>9} {:>12} {:>13} {:>10}".format(
+                "category",
+                "route",
+                "questions",
+                "latency (s)",
+                "input tokens",
+                "cost ($)",
+            )
+        )
+        for (category, name), stats in sorted(self.stats.items()):
+            print(
+                "{:<26} {:<32} {:>9,} {:>12.2f} {:>13,} {:>10.2f}".format(
+                    category,
+                    name,
+                    stats["questions"],
+                    stats["seconds"] / stats["questions"],
+                    stats["prompt_tokens"],
+                    stats["cost"],
+                )
+            )
+        total = sum(s["cost"] for s in self.stats.values())
+        if total:
+            print("total cost: ${:.2f}".format(total))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="learn a routing policy from the metrics of candidate routes"
+    )
+    parser.add_argument(
+        "candidates",
+        type=Path,
+        help="JSON file mapping candidate names to routes with a metrics path",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=Path,
+        default="data/open-eqa-v0.json",
+        help="path to dataset (default: data/open-eqa-v0.json)",
+    )
+    parser.add_argument(
+        "--max-score-drop",
+        type=float,
+        default=1.0,
+        help="score points traded for a cheaper route (default: 1.0)",
+    )
+    parser.add_argument(
+        "--output-path",
+        type=Path,
+        default="data/policy.json",
+        help="learned policy (default: data/policy.json)",
+    )
+    args = parser.parse_args()
+    candidates = json.load(args.candidates.open("r"))
+    for route in candidates.values():
+        check_route(route)
+    dataset = json.load(args.dataset.open("r"))
+    policy = learn_policy(candidates, dataset, max_score_drop=args.max_score_drop)
+    for category, route in policy["categories"].items():
+        print("{:<26} {:<24} {:.1f}".format(category, route["name"], route["score"]))
+    print("default: {}".format(policy["default"]["name"]))
+    json.dump(policy, args.output_path.open("w"), indent=2)
+    print("saved policy to {}".format(args.output_path))
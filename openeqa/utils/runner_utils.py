@@ -0,0 +1,510 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import tqdm
+from tenacity import RetryError
+
+
+def add_runner_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="questions answered in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=0,
+        help="shard of episodes to answer, in [0, --num-shards) (default: 0)",
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help="number of shards the episodes are split into (default: 1)",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop at the first failed question instead of recording it in "
+        "<results>-failed.json and continuing (default: false)",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="only re-ask the questions recorded in <results>-failed.json",
+    )
+    parser.add_argument(
+        "--retry-concurrency",
+        type=int,
+        default=1,
+        help="questions re-asked in parallel by --retry-failed (default: 1)",
+    )
+    parser.add_argument(
+        "--retry-attempts",
+        type=int,
+        default=3,
+        help="rounds of attempts by --retry-failed (default: 3)",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=30,
+        help="seconds between rounds of --retry-failed, doubled after every "
+        "round (default: 30)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only process the first 5 questions",
+    )
+
+
+def add_prefetch_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="questions prepared ahead of the requests in flight (default: 4)",
+    )
+    parser.add_argument(
+        "--prefetch-size",
+        type=float,
+        default=512,
+        help="max MB of prepared requests waiting to be sent (default: 512)",
+    )
+
+
+def get_shard(items: List[dict], shard_index: int, num_shards: int) -> List[dict]:
+    """Returns the questions of every num_shards-th episode (sorted by name)
+    starting at shard_index, so all questions of an episode are answered
+    by the same shard."""
+    if not 0 <= shard_index < num_shards:
+        raise ValueError("invalid shard {} of {}".format(shard_index, num_shards))
+    episodes = sorted(set(item["episode_history"] for item in items))
+    shard = set(episodes[shard_index::num_shards])
+    return [item for item in items if item["episode_history"] in shard]
+
+
+def get_shard_path(path: Path, shard_index: int, num_shards: int) -> Path:
+    if num_shards == 1:
+        return path
+    name = "{}-shard-{}-of-{}{}".format(path.stem, shard_index, num_shards, path.suffix)
+    return path.parent / name
+
+
+class RateLimiter:
+    """Spaces out requests so that at most requests_per_minute are started
+    per minute across all threads (no limit if requests_per_minute is None).
+    Rate-limit errors that still occur are retried by the call_*_api
+    functions."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self.interval
+        time.sleep(start_time - now)
+
+
+def get_payload_size(obj: Any) -> int:
+    """Returns the number of bytes of strings and bytes nested in obj."""
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(get_payload_size(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(get_payload_size(v) for v in obj)
+    return 0
+
+
+class Prefetcher:
+    """Calls prepare_fn(item) for items in order on a background thread, so
+    that the next questions are prepared while earlier requests are in
+    flight.
+
+    At most max_items prepared items (and max_bytes of their payloads) wait
+    to be picked up with get(item); the producer blocks until a slot is
+    freed. An item larger than max_bytes is admitted when nothing else is
+    waiting. Exceptions raised by prepare_fn are re-raised by get.
+    """
+
+    def __init__(
+        self,
+        items: List[dict],
+        prepare_fn: Callable[[dict], Any],
+        max_items: int = 4,
+        max_bytes: Optional[int] = None,
+    ):
+        self.items = items
+        self.prepare_fn = prepare_fn
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self._ready: Dict[str, tuple] = {}
+        self._num_bytes = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.wait_time = 0.0
+        self.num_waits = 0
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _has_room(self) -> bool:
+        if not self._ready:
+            return True
+        if len(self._ready) >= self.max_items:
+            return False
+        return self.max_bytes is None or self._num_bytes < self.max_bytes
+
+    def _run(self) -> None:
+        for item in self.items:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._has_room())
+                if self._closed:
+                    return
+            try:
+                prepared, error = self.prepare_fn(item), None
+            except Exception as e:
+                prepared, error = None, e
+            size = get_payload_size(prepared)
+            with self._cond:
+                if self._closed:
+                    return
+                self._ready[item["question_id"]] = (prepared, error, size)
+                self._num_bytes += size
+                self._cond.notify_all()
+
+    def get(self, item: dict) -> Any:
+        start_time = time.perf_counter()
+        with self._cond:
+            if item["question_id"] not in self._ready:
+                self.num_waits += 1
+            self._cond.wait_for(
+                lambda: self._closed or item["question_id"] in self._ready
+            )
+            if item["question_id"] not in self._ready:
+                raise RuntimeError("prefetcher is closed")
+            prepared, error, size = self._ready.pop(item["question_id"])
+            self._num_bytes -= size
+            self.wait_time += time.perf_counter() - start_time
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+        return prepared
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._ready.clear()
+            self._cond.notify_all()
+
+    def print_stats(self) -> None:
+        print(
+            "prefetch: {:,} questions waited {:.1f} s for preparation".format(
+                self.num_waits, self.wait_time
+            )
+        )
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?. ")
+
+
+class QuestionDeduplicator:
+    """Wraps answer_fn so that questions with the same normalized text are
+    answered once and the result is re-used for the others. Only for
+    baselines whose answer depends on the question text alone."""
+
+    def __init__(self, answer_fn: Callable[[dict], dict]):
+        self.answer_fn = answer_fn
+        self._results: Dict[str, dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.num_questions = 0
+        self.num_duplicates = 0
+
+    def __call__(self, item: dict) -> dict:
+        key = normalize_question(item["question"])
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:  # duplicates wait for the first answer
+            duplicate = key in self._results
+            if not duplicate:
+                self._results[key] = self.answer_fn(item)
+            result = dict(self._results[key])
+        with self._lock:
+            self.num_questions += 1
+            self.num_duplicates += duplicate
+        return result
+
+    def print_stats(self) -> None:
+        print(
+            "dedupe: {:,} questions, {:,} answered from a duplicate question".format(
+                self.num_questions, self.num_duplicates
+            )
+        )
+
+
+def save_results(results: List[dict], path: Path) -> None:
+    # write then rename, so an interrupted save never corrupts the results
+    tmp_path = Path(path).with_suffix(".tmp")
+    json.dump(results, tmp_path.open("w"), indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_failed_path(path: Path) -> Path:
+    return path.parent / "{}-failed{}".format(path.stem, path.suffix)
+
+
+class FailedQuestions:
+    """Questions whose answer could not be obtained, kept in a file next to
+    the results with the error class and message of the last failure and
+    the number of failed attempts.
+
+    Failed questions are not stored in the results, so a later run (or
+    --retry-failed) asks them again; they are removed from the file once
+    answered.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.failed: Dict[str, dict] = {}
+        if self.path.exists():
+            self.failed = {e["question_id"]: e for e in json.load(self.path.open())}
+        self.num_recovered = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self.failed
+
+    def _save(self) -> None:
+        if self.failed:
+            save_results(list(self.failed.values()), self.path)
+        elif self.path.exists():
+            self.path.unlink()
+
+    def add(self, question_id: str, error: Exception) -> int:
+        """Records a failed attempt and returns the question's attempts."""
+        if isinstance(error, RetryError):  # the API call gave up retrying
+            error = error.last_attempt.exception() or error
+        with self._lock:
+            entry = self.failed.setdefault(
+                question_id, {"question_id": question_id, "attempts": 0}
+            )
+            entry["attempts"] += 1
+            entry["error"] = type(error).__name__
+            entry["message"] = str(error)
+            self._save()
+            return entry["attempts"]
+
+    def remove(self, question_id: str) -> None:
+        with self._lock:
+            if self.failed.pop(question_id, None) is not None:
+                self.num_recovered += 1
+                self._save()
+
+    def print_stats(self) -> None:
+        if self.num_recovered:
+            print(
+                "answered {:,} previously failed questions".format(self.num_recovered)
+            )
+        if self.failed:
+            print(
+                "{:,} questions failed, see {} (re-ask them with "
+                "--retry-failed)".format(len(self.failed), self.path)
+            )
+
+
+def run_questions(
+    items: List[dict],
+    process_fn: Callable[[dict], dict],
+    results: List[dict],
+    output_path: Path,
+    concurrency: int = 1,
+) -> List[dict]:
+    """Calls process_fn(item) for every item on up to concurrency threads and
+    returns results followed by the new results in the order of items
+    (process_fn returns None for questions that should not be saved).
+
+    The output file is rewritten (in that order) after every finished
+    question. On Ctrl-C, questions that have not started are cancelled and
+    in-flight questions are awaited and saved; a second Ctrl-C stops
+    waiting. Exceptions raised by process_fn are re-raised after saving.
+    """
+    finished: Dict[int, dict] = {}
+
+    def get_results() -> List[dict]:
+        new_results = [finished[idx] for idx in sorted(finished)]
+        return results + [r for r in new_results if r is not None]
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, concurrency), thread_name_prefix="questions"
+    )
+    futures = {executor.submit(process_fn, item): i for i, item in enumerate(items)}
+    pending = set(futures)
+    interrupted = False
+    progress = tqdm.tqdm(total=len(items))
+    try:
+        while pending:
+            try:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                if interrupted:
+                    raise
+                interrupted = True
+                pending = {f for f in pending if not f.cancel()}
+                print(
+                    "\ninterrupted: waiting for {:,} in-flight questions "
+                    "(press Ctrl-C again to stop)".format(len(pending))
+                )
+                continue
+            error = None
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                finished[futures[future]] = future.result()
+                progress.update(1)
+            save_results(get_results(), output_path)
+            if error is not None:
+                raise error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        progress.close()
+        save_results(get_results(), output_path)
+
+    if interrupted:
+        print("saved {:,} answers".format(len(get_results())))
+        raise KeyboardInterrupt
+    return get_results()
+
+
+def run_baseline(
+    args: argparse.Namespace,
+    answer_fn: Callable[[dict], dict],
+    schedule_fn: Optional[Callable[[List[dict]], List[dict]]] = None,
+    prepare_fn: Optional[Callable[[dict], Any]] = None,
+) -> List[dict]:
+    """Answers the pending questions of args.dataset in this shard and saves
+    them to args.output_path (suffixed with the shard, if sharded).
+
+    answer_fn(item) returns the result fields of a question (at least
+    "answer"); schedule_fn may reorder the pending questions. If prepare_fn
+    is given, answer_fn(item, prepare_fn(item)) is called instead and up to
+    args.prefetch questions are prepared ahead (see add_prefetch_args).
+    Questions whose answer_fn raises are recorded in a failed-questions file
+    (see FailedQuestions) and skipped, unless --fail-fast stops the run at
+    the first failure. With --retry-failed,
+    only the recorded questions are asked, in up to args.retry_attempts
+    rounds with exponential backoff between them.
+    """
+    # load dataset
+    dataset = json.load(args.dataset.open("r"))
+    print("found {:,} questions".format(len(dataset)))
+    if args.dry_run:
+        dataset = dataset[:5]
+    if args.num_shards > 1:
+        dataset = get_shard(dataset, args.shard_index, args.num_shards)
+        print(
+            "shard {} of {}: {:,} questions".format(
+                args.shard_index, args.num_shards, len(dataset)
+            )
+        )
+
+    # load results
+    output_path = get_shard_path(args.output_path, args.shard_index, args.num_shards)
+    results = []
+    if output_path.exists():
+        results = json.load(output_path.open())
+        print("found {:,} existing results".format(len(results)))
+    completed = set(item["question_id"] for item in results)
+    pending = [item for item in dataset if item["question_id"] not in completed]
+    failed = FailedQuestions(get_failed_path(output_path))
+    concurrency, max_attempts = args.concurrency, 1
+    if args.retry_failed:
+        pending = [item for item in pending if item["question_id"] in failed]
+        concurrency, max_attempts = args.retry_concurrency, args.retry_attempts
+        print("retrying {:,} failed questions".format(len(pending)))
+
+    def run(items: List[dict], results: List[dict]) -> List[dict]:
+        if schedule_fn is not None:
+            items = schedule_fn(items)
+
+        prefetcher = None
+        if prepare_fn is not None and args.prefetch > 0:
+            prefetcher = Prefetcher(
+                items,
+                prepare_fn,
+                max_items=args.prefetch,
+                max_bytes=int(args.prefetch_size * 1024 * 1024),
+            )
+
+        def process(item: dict) -> Optional[dict]:
+            question_id = item["question_id"]
+            result = {"question_id": question_id}
+            try:
+                if prefetcher is not None:
+                    result.update(answer_fn(item, prefetcher.get(item)))
+                elif prepare_fn is not None:
+                    result.update(answer_fn(item, prepare_fn(item)))
+                else:
+                    result.update(answer_fn(item))
+            except Exception as e:
+                attempts = failed.add(question_id, e)
+                if args.fail_fast and not args.retry_failed:
+                    raise
+                print(
+                    "question {} failed (attempt {}): {!r}".format(
+                        question_id, attempts, e
+                    )
+                )
+                return None  # recorded in the failed questions
+            failed.remove(question_id)
+            return result
+
+        try:
+            return run_questions(
+                items, process, results, output_path, concurrency=concurrency
+            )
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+                prefetcher.print_stats()
+
+    try:
+        results = run(pending, results)
+        # questions that failed again are retried in rounds, each scheduled
+        # like a new run, with exponential backoff between rounds
+        for attempt in range(1, max_attempts):
+            pending = [item for item in pending if item["question_id"] in failed]
+            if not pending:
+                break
+            delay = args.retry_backoff * 2 ** (attempt - 1)
+            print(
+                "retrying {:,} failed questions in {:.0f}s".format(len(pending), delay)
+            )
+            time.sleep(delay)
+            results = run(pending, results)
+    finally:
+        failed.print_stats()
+    print("saving {:,} answers".format(len(results)))
+    return results
@@ -0,0 +1,66 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import collections
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+ARTICLES = {"a", "an", "the"}
+
+
+def add_sampling_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--num-samples",
+        type=int,
+        default=1,
+        help="answers sampled per question for a majority vote (default: 1)",
+    )
+
+
+def normalize_answer(answer: str) -> str:
+    words = re.sub(r"[^\w\s]", " ", answer.lower()).split()
+    return " ".join(w for w in words if w not in ARTICLES)
+
+
+def majority_vote(answers: List[Optional[str]]) -> Optional[str]:
+    """Returns the most common answer (compared after normalization, ties
+    broken by first occurrence), ignoring missing answers."""
+    answers = [a for a in answers if a]
+    if not answers:
+        return None
+    counts = collections.Counter(normalize_answer(a) for a in answers)
+    best = max(counts.values())
+    return next(a for a in answers if counts[normalize_answer(a)] == best)
+
+
+def sample_parallel(fn: Callable[[], Optional[str]], num_samples: int) -> list:
+    """Calls fn num_samples times in parallel, for providers that cannot
+    return several completions from one request. Failed samples are
+    dropped; the first error is raised only if every sample fails."""
+    if num_samples <= 1:
+        return [fn()]
+    with ThreadPoolExecutor(
+        max_workers=num_samples, thread_name_prefix="samples"
+    ) as executor:
+        futures = [executor.submit(fn) for _ in range(num_samples)]
+        samples, errors = [], []
+        for future in futures:
+            try:
+                samples.append(future.result())
+            except Exception as e:
+                print("WARNING: dropping failed sample: {!r}".format(e))
+                errors.append(e)
+        if errors and not samples:
+            raise errors[0]
+        return samples
+
+
+def get_samples_path(path: Path, num_samples: int) -> Path:
+    if num_samples <= 1:
+        return path
+    return path.parent / "{}-samples-{}{}".format(path.stem, num_samples, path.suffix)
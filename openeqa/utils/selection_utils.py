@@ -0,0 +1,226 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import cv2
+import numpy as np
+
+from openeqa.utils.decode_utils import get_frame_mtimes, map_frames
+from openeqa.utils.embedding_utils import (
+    EmbeddingBackend,
+    load_embedding_index,
+    release_embedding_index,
+)
+
+FRAME_SELECTION_METHODS = ["uniform", "distinct", "pose", "retrieval"]
+
+_index_cache: Dict[str, np.ndarray] = {}
+_index_cache_lock = threading.Lock()
+
+
+def get_uniform_indices(num_total: int, num_frames: int) -> np.ndarray:
+    return np.round(np.linspace(0, num_total - 1, num_frames)).astype(int)
+
+
+def compute_frame_hash(path: str, hash_size: int = 8) -> np.uint64:
+    """Difference hash (dHash) of a frame: one bit per horizontally adjacent
+    pixel pair of a (hash_size + 1) x hash_size grayscale thumbnail."""
+    frame = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if frame is None:
+        raise ValueError("could not read frame: {}".format(path))
+    frame = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (frame[:, 1:] > frame[:, :-1]).flatten()
+    return np.packbits(bits).view(">u8")[0].astype(np.uint64)
+
+
+def get_hamming_distances(hashes: np.ndarray, value: np.uint64) -> np.ndarray:
+    diff = np.bitwise_xor(hashes.astype(np.uint64), np.uint64(value))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def load_index(
+    name: str,
+    paths: List[Path],
+    index_directory: Optional[Path],
+    compute_fn: Callable,
+    num_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Loads a per-episode array with one row per frame from memory or
+    <index_directory>/<name>.npz, recomputing it with compute_fn (applied
+    to every frame path) when the frame list or modification times change.
+    In-memory entries are trusted for the lifetime of the process."""
+    cache_key = "{}:{}".format(paths[0].parent if paths else "", name)
+    with _index_cache_lock:
+        cached = _index_cache.get(cache_key)
+    if cached is not None and len(cached) == len(paths):
+        return cached
+
+    names = np.array([p.name for p in paths])
+    mtimes = get_frame_mtimes(paths)
+
+    index_path = None
+    if index_directory is not None:
+        index_path = Path(index_directory) / (name + ".npz")
+        if index_path.exists():
+            data = np.load(index_path)
+            same_names = np.array_equal(data["names"], names)
+            if same_names and np.array_equal(data["mtimes"], mtimes):
+                with _index_cache_lock:
+                    _index_cache[cache_key] = data["values"]
+                return data["values"]
+
+    values = np.array(map_frames(compute_fn, paths, num_workers))
+    if index_path is not None:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(index_path, names=names, mtimes=mtimes, values=values)
+    with _index_cache_lock:
+        _index_cache[cache_key] = values
+    return values
+
+
+def release_index(folder: Union[str, Path]) -> None:
+    """Drops the in-memory indices of the episode frames in folder."""
+    prefix = "{}:".format(Path(folder))
+    with _index_cache_lock:
+        for key in [k for k in _index_cache if k.startswith(prefix)]:
+            del _index_cache[key]
+    release_embedding_index(folder)
+
+
+def select_distinct_indices(
+    hashes: np.ndarray, num_frames: int, threshold: int = 8
+) -> np.ndarray:
+    """Walks the episode in order and keeps a frame only if its hash differs
+    from the last kept frame by more than threshold bits, then spreads the
+    budget evenly over the distinct frames. Returns fewer than num_frames
+    indices if the episode has fewer distinct views."""
+    keep = [0]
+    for idx in range(1, len(hashes)):
+        distance = get_hamming_distances(hashes[idx : idx + 1], hashes[keep[-1]])[0]
+        if distance > threshold:
+            keep.append(idx)
+    keep = np.array(keep)
+    if len(keep) <= num_frames:
+        return keep
+    return keep[get_uniform_indices(len(keep), num_frames)]
+
+
+def get_pose_path(path: Path) -> Path:
+    # both extraction scripts write <frame>.txt next to <frame>-rgb.png
+    return path.parent / path.name.replace("-rgb.png", ".txt")
+
+
+def load_camera_pose(path: Path) -> np.ndarray:
+    return np.loadtxt(get_pose_path(path)).reshape(4, 4)
+
+
+def select_pose_indices(
+    poses: np.ndarray, num_frames: int, direction_weight: float = 1.0
+) -> np.ndarray:
+    """Greedy farthest-point sampling over camera position and viewing
+    direction, so that a few frames cover as much of the scene as possible.
+
+    Each frame is embedded as [position, direction_weight * forward], where
+    forward is the camera z-axis (its sign convention differs between
+    datasets, but is consistent within an episode). Frames with invalid
+    (non-finite) poses are never selected. Returns indices in time order.
+    """
+    valid = np.flatnonzero(np.isfinite(poses).all(axis=(1, 2)))
+    if len(valid) == 0:
+        return np.array([], dtype=int)
+    positions = poses[valid, :3, 3]
+    directions = poses[valid, :3, 2]
+    directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    features = np.concatenate([positions, direction_weight * directions], axis=1)
+
+    selected = [0]
+    distances = np.linalg.norm(features - features[0], axis=1)
+    while len(selected) < min(num_frames, len(valid)):
+        idx = int(np.argmax(distances))
+        if distances[idx] <= 0:
+            break  # remaining frames duplicate selected poses
+        selected.append(idx)
+        distances = np.minimum(
+            distances, np.linalg.norm(features - features[idx], axis=1)
+        )
+    return np.sort(valid[selected])
+
+
+def select_retrieval_indices(
+    similarities: np.ndarray, num_frames: int, num_context_frames: int = 2
+) -> np.ndarray:
+    """Keeps num_context_frames evenly spaced frames for overall context and
+    fills the rest of the budget with the frames most similar to the
+    question. Returns indices in time order."""
+    num_context_frames = min(num_context_frames, num_frames, len(similarities))
+    selected = set(get_uniform_indices(len(similarities), num_context_frames))
+    for idx in np.argsort(-similarities, kind="stable"):
+        if len(selected) >= min(num_frames, len(similarities)):
+            break
+        selected.add(int(idx))
+    return np.array(sorted(selected), dtype=int)
+
+
+def select_frames(
+    frames: List[Union[str, Path]],
+    num_frames: int,
+    method: str = "uniform",
+    index_directory: Optional[Path] = None,
+    distinct_threshold: int = 8,
+    pose_direction_weight: float = 1.0,
+    num_workers: Optional[int] = None,
+    question: Optional[str] = None,
+    embedding_backend: Optional[EmbeddingBackend] = None,
+    num_context_frames: int = 2,
+) -> List[str]:
+    """Selects up to num_frames frame paths from an episode's sorted frames.
+
+    uniform: evenly spaced frames (may repeat frames in short episodes).
+    distinct: evenly spaced among frames that are not near-duplicates of
+        the previous kept frame, using cached perceptual hashes.
+    pose: frames that maximize coverage of camera position and viewing
+        direction, using the exported camera poses (falls back to uniform
+        if the episode has no poses).
+    retrieval: frames most similar to the question text in the embedding
+        index, plus num_context_frames evenly spaced frames.
+    """
+    frames = [Path(f) for f in frames]
+    if method == "uniform":
+        indices = get_uniform_indices(len(frames), num_frames)
+    elif method == "distinct":
+        hashes = load_index(
+            "frame-hashes",
+            frames,
+            index_directory,
+            compute_frame_hash,
+            num_workers=num_workers,
+        )
+        indices = select_distinct_indices(hashes, num_frames, distinct_threshold)
+    elif method == "pose":
+        try:
+            poses = load_index(
+                "camera-poses",
+                frames,
+                index_directory,
+                load_camera_pose,
+                num_workers=num_workers,
+            )
+        except OSError:
+            print("WARNING: missing camera poses in {}".format(frames[0].parent))
+            return select_frames(frames, num_frames, method="uniform")
+        indices = select_pose_indices(poses, num_frames, pose_direction_weight)
+    elif method == "retrieval":
+        if question is None or embedding_backend is None:
+            raise ValueError("retrieval requires a question and embedding backend")
+        embeddings = load_embedding_index(frames, index_directory, embedding_backend)
+        query = embedding_backend.embed_texts([question])[0]
+        similarities = np.asarray(embeddings @ query)
+        indices = select_retrieval_indices(similarities, num_frames, num_context_frames)
+    else:
+        raise ValueError("invalid frame selection method: {}".format(method))
+    return [str(frames[i]) for i in indices]
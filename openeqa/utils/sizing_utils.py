@@ -0,0 +1,207 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Per-provider image token cost models and sizing policy.
+
+Providers rescale images before billing them, so the token cost of a frame
+depends on its dimensions in a provider-specific way:
+
+- openai: fit within 2048x2048, then shrink the shortest side to 768, then
+  bill 170 tokens per 512x512 tile plus 85 base tokens (detail: high).
+- anthropic: shrink the longest side to 1568, then bill ~(w * h) / 750.
+- google: images up to 384x384 cost 258 tokens, larger images are tiled
+  into 768x768 crops of 258 tokens each.
+"""
+
+import argparse
+import math
+from typing import Optional, Tuple
+
+PROVIDERS = ["openai", "anthropic", "google"]
+
+
+def scale_to_fit(width: int, height: int, factor: float) -> Tuple[int, int]:
+    if factor >= 1.0:
+        return width, height
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def get_provider_size(provider: str, width: int, height: int) -> Tuple[int, int]:
+    """Returns the dimensions a provider rescales an image to before billing."""
+    if provider == "openai":
+        width, height = scale_to_fit(width, height, 2048 / max(width, height))
+        return scale_to_fit(width, height, 768 / min(width, height))
+    if provider == "anthropic":
+        width, height = scale_to_fit(width, height, 1568 / max(width, height))
+        return scale_to_fit(width, height, math.sqrt(1.15e6 / (width * height)))
+    if provider == "google":
+        return scale_to_fit(width, height, 3072 / max(width, height))
+    raise ValueError("invalid provider: {}".format(provider))
+
+
+def get_image_tokens(provider: str, width: int, height: int) -> int:
+    width, height = get_provider_size(provider, width, height)
+    if provider == "openai":
+        tiles = math.ceil(width / 512) * math.ceil(height / 512)
+        return 85 + 170 * tiles
+    if provider == "anthropic":
+        return math.ceil(width * height / 750)
+    if provider == "google":
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    raise ValueError("invalid provider: {}".format(provider))
+
+
+def get_min_image_tokens(provider: str) -> int:
+    """Returns the fewest tokens a provider bills for an image of any size."""
+    return get_image_tokens(provider, 1, 1)
+
+
+def get_resized_shape(shape: Tuple[int, int], image_size: int) -> Tuple[int, int]:
+    # matches the output of frame_utils.load_frame
+    height, width = shape[:2]
+    factor = image_size / max(height, width)
+    return round(height * factor), round(width * factor)
+
+
+def get_budget_image_size(
+    provider: str, shape: Tuple[int, int], max_tokens: float
+) -> int:
+    """Returns the largest image size (longest side) for frames of the given
+    native shape that a provider bills at no more than max_tokens and does
+    not rescale (pixels beyond that point are uploaded but not used).
+    Raises ValueError if even the smallest image costs more than max_tokens."""
+    if get_min_image_tokens(provider) > max_tokens:
+        raise ValueError(
+            "budget of {:.0f} tokens per image is below the {} minimum of {}".format(
+                max_tokens, provider, get_min_image_tokens(provider)
+            )
+        )
+    height, width = shape[:2]
+    low, high = 1, max(height, width)
+    while low < high:
+        image_size = (low + high + 1) // 2
+        h, w = get_resized_shape(shape, image_size)
+        within_budget = get_image_tokens(provider, w, h) <= max_tokens
+        not_rescaled = get_provider_size(provider, w, h) == (w, h)
+        if within_budget and not_rescaled:
+            low = image_size
+        else:
+            high = image_size - 1
+    return low
+
+
+def get_mosaic_grid(mosaic_size: int) -> Tuple[int, int]:
+    num_columns = math.ceil(math.sqrt(mosaic_size))
+    num_rows = math.ceil(mosaic_size / num_columns)
+    return num_rows, num_columns
+
+
+def get_mosaic_shape(shape: Tuple[int, int], mosaic_size: int) -> Tuple[int, int]:
+    num_rows, num_columns = get_mosaic_grid(mosaic_size)
+    return num_rows * shape[0], num_columns * shape[1]
+
+
+def get_image_size(
+    provider: str,
+    shape: Optional[Tuple[int, int]],
+    num_frames: int,
+    image_size: Optional[int] = 512,
+    token_budget: Optional[int] = None,
+    mosaic_size: Optional[int] = None,
+) -> Optional[int]:
+    """Returns the longest side of each image sent for num_frames frames of
+    the given native shape. Without a token budget, frames (or mosaic tiles)
+    are image_size; with one, the size is chosen by get_budget_image_size.
+    Frames of unknown shape (None) are image_size, and None keeps frames at
+    full resolution."""
+    if shape is None or (image_size is None and token_budget is None):
+        return image_size
+    num_images = num_frames
+    if mosaic_size:
+        num_images = math.ceil(num_frames / mosaic_size)
+        if token_budget is None:
+            shape = get_resized_shape(shape, image_size)
+            return max(get_mosaic_shape(shape, mosaic_size))
+        shape = get_mosaic_shape(shape, mosaic_size)
+    if token_budget is None:
+        return image_size
+    return get_budget_image_size(provider, shape, token_budget / num_images)
+
+
+def get_request_image_tokens(
+    provider: str,
+    shape: Tuple[int, int],
+    num_frames: int,
+    image_size: Optional[int] = 512,
+    token_budget: Optional[int] = None,
+    mosaic_size: Optional[int] = None,
+) -> int:
+    """Returns the billed image tokens of a request with num_frames frames."""
+    size = get_image_size(
+        provider, shape, num_frames, image_size, token_budget, mosaic_size
+    )
+    num_images = num_frames
+    if mosaic_size:
+        num_images = math.ceil(num_frames / mosaic_size)
+        shape = get_mosaic_shape(shape, mosaic_size)
+    height, width = shape[:2]
+    if size is not None:
+        height, width = get_resized_shape(shape, size)
+    return num_images * get_image_tokens(provider, width, height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="print per-provider image sizes for a token budget"
+    )
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=2,
+        default=[1080, 1920],
+        help="native frame height and width (default: 1080 1920)",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=20000,
+        help="image tokens per request (default: 20000)",
+    )
+    parser.add_argument(
+        "--num-frames",
+        type=int,
+        nargs="+",
+        default=[5, 10, 20, 50],
+        help="number of frames (default: 5 10 20 50)",
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:<10} {:>7} {:>11} {:>14} {:>14}".format(
+            "provider", "frames", "image size", "tokens/frame", "tokens/request"
+        )
+    )
+    for provider in PROVIDERS:
+        for num_frames in args.num_frames:
+            try:
+                image_size = get_budget_image_size(
+                    provider, args.shape, args.token_budget / num_frames
+                )
+            except ValueError:
+                print("{:<10} {:>7} {:>11}".format(provider, num_frames, "-"))
+                continue
+            h, w = get_resized_shape(args.shape, image_size)
+            tokens = get_image_tokens(provider, w, h)
+            print(
+                "{:<10} {:>7} {:>11} {:>14} {:>14}".format(
+                    provider,
+                    num_frames,
+                    "{}x{}".format(w, h),
+                    tokens,
+                    tokens * num_frames,
+                )
+            )
@@ -0,0 +1,231 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Packed per-episode frame store.
+
+Each episode is stored as <store-directory>/<episode>/frames-<size>.npy, an
+(N, H, W, 3) uint8 BGR array of the episode's frames resized so that their
+longest side is <size>, plus an index.json with the frame names, the native
+frame shape, and the mtime of the episode directory it was built from.
+Arrays are memory-mapped, so reading a frame is a slice of the file instead
+of opening and decoding a PNG.
+"""
+
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import tqdm
+
+from openeqa.utils.decode_utils import decode_frame, get_frame_shape, map_frames
+
+INDEX_NAME = "index.json"
+
+
+def get_array_path(folder: Path, image_size: int) -> Path:
+    return folder / "frames-{}.npy".format(image_size)
+
+
+def build_episode_store(
+    frames: List[Path],
+    store_folder: Path,
+    image_sizes: List[int],
+    num_workers: Optional[int] = None,
+    chunk_size: int = 64,
+) -> None:
+    frames = [Path(f) for f in frames]
+    store_folder.mkdir(parents=True, exist_ok=True)
+    shape = get_frame_shape(str(frames[0]))
+    for image_size in image_sizes:
+        height, width = decode_frame(str(frames[0]), image_size).shape[:2]
+        path = get_array_path(store_folder, image_size)
+        tmp_path = path.with_suffix(".tmp.npy")
+        array = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.uint8, shape=(len(frames), height, width, 3)
+        )
+        for start in range(0, len(frames), chunk_size):
+            chunk = frames[start : start + chunk_size]
+            loaded = map_frames(
+                lambda p: decode_frame(str(p), image_size), chunk, num_workers
+            )
+            array[start : start + len(chunk)] = np.stack(loaded)
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+
+    # written last, so a partially built episode is never used
+    index = {
+        "frames": [f.name for f in frames],
+        "shape": list(shape),
+        "mtime_ns": os.stat(frames[0].parent).st_mtime_ns,
+        "image_sizes": sorted(image_sizes),
+    }
+    json.dump(index, (store_folder / INDEX_NAME).open("w"))
+
+
+class EpisodeStore:
+    def __init__(self, folder: Path, index: dict):
+        self.shape = tuple(index["shape"])
+        self.image_sizes = index["image_sizes"]
+        self.names = {name: idx for idx, name in enumerate(index["frames"])}
+        self.arrays = {
+            image_size: np.load(get_array_path(folder, image_size), mmap_mode="r")
+            for image_size in self.image_sizes
+        }
+
+    def get_frame(self, name: str, image_size: int) -> Optional[np.ndarray]:
+        idx = self.names.get(name)
+        sizes = [s for s in self.image_sizes if s >= image_size]
+        if idx is None or not sizes:
+            return None
+        frame = self.arrays[sizes[0]][idx]
+        if sizes[0] == image_size:
+            return frame  # zero-copy view
+
+        # downscale from the next larger resolution (matches decode_frame)
+        factor = image_size / max(self.shape)
+        dsize = (round(self.shape[1] * factor), round(self.shape[0] * factor))
+        return cv2.resize(frame, dsize=dsize, interpolation=cv2.INTER_AREA)
+
+
+class FrameStore:
+    """Serves frames of <frames_directory>/<episode> from a packed store.
+
+    get_frame returns None for frames the store cannot serve (episode not
+    packed, packed before the episode directory last changed, or only
+    packed at smaller sizes), so callers can fall back to decoding.
+    Episodes are looked up by the folder of the frame path as given, which
+    is resolved once per episode rather than once per frame.
+    """
+
+    def __init__(
+        self,
+        store_directory: Union[str, Path],
+        frames_directory: Union[str, Path],
+    ):
+        self.store_directory = Path(store_directory)
+        self.frames_directory = Path(frames_directory).resolve()
+        self._episodes: Dict[str, Tuple[Path, Optional[EpisodeStore]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _open(self, folder: Path) -> Optional[EpisodeStore]:
+        try:
+            episode = folder.relative_to(self.frames_directory)
+        except ValueError:
+            return None
+        store_folder = self.store_directory / episode
+        index_path = store_folder / INDEX_NAME
+        if not index_path.exists():
+            return None
+        index = json.load(index_path.open("r"))
+        if index["mtime_ns"] != os.stat(folder).st_mtime_ns:
+            print("WARNING: ignoring stale frame store for {}".format(episode))
+            return None
+        return EpisodeStore(store_folder, index)
+
+    def get_episode(self, folder: Union[str, Path]) -> Optional[EpisodeStore]:
+        key = str(folder)
+        with self._lock:
+            if key not in self._episodes:
+                resolved = Path(folder).resolve()
+                self._episodes[key] = (resolved, self._open(resolved))
+            return self._episodes[key][1]
+
+    def get_frame(self, path: str, image_size: Optional[int]) -> Optional[np.ndarray]:
+        frame = None
+        folder, name = os.path.split(str(path))
+        episode = self.get_episode(folder)
+        if episode is not None and image_size:
+            frame = episode.get_frame(name, image_size)
+        with self._lock:
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return frame
+
+    def release(self, folder: Union[str, Path]) -> None:
+        """Closes the memory maps of an episode."""
+        resolved = Path(folder).resolve()
+        with self._lock:
+            for key in [k for k, v in self._episodes.items() if v[0] == resolved]:
+                del self._episodes[key]
+
+    def print_stats(self) -> None:
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return
+        print(
+            "frame store: {:,} lookups, {:.1f}% served from the store".format(
+                lookups, 100.0 * self.hits / lookups
+            )
+        )
+
+
+def build_frame_store(
+    frames_directory: Path,
+    store_directory: Path,
+    image_sizes: List[int],
+    num_workers: Optional[int] = None,
+    force: bool = False,
+) -> None:
+    folders = sorted(p for p in frames_directory.glob("*/*") if p.is_dir())
+    print("found {:,} episodes".format(len(folders)))
+    for folder in tqdm.tqdm(folders):
+        store_folder = store_directory / folder.relative_to(frames_directory)
+        if (store_folder / INDEX_NAME).exists() and not force:
+            continue  # skip existing
+        frames = sorted(folder.glob("*-rgb.png"))
+        if frames:
+            build_episode_store(frames, store_folder, image_sizes, num_workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build a packed frame store")
+    parser.add_argument(
+        "--frames-directory",
+        type=Path,
+        default="data/frames",
+        help="path episode histories (default: data/frames)",
+    )
+    parser.add_argument(
+        "--store-directory",
+        type=Path,
+        default="data/store",
+        help="output directory (default: data/store)",
+    )
+    parser.add_argument(
+        "--image-sizes",
+        type=int,
+        nargs="+",
+        default=[512],
+        help="longest side of stored frames (default: 512)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="threads for decoding frames (default: 8)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild existing episodes (default: false)",
+    )
+    args = parser.parse_args()
+    build_frame_store(
+        args.frames_directory,
+        args.store_directory,
+        args.image_sizes,
+        num_workers=args.num_workers,
+        force=args.force,
+    )
@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+
+
+def add_streaming_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream responses and close them once the answer line is complete "
+        "(default: false)",
+    )
+
+
+def is_answer_complete(text: str) -> bool:
+    """Returns True once the "A:" line kept by the baselines' output parsers
+    is followed by a newline. Text without an "A:" line is read in full."""
+    start_idx = text.find("A:")
+    return start_idx != -1 and "\n" in text[start_idx:]
+
+
+def read_stream(
+    chunks: Iterable[str],
+    start_time: float,
+    stop_fn: Optional[Callable[[str], bool]] = None,
+    latency: Optional[dict] = None,
+) -> str:
+    """Concatenates text chunks until stop_fn(text) is True; the caller then
+    closes the stream. If latency is given, it is updated with the seconds
+    from start_time to the first chunk and to the end of the answer, and
+    whether the stream was stopped early."""
+    text = ""
+    first_token_time = None
+    stopped = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter()
+        text += chunk
+        if stop_fn is not None and stop_fn(text):
+            stopped = True
+            break
+    end_time = time.perf_counter()
+    if latency is not None:
+        latency["first_token_seconds"] = (first_token_time or end_time) - start_time
+        latency["answer_seconds"] = end_time - start_time
+        latency["stopped_early"] = stopped
+    return text
+
+
+class StreamStats:
+    """Tracks first-token and full-answer latency of streamed requests."""
+
+    def __init__(self):
+        self.first_token_seconds: List[float] = []
+        self.answer_seconds: List[float] = []
+        self.num_stopped = 0
+        self._lock = threading.Lock()
+
+    def add(self, latency: dict) -> None:
+        if "answer_seconds" not in latency:
+            return
+        with self._lock:
+            self.first_token_seconds.append(latency["first_token_seconds"])
+            self.answer_seconds.append(latency["answer_seconds"])
+            self.num_stopped += latency["stopped_early"]
+
+    def print_stats(self) -> None:
+        if not self.answer_seconds:
+            return
+        print(
+            "streaming: {:,} requests, {:,} closed after the answer line".format(
+                len(self.answer_seconds), self.num_stopped
+            )
+        )
+        for name, seconds in [
+            ("first token", self.first_token_seconds),
+            ("full answer", self.answer_seconds),
+        ]:
+            print(
+                "  {}: mean {:.2f}s, p50 {:.2f}s, p90 {:.2f}s".format(
+                    name,
+                    np.mean(seconds),
+                    np.percentile(seconds, 50),
+                    np.percentile(seconds, 90),
+                )
+            )
@@ -0,0 +1,412 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import math
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+from openeqa.utils.batch_utils import QuestionBatcher, parse_numbered_answers
+from openeqa.utils.cascade_utils import CascadeStats, run_cascade
+from openeqa.utils.embedding_utils import (
+    DEFAULT_EMBEDDING_MODEL,
+    EMBEDDING_BACKENDS,
+    get_embedding_backend,
+)
+from openeqa.utils.episode_utils import EpisodeScheduler
+from openeqa.utils.frame_utils import FrameCache, FrameTimings
+from openeqa.utils.runner_utils import RateLimiter, run_baseline
+from openeqa.utils.sampling_utils import majority_vote, sample_parallel
+from openeqa.utils.selection_utils import FRAME_SELECTION_METHODS, select_frames
+from openeqa.utils.sizing_utils import get_image_size, get_min_image_tokens
+from openeqa.utils.store_utils import FrameStore
+from openeqa.utils.stream_utils import StreamStats
+
+
+def add_frame_args(parser: argparse.ArgumentParser) -> None:
+    """Frame selection, encoding, and caching options of the vision baselines
+    (see check_frame_args)."""
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=512,
+        help="image size (default: 512)",
+    )
+    parser.add_argument(
+        "--frame-selection",
+        choices=FRAME_SELECTION_METHODS,
+        default="uniform",
+        help="how frames are selected from an episode (default: uniform)",
+    )
+    parser.add_argument(
+        "--distinct-threshold",
+        type=int,
+        default=8,
+        help="min hash distance between distinct frames (default: 8)",
+    )
+    parser.add_argument(
+        "--pose-direction-weight",
+        type=float,
+        default=1.0,
+        help="weight of view direction vs. position for pose selection (default: 1.0)",
+    )
+    parser.add_argument(
+        "--index-directory",
+        type=Path,
+        default="data/index",
+        help="per-episode frame index cache (default: data/index)",
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=list(EMBEDDING_BACKENDS),
+        default="clip",
+        help="frame embedding backend for retrieval (default: clip)",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=DEFAULT_EMBEDDING_MODEL,
+        help="frame embedding model (default: {})".format(DEFAULT_EMBEDDING_MODEL),
+    )
+    parser.add_argument(
+        "--num-context-frames",
+        type=int,
+        default=2,
+        help="evenly spaced frames added to retrieved frames (default: 2)",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        help="image tokens per request; overrides --image-size (default: none)",
+    )
+    parser.add_argument(
+        "--mosaic-size",
+        type=int,
+        help="tile this many consecutive frames into each image (default: none)",
+    )
+    parser.add_argument(
+        "--image-format",
+        choices=["png", "jpeg", "webp"],
+        default="png",
+        help="frame encoding (default: png)",
+    )
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        help="jpeg/webp quality (default: 90)",
+    )
+    parser.add_argument(
+        "--payload-budget",
+        type=float,
+        help="per-request frame payload budget in MB (default: none)",
+    )
+    parser.add_argument(
+        "--cascade-num-frames",
+        type=int,
+        help="ask with this many frames first, escalating if unsure (default: none)",
+    )
+    parser.add_argument(
+        "--cascade-min-confidence",
+        type=int,
+        default=4,
+        help="re-ask with --num-frames below this confidence (1-5, default: 4)",
+    )
+    parser.add_argument(
+        "--questions-per-request",
+        type=int,
+        default=1,
+        help="questions of an episode answered by one request (default: 1)",
+    )
+    parser.add_argument(
+        "--frame-cache-size",
+        type=int,
+        default=1024,
+        help="in-memory encoded frame cache size in MB (default: 1024)",
+    )
+    parser.add_argument(
+        "--frame-cache-directory",
+        type=Path,
+        help="optional on-disk encoded frame cache (default: none)",
+    )
+    parser.add_argument(
+        "--store-directory",
+        type=Path,
+        help="packed frame store to read frames from (default: none)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="threads for loading and encoding frames (default: 8)",
+    )
+    parser.add_argument(
+        "--max-live-episodes",
+        type=int,
+        default=2,
+        help="episodes whose frames are held in memory at once (default: 2)",
+    )
+
+
+def check_frame_args(
+    parser: argparse.ArgumentParser, args: argparse.Namespace, provider: str
+) -> None:
+    if args.payload_budget is not None and args.image_format == "png":
+        parser.error("--payload-budget requires --image-format jpeg or webp")
+    if args.questions_per_request > 1 and args.frame_selection == "retrieval":
+        parser.error("--questions-per-request requires question-independent frames")
+    if args.questions_per_request > 1 and args.cascade_num_frames:
+        parser.error("--questions-per-request cannot be used with a cascade")
+    if args.num_samples > 1 and (
+        args.questions_per_request > 1 or args.cascade_num_frames
+    ):
+        parser.error("--num-samples requires single questions without a cascade")
+    if args.token_budget is not None:
+        num_images = max(args.num_frames, args.cascade_num_frames or 0)
+        if args.mosaic_size:
+            num_images = math.ceil(num_images / args.mosaic_size)
+        min_tokens = num_images * get_min_image_tokens(provider)
+        if args.token_budget < min_tokens:
+            parser.error(
+                "--token-budget is below the {} minimum of {} tokens for {} "
+                "images".format(provider, min_tokens, num_images)
+            )
+    args.max_payload_bytes = None
+    if args.payload_budget is not None:
+        args.max_payload_bytes = int(args.payload_budget * 1e6)
+
+
+class VisionPipeline:
+    """Answers the questions of a vision baseline (see add_frame_args).
+
+    Questions are grouped by episode, frames are selected and the first
+    request of each question is prepared ahead of time, and questions are
+    answered by a single request, a cascade, a multi-question batch, or
+    several samples. A baseline only provides its provider's requests:
+
+    - prepare_messages_fn(question, image_paths, image_size, abstain, ...)
+      builds a request for a question (or a list of numbered questions),
+      taking the frame options of its provider's prepare_*_vision_messages.
+    - ask_fn(messages, paths, num_questions, raw, num_samples, latency) sends
+      it and returns the answer (the unparsed output if raw), or a list of
+      num_samples answers. Streamed requests update the latency dict.
+
+    If samples_per_request is False, --num-samples sends parallel requests.
+    """
+
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        provider: str,
+        prepare_messages_fn: Callable[..., List],
+        ask_fn: Callable[..., Optional[Union[str, List[str]]]],
+        samples_per_request: bool = False,
+    ):
+        self.args = args
+        self.provider = provider
+        self.prepare_messages_fn = prepare_messages_fn
+        self.ask_fn = ask_fn
+        self.samples_per_request = samples_per_request
+
+        # share encoded frames across questions
+        self.frame_cache = FrameCache(
+            max_bytes=args.frame_cache_size * 2**20,
+            cache_directory=args.frame_cache_directory,
+        )
+        self.frame_timings = FrameTimings()
+        self.rate_limiter = RateLimiter(args.requests_per_minute)
+        self.stream_stats = StreamStats()
+        self.frame_store = None
+        if args.store_directory is not None:
+            self.frame_store = FrameStore(args.store_directory, args.frames_directory)
+        self.embedding_backend = None
+        if args.frame_selection == "retrieval":
+            self.embedding_backend = get_embedding_backend(
+                args.embedding_backend, args.embedding_model
+            )
+        self.cascade_stats = CascadeStats(
+            provider,
+            image_size=args.image_size,
+            token_budget=args.token_budget,
+            mosaic_size=args.mosaic_size,
+        )
+
+        # group pending questions by episode to load each episode once
+        self.scheduler = EpisodeScheduler(
+            args.frames_directory,
+            frame_cache=self.frame_cache,
+            frame_store=self.frame_store,
+            max_live_episodes=args.max_live_episodes,
+        )
+
+        # optionally answer several questions of an episode per request
+        self.batcher = None
+        if args.questions_per_request > 1:
+            self.batcher = QuestionBatcher(args.questions_per_request)
+
+    def schedule(self, items: List[dict]) -> List[dict]:
+        items = self.scheduler.schedule(items)
+        return self.batcher.schedule(items) if self.batcher else items
+
+    def select(self, item: dict, frames: List[str], num_frames: int) -> List[str]:
+        args = self.args
+        return select_frames(
+            frames,
+            num_frames,
+            method=args.frame_selection,
+            index_directory=args.index_directory / item["episode_history"],
+            distinct_threshold=args.distinct_threshold,
+            pose_direction_weight=args.pose_direction_weight,
+            num_workers=args.num_workers,
+            question=item["question"],
+            embedding_backend=self.embedding_backend,
+            num_context_frames=args.num_context_frames,
+        )
+
+    def get_messages(
+        self,
+        item: dict,
+        paths: List[str],
+        abstain: bool = False,
+        questions: Optional[List[str]] = None,
+    ) -> List:
+        args = self.args
+        # pick the largest image size that fits the token budget
+        image_size = get_image_size(
+            self.provider,
+            self.scheduler.manifest.get_shape(item["episode_history"]),
+            len(paths),
+            image_size=args.image_size,
+            token_budget=args.token_budget,
+            mosaic_size=args.mosaic_size,
+        )
+        return self.prepare_messages_fn(
+            question=questions or item["question"],
+            image_paths=paths,
+            image_size=image_size,
+            image_format=args.image_format,
+            image_quality=args.image_quality,
+            max_payload_bytes=args.max_payload_bytes,
+            frame_cache=self.frame_cache,
+            num_workers=args.num_workers,
+            frame_timings=self.frame_timings,
+            mosaic_size=args.mosaic_size,
+            frame_store=self.frame_store,
+            abstain=abstain,
+        )
+
+    def prepare(self, item: dict) -> dict:
+        # select frames and encode the first request (possibly ahead of time)
+        args, batcher = self.args, self.batcher
+        frames = self.scheduler.acquire(item["episode_history"])
+        try:
+            prepared = {"paths": self.select(item, frames, args.num_frames)}
+            prepared["cascade_paths"] = None
+            if args.cascade_num_frames:
+                cascade_paths = self.select(item, frames, args.cascade_num_frames)
+                prepared["cascade_paths"] = cascade_paths
+            if batcher is None:
+                first_paths = prepared["cascade_paths"] or prepared["paths"]
+                prepared["messages"] = self.get_messages(
+                    item, first_paths, abstain=bool(args.cascade_num_frames)
+                )
+            elif batcher.get_batch(item)[0] is item:
+                # the batch request is usually sent by its first question
+                questions = [i["question"] for i in batcher.get_batch(item)]
+                prepared["batch_messages"] = self.get_messages(
+                    item, prepared["paths"], questions=questions
+                )
+            return prepared
+        except Exception:
+            self.scheduler.release(item["episode_history"])
+            raise
+
+    def ask(
+        self,
+        item: dict,
+        prepared: dict,
+        paths: List[str],
+        abstain: bool = False,
+        questions: Optional[List[str]] = None,
+        num_samples: int = 1,
+        latency: Optional[dict] = None,
+    ) -> Optional[Union[str, List[str]]]:
+        # only the first request of a question is prepared in advance
+        key = "batch_messages" if questions else "messages"
+        messages = prepared.pop(key, None)
+        if messages is None:
+            messages = self.get_messages(item, paths, abstain, questions)
+        latency = {} if latency is None else latency
+        self.rate_limiter.wait()
+        answer = self.ask_fn(
+            messages,
+            paths,
+            num_questions=len(questions or [item]),
+            raw=abstain or bool(questions),
+            num_samples=num_samples,
+            latency=latency,
+        )
+        self.stream_stats.add(latency)
+        return answer
+
+    def answer(self, item: dict, prepared: dict) -> dict:
+        args = self.args
+
+        def ask(paths: List[str], abstain: bool = False, **kwargs):
+            return self.ask(item, prepared, paths, abstain, **kwargs)
+
+        def ask_batch(items: List[dict]) -> List[Optional[str]]:
+            questions = [i["question"] for i in items]
+            output = ask(prepared["paths"], questions=questions)
+            return parse_numbered_answers(output, len(items))
+
+        try:
+            result = {}
+            paths = prepared["paths"]
+            if self.batcher is not None:
+                # unparsed answers fall back to a single-question request
+                result["answer"] = self.batcher.get(item, ask_batch) or ask(paths)
+            elif prepared["cascade_paths"]:
+                result["answer"], requests = run_cascade(
+                    ask, prepared["cascade_paths"], paths, args.cascade_min_confidence
+                )
+                result.update(self.cascade_stats.add(requests, paths))
+            elif args.num_samples > 1 and self.samples_per_request:
+                # all samples come from one request, sending the frames once
+                result["samples"] = ask(paths, num_samples=args.num_samples) or []
+                result["answer"] = majority_vote(result["samples"])
+            elif args.num_samples > 1:
+                # one request per sample, sent in parallel
+                result["samples"] = sample_parallel(
+                    lambda: ask(paths), args.num_samples
+                )
+                result["answer"] = majority_vote(result["samples"])
+            else:
+                result["answer"] = ask(paths, latency=result)
+            return result
+        finally:
+            self.scheduler.release(item["episode_history"])
+
+    def run(self) -> None:
+        try:
+            run_baseline(
+                self.args,
+                self.answer,
+                schedule_fn=self.schedule,
+                prepare_fn=self.prepare,
+            )
+        finally:
+            self.scheduler.close()
+        self.print_stats()
+
+    def print_stats(self) -> None:
+        self.scheduler.print_stats()
+        self.frame_cache.print_stats()
+        if self.frame_store is not None:
+            self.frame_store.print_stats()
+        self.frame_timings.print_stats()
+        self.cascade_stats.print_stats()
+        self.stream_stats.print_stats()
+        if self.batcher is not None:
+            self.batcher.print_stats()
@@ -0,0 +1,74 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("anthropic")
+
+from openeqa.utils.anthropic_utils import PromptCacheGate
+
+
+class Requests:
+    """Sends concurrent requests with the same prefix through a gate; the
+    first num_failures requests that are let through fail."""
+
+    def __init__(self, gate: PromptCacheGate, num_failures: int = 0):
+        self.gate = gate
+        self.num_failures = num_failures
+        self.num_sent = 0
+        self.num_active = 0
+        self.peaks = []  # concurrent requests when each request was sent
+        self.results = []
+        self._lock = threading.Lock()
+
+    def request(self) -> None:
+        try:
+            with self.gate.hold("frames"):
+                with self._lock:
+                    fail = self.num_sent < self.num_failures
+                    self.num_sent += 1
+                    self.num_active += 1
+                    self.peaks.append(self.num_active)
+                time.sleep(0.05)
+                with self._lock:
+                    self.num_active -= 1
+                if fail:
+                    raise RuntimeError("request failed")
+            self.results.append("ok")
+        except RuntimeError:
+            self.results.append("failed")
+
+    def send(self, num_requests: int) -> None:
+        threads = [threading.Thread(target=self.request) for _ in range(num_requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def test_waiters_are_released_after_the_first_success():
+    gate = PromptCacheGate()
+    requests = Requests(gate)
+    requests.send(4)
+    assert requests.results == ["ok"] * 4
+    assert requests.peaks[0] == 1  # the first request is sent alone
+    assert max(requests.peaks) > 1
+
+    # once the prefix is cached, requests are no longer held back
+    requests = Requests(gate)
+    requests.send(4)
+    assert max(requests.peaks) == 4
+
+
+def test_failed_first_request_hands_over_to_one_waiter():
+    requests = Requests(PromptCacheGate(), num_failures=2)
+    requests.send(5)
+    assert sorted(requests.results) == ["failed"] * 2 + ["ok"] * 3
+    # each failure lets a single waiter through, which writes the entry
+    assert requests.peaks[:3] == [1, 1, 1]
+    assert max(requests.peaks) > 1
@@ -0,0 +1,98 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from openeqa.utils.batch_utils import QuestionBatcher, parse_numbered_answers
+
+
+@pytest.mark.parametrize(
+    "output,expected",
+    [
+        ("1. A: red\n2. A: two\n3. A: yes", ["red", "two", "yes"]),
+        ("**1.** red\n2) two\nQ3: yes", ["red", "two", "yes"]),
+        # unnumbered lines continue the previous answer
+        (
+            "Here you go:\n1. A: the red\nsofa\n\n3. A: yes",
+            ["the red sofa", None, "yes"],
+        ),
+        # out-of-range, repeated and empty answers are dropped
+        ("1. A: red\n1. A: blue\n2. A:\n4. A: four", ["red", None, None]),
+        ("I cannot see the frames.", [None, None, None]),
+        (None, [None, None, None]),
+    ],
+)
+def test_parse_numbered_answers(output, expected):
+    assert parse_numbered_answers(output, 3) == expected
+
+
+def make_items():
+    episodes = ["ep0", "ep1", "ep0", "ep0", "ep1"]
+    return [
+        {"question_id": "q{}".format(i), "episode_history": episode}
+        for i, episode in enumerate(episodes)
+    ]
+
+
+class Model:
+    def __init__(self, answers=None, error=None):
+        self.answers = answers or {}
+        self.error = error
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append([item["question_id"] for item in items])
+        if self.error is not None:
+            raise self.error
+        return [self.answers.get(item["question_id"]) for item in items]
+
+
+def test_batches_are_grouped_by_episode():
+    batcher = QuestionBatcher(batch_size=2)
+    scheduled = batcher.schedule(make_items())
+    assert [item["question_id"] for item in scheduled] == [
+        "q0",
+        "q2",
+        "q3",
+        "q1",
+        "q4",
+    ]
+    assert [item["question_id"] for item in batcher.get_batch(scheduled[1])] == [
+        "q0",
+        "q2",
+    ]
+
+
+def test_each_batch_is_asked_once():
+    batcher = QuestionBatcher(batch_size=3)
+    scheduled = batcher.schedule(make_items())
+    ask_fn = Model({"q{}".format(i): "answer {}".format(i) for i in range(5)})
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        answers = list(executor.map(lambda item: batcher.get(item, ask_fn), scheduled))
+    assert answers == ["answer 0", "answer 2", "answer 3", "answer 1", "answer 4"]
+    assert sorted(ask_fn.batches) == [["q0", "q2", "q3"], ["q1", "q4"]]
+    assert batcher.num_requests == 2
+    assert batcher.num_fallbacks == 0
+
+
+def test_missing_answers_fall_back():
+    batcher = QuestionBatcher(batch_size=3)
+    scheduled = batcher.schedule(make_items())
+    ask_fn = Model({"q0": "red", "q3": "yes"})
+    answers = [batcher.get(item, ask_fn) for item in scheduled[:3]]
+    assert answers == ["red", None, "yes"]
+    assert batcher.num_fallbacks == 1
+
+
+def test_failed_batch_falls_back():
+    batcher = QuestionBatcher(batch_size=3)
+    scheduled = batcher.schedule(make_items())
+    ask_fn = Model(error=TimeoutError("batch request failed"))
+    answers = [batcher.get(item, ask_fn) for item in scheduled]
+    assert answers == [None] * 5
+    assert len(ask_fn.batches) == 2  # a failed batch is not asked again
+    assert batcher.num_fallbacks == 5
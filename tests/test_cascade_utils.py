@@ -0,0 +1,66 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+from openeqa.utils.cascade_utils import parse_cascade_output, run_cascade
+
+CASCADE_PATHS = ["a.png", "b.png"]
+PATHS = ["a.png", "b.png", "c.png", "d.png"]
+
+
+@pytest.mark.parametrize(
+    "output,expected",
+    [
+        ("A: the red sofa\nConfidence: 5", ("the red sofa", 5)),
+        ("A: red\nConfidence: 2", ("red", 2)),
+        ("Reasoning first.\nA: red\nConfidence:4\n", ("red", 4)),
+        ("A: I don't know.\nConfidence: 1", (None, 1)),
+        ("A: unknown", (None, None)),
+        ("A:\nConfidence: 3", (None, 3)),
+        ("red", ("red", None)),
+        ("A: red\nConfidence: high", ("red", None)),
+        ("", (None, None)),
+        (None, (None, None)),
+    ],
+)
+def test_parse_cascade_output(output, expected):
+    assert parse_cascade_output(output) == expected
+
+
+class Model:
+    def __init__(self, cascade_output):
+        self.cascade_output = cascade_output
+        self.requests = []
+
+    def __call__(self, paths, abstain):
+        self.requests.append((paths, abstain))
+        return self.cascade_output if abstain else "blue"
+
+
+def test_confident_answer_is_kept():
+    ask_fn = Model("A: red\nConfidence: 4")
+    answer, requests = run_cascade(ask_fn, CASCADE_PATHS, PATHS, min_confidence=4)
+    assert answer == "red"
+    assert requests == [CASCADE_PATHS]
+    assert ask_fn.requests == [(CASCADE_PATHS, True)]
+
+
+@pytest.mark.parametrize(
+    "cascade_output",
+    [
+        "A: red\nConfidence: 3",  # low confidence
+        "A: I don't know\nConfidence: 5",  # abstained
+        "A: red",  # no confidence
+        "Sorry, I can't help with that",  # malformed
+        None,  # failed request
+    ],
+)
+def test_escalates_to_full_frames(cascade_output):
+    ask_fn = Model(cascade_output)
+    answer, requests = run_cascade(ask_fn, CASCADE_PATHS, PATHS, min_confidence=4)
+    assert answer == "blue"
+    assert requests == [CASCADE_PATHS, PATHS]
+    assert ask_fn.requests == [(CASCADE_PATHS, True), (PATHS, False)]
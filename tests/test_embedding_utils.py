@@ -0,0 +1,111 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+from typing import Dict, List
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.embedding_utils import EmbeddingBackend, load_embedding_index
+from openeqa.utils.selection_utils import release_index, select_frames
+
+
+class RandomBackend(EmbeddingBackend):
+    """Projects 8x8 grayscale thumbnails with fixed random weights; texts
+    are embedded as the query vectors registered in queries."""
+
+    name = "random"
+
+    def __init__(self, dim: int = 16, seed: int = 0):
+        self.weights = np.random.default_rng(seed).normal(size=(64, dim))
+        self.queries: Dict[str, np.ndarray] = {}
+        self.num_image_calls = 0
+
+    def embed_images(self, frames: List[np.ndarray]) -> np.ndarray:
+        self.num_image_calls += 1
+        thumbnails = [
+            cv2.resize(cv2.cvtColor(f, cv2.COLOR_BGR2GRAY), (8, 8)) for f in frames
+        ]
+        pixels = np.stack(thumbnails).reshape(len(frames), -1) / 255.0 - 0.5
+        features = pixels @ self.weights
+        features /= np.linalg.norm(features, axis=1, keepdims=True)
+        return features.astype(np.float32)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.queries[text] for text in texts])
+
+
+@pytest.fixture
+def episode(tmp_path):
+    folder = tmp_path / "frames" / "episode"
+    folder.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    paths = []
+    for idx in range(10):
+        path = folder / "{:05d}-rgb.png".format(idx)
+        cv2.imwrite(str(path), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+        paths.append(path)
+    yield paths, tmp_path / "index"
+    release_index(folder)
+
+
+def test_embedding_backend_is_abstract():
+    with pytest.raises(TypeError):
+        EmbeddingBackend()
+
+
+def test_retrieval_returns_top_k_frames(episode):
+    paths, index_directory = episode
+    backend = RandomBackend()
+    embeddings = load_embedding_index(paths, index_directory, backend)
+    query = embeddings[2] + embeddings[6]
+    backend.queries["where is the sofa?"] = query / np.linalg.norm(query)
+
+    selected = select_frames(
+        paths,
+        2,
+        method="retrieval",
+        index_directory=index_directory,
+        question="where is the sofa?",
+        embedding_backend=backend,
+        num_context_frames=0,
+    )
+    assert selected == [str(paths[2]), str(paths[6])]
+
+    # context frames are evenly spaced and kept in time order
+    selected = select_frames(
+        paths,
+        4,
+        method="retrieval",
+        index_directory=index_directory,
+        question="where is the sofa?",
+        embedding_backend=backend,
+        num_context_frames=2,
+    )
+    assert selected == [str(paths[i]) for i in [0, 2, 6, 9]]
+
+
+def test_embedding_index_is_reused_until_frames_change(episode):
+    paths, index_directory = episode
+    backend = RandomBackend()
+    embeddings = np.array(load_embedding_index(paths, index_directory, backend))
+    assert embeddings.shape == (10, 16)
+    assert backend.num_image_calls == 1
+
+    # re-used from memory, then from disk once the episode is released
+    load_embedding_index(paths, index_directory, backend)
+    release_index(paths[0].parent)
+    reloaded = load_embedding_index(paths, index_directory, backend)
+    assert backend.num_image_calls == 1
+    np.testing.assert_array_equal(reloaded, embeddings)
+
+    # a modified frame makes the index stale
+    stat = os.stat(paths[3])
+    os.utime(paths[3], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    release_index(paths[0].parent)
+    load_embedding_index(paths, index_directory, backend)
+    assert backend.num_image_calls == 2
@@ -0,0 +1,87 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.episode_utils import EpisodeScheduler
+
+EPISODES = ["scannet-v0/ep0", "scannet-v0/ep1", "scannet-v0/ep2"]
+
+
+@pytest.fixture
+def frames_directory(tmp_path):
+    for episode in EPISODES:
+        folder = tmp_path / episode
+        folder.mkdir(parents=True)
+        for idx in range(3):
+            path = folder / "{:05d}-rgb.png".format(idx)
+            cv2.imwrite(str(path), np.zeros((8, 8, 3), dtype=np.uint8))
+    return tmp_path
+
+
+def make_items(episodes):
+    return [
+        {"question_id": "q{}".format(i), "episode_history": episode}
+        for i, episode in enumerate(episodes)
+    ]
+
+
+def test_schedule_groups_questions_by_episode(frames_directory):
+    scheduler = EpisodeScheduler(frames_directory)
+    items = make_items([EPISODES[1], EPISODES[0], EPISODES[1], EPISODES[0]])
+    scheduled = scheduler.schedule(items)
+    assert [item["question_id"] for item in scheduled] == ["q0", "q2", "q1", "q3"]
+
+
+def test_acquire_waits_for_released_episodes(frames_directory):
+    scheduler = EpisodeScheduler(frames_directory, max_live_episodes=2)
+    scheduler.schedule(make_items([EPISODES[0], EPISODES[0], EPISODES[1], EPISODES[2]]))
+
+    frames = scheduler.acquire(EPISODES[0])
+    assert [p.name for p in frames] == ["0000{}-rgb.png".format(i) for i in range(3)]
+    assert scheduler.acquire(EPISODES[0]) == frames  # already live
+    scheduler.acquire(EPISODES[1])
+
+    acquired = threading.Event()
+
+    def acquire_third():
+        scheduler.acquire(EPISODES[2])
+        acquired.set()
+
+    thread = threading.Thread(target=acquire_third)
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    # the episode stays live until all of its questions are released
+    scheduler.release(EPISODES[0])
+    assert not acquired.wait(0.1)
+    scheduler.release(EPISODES[0])
+    assert acquired.wait(5)
+    thread.join()
+    assert scheduler.num_episodes == 3
+    assert scheduler.max_live == 2
+
+
+def test_close_fails_waiting_acquires(frames_directory):
+    scheduler = EpisodeScheduler(frames_directory, max_live_episodes=1)
+    scheduler.schedule(make_items(EPISODES[:2]))
+    scheduler.acquire(EPISODES[0])
+    errors = []
+
+    def acquire_second():
+        try:
+            scheduler.acquire(EPISODES[1])
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=acquire_second)
+    thread.start()
+    scheduler.close()
+    thread.join(5)
+    assert len(errors) == 1
@@ -0,0 +1,143 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import base64
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.frame_utils import (
+    FrameCache,
+    compare_reduced_decode,
+    get_frame_payloads,
+    load_frame,
+    load_mosaic,
+)
+
+
+@pytest.fixture
+def paths(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for idx in range(4):
+        path = tmp_path / "{:05d}-rgb.png".format(idx)
+        cv2.imwrite(str(path), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+        paths.append(str(path))
+    return paths
+
+
+def make_key(path, raw=False):
+    return (str(path), 1, 512, "png", None, raw)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = FrameCache(max_bytes=10)
+    cache.put(make_key("a"), "aaaa")
+    cache.put(make_key("b"), "bbbb")
+    assert cache.get(make_key("a")) == "aaaa"  # b is now least recently used
+    cache.put(make_key("c"), "cccc")
+    assert len(cache) == 2
+    assert cache.get(make_key("b")) is None
+    assert cache.get(make_key("a")) == "aaaa"
+    assert cache.get(make_key("c")) == "cccc"
+    assert cache.stats()["memory_bytes"] == 8
+
+    # a payload larger than the cache is not kept in memory
+    cache.put(make_key("d"), "d" * 11)
+    assert len(cache) == 0
+
+
+def test_cache_disk_round_trip(tmp_path):
+    cache = FrameCache(max_bytes=4, cache_directory=tmp_path)
+    cache.put(make_key("a"), "aaaa")
+    cache.put(make_key("b", raw=True), b"bbbb")
+    assert cache.get(make_key("a")) == "aaaa"  # evicted from memory
+    assert cache.disk_hits == 1
+
+    reopened = FrameCache(cache_directory=tmp_path)
+    assert reopened.get(make_key("b", raw=True)) == b"bbbb"
+    assert reopened.get(make_key("b")) is None  # raw and base64 are separate
+    assert reopened.get(make_key("a")) == "aaaa"
+    assert (reopened.disk_hits, reopened.misses) == (2, 1)
+    assert not list(tmp_path.rglob("*.tmp*"))
+
+
+def test_cache_release_drops_episode(tmp_path):
+    cache = FrameCache(cache_directory=tmp_path / "cache")
+    episode = tmp_path / "frames" / "episode"
+    other = tmp_path / "frames" / "episode-2"
+    cache.put(make_key(episode / "00000-rgb.png"), "aaaa")
+    cache.put(make_key("mosaic:{}".format(episode / "00000-rgb.png")), "bbbb")
+    cache.put(make_key(other / "00000-rgb.png"), "cccc")
+
+    # only exact folder prefixes are released, not episode-2
+    assert cache.release(episode) == 8
+    assert len(cache) == 1
+    assert cache.get(make_key(episode / "00000-rgb.png")) == "aaaa"  # from disk
+    assert cache.memory_hits == 0
+
+
+@pytest.mark.parametrize("mosaic_size", [None, 2])
+def test_raw_payloads_match_base64_payloads(tmp_path, paths, mosaic_size):
+    cache = FrameCache(cache_directory=tmp_path / "cache")
+    kwargs = dict(image_size=32, image_format="jpeg", mosaic_size=mosaic_size)
+    encoded = get_frame_payloads(paths, cache=cache, **kwargs)
+    raw = get_frame_payloads(paths, cache=cache, raw=True, **kwargs)
+    assert all(isinstance(p, bytes) for p in raw)
+    assert raw == [base64.b64decode(p) for p in encoded]
+
+    # raw and base64 payloads are cached separately, in memory and on disk
+    assert get_frame_payloads(paths, cache=cache, raw=True, **kwargs) == raw
+    disk_cache = FrameCache(cache_directory=tmp_path / "cache")
+    assert get_frame_payloads(paths, cache=disk_cache, raw=True, **kwargs) == raw
+    assert get_frame_payloads(paths, cache=disk_cache, **kwargs) == encoded
+    assert disk_cache.disk_hits == 2 * len(raw)
+
+
+def test_mosaic_without_image_size_keeps_full_resolution(paths):
+    mosaic = load_mosaic(paths[:3], image_size=None, mosaic_size=4)
+    assert mosaic.shape == (2 * 48, 2 * 64, 3)
+    np.testing.assert_array_equal(mosaic[:48, :64], load_frame(paths[0], None))
+
+
+def test_cache_keys_use_recorded_mtimes(tmp_path, paths):
+    cache = FrameCache()
+    cache.set_mtimes(paths[:2], [1, 2])
+    get_frame_payloads(paths, image_size=32, cache=cache)
+    mtimes = sorted(key[1] for key in cache._entries)
+    assert mtimes[:2] == [1, 2]
+    assert mtimes[2:] == sorted(os.stat(p).st_mtime_ns for p in paths[2:])
+
+    # released episodes fall back to the file mtime
+    cache.release(tmp_path)
+    assert cache.get_mtime(paths[0]) == os.stat(paths[0]).st_mtime_ns
+
+
+def write_smooth_frame(path, shape=(480, 640)):
+    # a blurred gradient with texture, like a camera frame (resizing pure
+    # noise differs between interpolation methods)
+    ys, xs = np.mgrid[: shape[0], : shape[1]]
+    frame = np.stack([xs * 255 // shape[1], ys * 255 // shape[0], xs * 0 + 128], -1)
+    texture = np.random.default_rng(0).integers(-32, 33, frame.shape)
+    frame = np.clip(frame + texture, 0, 255).astype(np.uint8)
+    cv2.imwrite(str(path), cv2.GaussianBlur(frame, (0, 0), 2))
+
+
+@pytest.mark.parametrize("image_size", [64, 128, 300])
+def test_reduced_decode_error_is_bounded(tmp_path, image_size):
+    path = tmp_path / "00000-rgb.jpg"
+    write_smooth_frame(path)
+    mean_error, _ = compare_reduced_decode(str(path), image_size)
+    assert mean_error <= 2.0  # the default --max-pixel-error
+
+
+def test_reduced_decode_only_applies_to_jpeg(tmp_path):
+    path = tmp_path / "00000-rgb.png"
+    write_smooth_frame(path)
+    full = load_frame(str(path), image_size=128, reduced_decode=False)
+    reduced = load_frame(str(path), image_size=128, reduced_decode=True)
+    np.testing.assert_array_equal(full, reduced)
@@ -0,0 +1,92 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from openeqa.utils.google_utils import (
+    FrameAssetManager,
+    LocalFileUploader,
+    cancel_stream,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def uploader(clock):
+    return LocalFileUploader(ttl=100, clock=clock)
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_frames_are_uploaded_once(clock, uploader, num_workers):
+    frame_assets = FrameAssetManager(
+        uploader, expiry_margin=10, num_workers=num_workers, clock=clock
+    )
+    payloads = [b"frame-0", b"frame-1", b"frame-2", b"frame-0"]
+    handles = frame_assets.get_handles(payloads, "image/png")
+    assert len(uploader.files) == 3
+    assert handles[0] == handles[3]
+    assert len({h["file_data"]["file_uri"] for h in handles}) == 3
+
+    # later questions re-use the uploaded frames
+    assert frame_assets.get_handles(payloads[:3], "image/png") == handles[:3]
+    assert len(uploader.files) == 3
+    assert frame_assets.num_uploads == 3
+    assert frame_assets.num_reuses == 4
+    frame_assets.close()
+
+
+def test_expired_frames_are_uploaded_again(clock, uploader):
+    frame_assets = FrameAssetManager(uploader, expiry_margin=10, clock=clock)
+    handle = frame_assets.get_handle(b"frame-0", "image/png")
+
+    # still valid until expiry_margin seconds before it expires
+    clock.time = 89
+    assert frame_assets.get_handle(b"frame-0", "image/png") == handle
+    clock.time = 91
+    assert frame_assets.get_handle(b"frame-0", "image/png") != handle
+    assert len(uploader.files) == 2
+    assert frame_assets.num_uploads == 2
+    frame_assets.close()
+
+
+class Call:
+    def __init__(self, error=None):
+        self.error = error
+        self.num_cancels = 0
+
+    def cancel(self):
+        self.num_cancels += 1
+        if self.error is not None:
+            raise self.error
+
+
+class Response:
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+
+def test_cancel_stream():
+    call = Call()
+    assert cancel_stream(Response(call))
+    assert call.num_cancels == 1
+
+    # a missing or failing cancel is not an error
+    assert not cancel_stream(Response(iter([])))
+    assert not cancel_stream(object())
+    assert not cancel_stream(Response(Call(error=RuntimeError("closed"))))
@@ -0,0 +1,63 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.manifest_utils import MANIFEST_NAME, FramesManifest, build_manifest
+
+EPISODE = "scannet-v0/episode"
+
+
+def write_frame(path):
+    cv2.imwrite(str(path), np.zeros((48, 64, 3), dtype=np.uint8))
+
+
+@pytest.fixture
+def frames_directory(tmp_path):
+    folder = tmp_path / EPISODE
+    folder.mkdir(parents=True)
+    for idx in range(3):
+        write_frame(folder / "{:05d}-rgb.png".format(idx))
+    build_manifest(tmp_path)
+    return tmp_path
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_manifest_records_frames(frames_directory):
+    manifest = FramesManifest(frames_directory)
+    frames = manifest.get_frames(EPISODE)
+    assert [p.name for p in frames] == ["0000{}-rgb.png".format(i) for i in range(3)]
+    assert manifest.get_mtimes(EPISODE) == [os.stat(p).st_mtime_ns for p in frames]
+    assert manifest.get_shape(EPISODE) == (48, 64)
+    assert manifest.num_stale == 0
+
+
+def test_changed_episode_is_listed_again(frames_directory):
+    folder = frames_directory / EPISODE
+    write_frame(folder / "00003-rgb.png")
+    bump_mtime(folder)
+
+    manifest = FramesManifest(frames_directory)
+    assert len(manifest.get_frames(EPISODE)) == 4
+    assert len(manifest.get_mtimes(EPISODE)) == 4
+    assert manifest.num_stale == 1
+
+    # rebuilding only updates the changed episode
+    build_manifest(frames_directory)
+    entry = json.load((frames_directory / MANIFEST_NAME).open())["episodes"][EPISODE]
+    assert entry["mtime_ns"] == os.stat(folder).st_mtime_ns
+    assert len(entry["frames"]) == 4
+    manifest = FramesManifest(frames_directory)
+    assert len(manifest.get_frames(EPISODE)) == 4
+    assert manifest.num_stale == 0
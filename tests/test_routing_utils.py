@@ -0,0 +1,69 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+
+import pytest
+
+from openeqa.utils.routing_utils import get_route_cost, learn_policy
+
+DATASET = [
+    {"question_id": "q{}".format(i), "category": category}
+    for i, category in enumerate(["world knowledge", "object recognition"] * 2)
+]
+
+
+@pytest.fixture
+def make_candidates(tmp_path):
+    def make_candidates(routes):
+        candidates = {}
+        for name, (route, scores) in routes.items():
+            path = tmp_path / "{}-metrics.json".format(name)
+            json.dump(
+                {item["question_id"]: scores[i % 2] for i, item in enumerate(DATASET)},
+                path.open("w"),
+            )
+            candidates[name] = dict(route, metrics=str(path))
+        return candidates
+
+    return make_candidates
+
+
+def test_route_cost_units():
+    vision = {"backend": "vision", "num_frames": 10}
+    assert get_route_cost({"backend": "llama", "model": "x"}) == 0.0
+    assert get_route_cost(dict(vision, cost=0.5)) == 0.5
+    tokens = get_route_cost(vision)
+    assert tokens > get_route_cost({"backend": "blind"}) > 1
+    usd = get_route_cost(dict(vision, prices=[10, 30]))
+    assert usd == pytest.approx((tokens * 10 + 30 * 30) / 1e6)
+
+
+def test_cheapest_adequate_route_is_learned(make_candidates):
+    candidates = make_candidates(
+        {
+            "blind": ({"backend": "blind", "prices": [1, 2]}, [5, 1]),
+            "vision": ({"backend": "vision", "cost": 0.01}, [5, 5]),
+            "vision-small": ({"backend": "vision", "cost": 0.001}, [4, 5]),
+        }
+    )
+    policy = learn_policy(candidates, DATASET, max_score_drop=0.0)
+    assert policy["default"]["name"] == "vision"
+    assert policy["categories"]["world knowledge"]["name"] == "blind"
+    assert policy["categories"]["object recognition"]["name"] == "vision-small"
+    assert "metrics" not in policy["default"]
+
+
+@pytest.mark.parametrize("priced", [{"prices": [30, 60]}, {"cost": 0.01}])
+def test_usd_and_token_costs_are_not_mixed(make_candidates, priced):
+    candidates = make_candidates(
+        {
+            "blind": (dict({"backend": "blind"}, **priced), [5, 1]),
+            "vision": ({"backend": "vision"}, [5, 5]),
+            "llama": ({"backend": "llama", "model": "llama"}, [1, 1]),
+        }
+    )
+    with pytest.raises(ValueError, match="vision"):
+        learn_policy(candidates, DATASET)
@@ -0,0 +1,196 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import threading
+import time
+
+import pytest
+
+from openeqa.utils.runner_utils import (
+    Prefetcher,
+    QuestionDeduplicator,
+    RateLimiter,
+    normalize_question,
+    run_questions,
+)
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_results_are_saved_in_question_order(tmp_path):
+    items = [
+        {"question_id": "q{}".format(i), "delay": 0.05 * (3 - i)} for i in range(4)
+    ]
+    output_path = tmp_path / "results.json"
+    seen = []
+
+    def process_fn(item):
+        time.sleep(item["delay"])
+        if item["question_id"] != "q3":
+            seen.append(item["question_id"])
+            return {"question_id": item["question_id"]}
+
+    previous = [{"question_id": "old"}]
+    results = run_questions(items, process_fn, previous, output_path, concurrency=4)
+    assert seen[0] == "q2"  # answers finish out of order...
+    expected = [{"question_id": q} for q in ["old", "q0", "q1", "q2"]]
+    assert results == expected  # ...but are saved in order, without None
+    assert json.load(output_path.open()) == expected
+
+
+def test_finished_answers_are_saved_before_errors_are_raised(tmp_path):
+    items = [{"question_id": "q{}".format(i)} for i in range(5)]
+    output_path = tmp_path / "results.json"
+
+    def process_fn(item):
+        if item["question_id"] == "q2":
+            raise ValueError("boom")
+        if item["question_id"] > "q2":
+            time.sleep(0.2)
+        return {"question_id": item["question_id"], "answer": "a"}
+
+    with pytest.raises(ValueError, match="boom"):
+        run_questions(items, process_fn, [], output_path, concurrency=1)
+    assert json.load(output_path.open()) == [
+        {"question_id": "q0", "answer": "a"},
+        {"question_id": "q1", "answer": "a"},
+    ]
+
+
+def test_prefetcher_is_bounded_by_items():
+    items = [{"question_id": "q{}".format(i)} for i in range(5)]
+    prepared = []
+
+    def prepare_fn(item):
+        prepared.append(item["question_id"])
+        return item["question_id"]
+
+    prefetcher = Prefetcher(items, prepare_fn, max_items=2)
+    wait_until(lambda: len(prepared) == 2)
+    time.sleep(0.05)
+    assert prepared == ["q0", "q1"]
+
+    assert prefetcher.get(items[0]) == "q0"
+    wait_until(lambda: len(prepared) == 3)
+    assert [prefetcher.get(item) for item in items[1:]] == ["q1", "q2", "q3", "q4"]
+    prefetcher.close()
+
+
+def test_prefetcher_is_bounded_by_bytes():
+    items = [{"question_id": "q{}".format(i)} for i in range(4)]
+    prepared = []
+
+    def prepare_fn(item):
+        prepared.append(item["question_id"])
+        if item["question_id"] == "q3":
+            raise ValueError("bad frames")
+        return {"image": "x" * 8}
+
+    prefetcher = Prefetcher(items, prepare_fn, max_items=4, max_bytes=10)
+    wait_until(lambda: len(prepared) == 2)
+    time.sleep(0.05)
+    assert len(prepared) == 2  # 16 bytes are waiting
+
+    prefetcher.get(items[0])
+    prefetcher.get(items[1])
+    prefetcher.get(items[2])
+    with pytest.raises(ValueError, match="bad frames"):
+        prefetcher.get(items[3])
+    prefetcher.close()
+    with pytest.raises(RuntimeError):
+        prefetcher.get({"question_id": "q5"})
+
+
+def test_rate_limiter_spaces_out_requests():
+    limiter = RateLimiter(requests_per_minute=600)
+    start_times = []
+
+    def request():
+        limiter.wait()
+        start_times.append(time.monotonic())
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    start_times.sort()
+    gaps = [b - a for a, b in zip(start_times, start_times[1:])]
+    assert min(gaps) >= 0.09
+
+    start_time = time.monotonic()
+    for _ in range(10):
+        RateLimiter().wait()
+    assert time.monotonic() - start_time < 0.05
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What color is the sofa?",
+        "what color is the sofa",
+        "  What  color is\tthe sofa ? ",
+        "What color is the sofa...",
+    ],
+)
+def test_normalize_question(question):
+    assert normalize_question(question) == "what color is the sofa"
+
+
+def test_duplicate_questions_are_answered_once(tmp_path):
+    questions = [
+        "What color is the sofa?",
+        "Is the door open?",
+        "what color is the SOFA",
+    ]
+    items = [
+        {"question_id": "q{}".format(i), "question": question}
+        for i, question in enumerate(questions * 2)
+    ]
+    asked = []
+
+    def answer_fn(item):
+        asked.append(item["question_id"])
+        time.sleep(0.05)
+        return {"answer": "answer to " + item["question_id"]}
+
+    answer = QuestionDeduplicator(answer_fn)
+
+    def process_fn(item):
+        return {"question_id": item["question_id"], **answer(item)}
+
+    results = run_questions(items, process_fn, [], tmp_path / "results.json", 4)
+    assert sorted(asked) == ["q0", "q1"]
+    assert [r["question_id"] for r in results] == [
+        item["question_id"] for item in items
+    ]
+    assert [r["answer"] for r in results] == [
+        "answer to q0",
+        "answer to q1",
+        "answer to q0",
+    ] * 2
+    assert answer.num_duplicates == 4
+
+
+def test_failed_answers_are_not_reused():
+    calls = []
+
+    def answer_fn(item):
+        calls.append(item["question_id"])
+        if len(calls) == 1:
+            raise TimeoutError()
+        return {"answer": "red"}
+
+    answer = QuestionDeduplicator(answer_fn)
+    with pytest.raises(TimeoutError):
+        answer({"question_id": "q0", "question": "What color?"})
+    assert answer({"question_id": "q1", "question": "what color"}) == {"answer": "red"}
+    assert calls == ["q0", "q1"]
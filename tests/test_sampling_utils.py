@@ -0,0 +1,60 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+import threading
+
+import pytest
+
+from openeqa.utils.sampling_utils import majority_vote, sample_parallel
+
+
+@pytest.mark.parametrize(
+    "answers,expected",
+    [
+        (["red", "blue", "red"], "red"),
+        # answers are compared after normalization; the first spelling wins
+        (["The red one.", "blue", "red one", "Blue!", "RED ONE"], "The red one."),
+        # ties are broken by first occurrence
+        (["blue", "red", "Red", "the blue"], "blue"),
+        ([None, "red", "", None, "blue", "blue"], "blue"),
+        ([None, None], None),
+        ([], None),
+    ],
+)
+def test_majority_vote(answers, expected):
+    assert majority_vote(answers) == expected
+
+
+def make_fn(outcomes):
+    outcomes = iter(outcomes)
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return fn
+
+
+def test_failed_samples_are_dropped():
+    fn = make_fn([TimeoutError(), "red", None, TimeoutError(), "blue"])
+    samples = sample_parallel(fn, 5)
+    assert sorted(samples, key=str) == [None, "blue", "red"]
+
+
+def test_all_samples_failing_raises():
+    fn = make_fn(itertools.repeat(TimeoutError("request timed out")))
+    with pytest.raises(TimeoutError, match="timed out"):
+        sample_parallel(fn, 3)
+
+
+def test_single_sample_is_not_threaded():
+    assert sample_parallel(lambda: threading.current_thread().name, 1) == [
+        threading.current_thread().name
+    ]
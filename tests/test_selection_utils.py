@@ -0,0 +1,84 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.selection_utils import (
+    release_index,
+    select_distinct_indices,
+    select_frames,
+    select_pose_indices,
+)
+
+
+def make_pose(position, forward):
+    pose = np.eye(4)
+    pose[:3, 2] = forward
+    pose[:3, 3] = position
+    return pose
+
+
+def test_distinct_skips_near_duplicates():
+    # frame 1 is 8 bits from frame 0 and frame 4 is 1 bit from frame 3
+    hashes = np.array([0, 0xFF, 0x1FF, 2**64 - 1, 2**64 - 2], dtype=np.uint64)
+    assert select_distinct_indices(hashes, 10).tolist() == [0, 2, 3]
+    assert select_distinct_indices(hashes, 10, threshold=7).tolist() == [0, 1, 3]
+    assert select_distinct_indices(hashes, 2).tolist() == [0, 3]
+
+
+def test_pose_covers_positions_and_directions():
+    forward = [0.0, 0.0, 1.0]
+    poses = np.stack(
+        [make_pose([0.01 * i, 0.0, 0.0], forward) for i in range(5)]
+        + [make_pose([5.0, 0.0, 0.0], forward)]
+        + [make_pose([0.0, 0.0, 0.0], [0.0, 0.0, -1.0])]
+    )
+    assert select_pose_indices(poses, 3).tolist() == [0, 5, 6]
+    # without direction, the turned-around frame is a duplicate of frame 0
+    assert select_pose_indices(poses, 2, direction_weight=0.0).tolist() == [0, 5]
+
+
+def test_pose_skips_non_finite_poses():
+    # ScanNet marks frames without tracking with -inf poses
+    invalid = np.full((4, 4), -np.inf)
+    poses = np.stack(
+        [invalid, make_pose([0.0, 0.0, 0.0], [0, 0, 1]), invalid]
+        + [make_pose([1.0, 0.0, 0.0], [0, 0, 1])]
+    )
+    assert select_pose_indices(poses, 4).tolist() == [1, 3]
+    assert select_pose_indices(poses[[0, 2]], 4).tolist() == []
+
+
+@pytest.fixture
+def episode(tmp_path):
+    folder = tmp_path / "frames" / "episode"
+    folder.mkdir(parents=True)
+    paths = []
+    for idx in range(6):
+        path = folder / "{:05d}-rgb.png".format(idx)
+        cv2.imwrite(str(path), np.full((48, 64, 3), 40 * idx, dtype=np.uint8))
+        paths.append(path)
+    yield paths
+    release_index(folder)
+
+
+def test_pose_selection_reads_pose_files(episode, tmp_path):
+    for idx, path in enumerate(episode):
+        pose = make_pose([float(idx == 4), 0.0, 0.0], [0, 0, 1])
+        if idx == 0:
+            pose[:] = -np.inf
+        np.savetxt(str(path).replace("-rgb.png", ".txt"), pose)
+    selected = select_frames(
+        episode, 2, method="pose", index_directory=tmp_path / "index"
+    )
+    assert selected == [str(episode[1]), str(episode[4])]
+
+
+def test_pose_selection_falls_back_to_uniform(episode, capsys):
+    selected = select_frames(episode, 3, method="pose")
+    assert selected == [str(episode[i]) for i in [0, 2, 5]]
+    assert "missing camera poses" in capsys.readouterr().out
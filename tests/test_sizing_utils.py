@@ -0,0 +1,56 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+from openeqa.utils.sizing_utils import (
+    PROVIDERS,
+    get_image_size,
+    get_request_image_tokens,
+)
+
+SHAPE = (1080, 1920)
+
+
+@pytest.mark.parametrize("provider", ["openai", "google"])
+def test_budget_below_minimum_image_cost(provider):
+    with pytest.raises(ValueError):
+        get_image_size(provider, SHAPE, 50, token_budget=5000)
+
+
+@pytest.mark.parametrize("provider", PROVIDERS)
+@pytest.mark.parametrize("num_frames", [5, 10])
+def test_budget_image_size_fits(provider, num_frames):
+    tokens = get_request_image_tokens(provider, SHAPE, num_frames, token_budget=5000)
+    assert tokens <= 5000
+
+
+def test_mosaic_budget_image_size_fits():
+    tokens = get_request_image_tokens(
+        "openai", SHAPE, 50, token_budget=5000, mosaic_size=9
+    )
+    assert tokens <= 5000
+
+
+@pytest.mark.parametrize("mosaic_size", [None, 4])
+@pytest.mark.parametrize("token_budget", [None, 5000])
+def test_unknown_shape_falls_back_to_image_size(mosaic_size, token_budget):
+    # e.g. an episode without frames in the manifest
+    size = get_image_size(
+        "openai", None, 10, 384, token_budget=token_budget, mosaic_size=mosaic_size
+    )
+    assert size == 384
+
+
+@pytest.mark.parametrize("mosaic_size", [None, 4])
+def test_full_resolution_without_image_size(mosaic_size):
+    size = get_image_size("anthropic", SHAPE, 8, None, mosaic_size=mosaic_size)
+    assert size is None
+    tokens = get_request_image_tokens(
+        "anthropic", SHAPE, 8, None, mosaic_size=mosaic_size
+    )
+    assert tokens == get_request_image_tokens(
+        "anthropic", SHAPE, 8, max(SHAPE), mosaic_size=mosaic_size
+    )
@@ -0,0 +1,63 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from openeqa.utils.decode_utils import decode_frame
+from openeqa.utils.store_utils import FrameStore, build_frame_store
+
+EPISODE = "scannet-v0/episode"
+
+
+@pytest.fixture
+def frames_directory(tmp_path):
+    folder = tmp_path / "frames" / EPISODE
+    folder.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for idx in range(5):
+        frame = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+        cv2.imwrite(str(folder / "{:05d}-rgb.png".format(idx)), frame)
+    return tmp_path / "frames"
+
+
+def test_store_round_trip(tmp_path, frames_directory):
+    store_directory = tmp_path / "store"
+    build_frame_store(frames_directory, store_directory, [32, 16])
+    store = FrameStore(store_directory, frames_directory)
+    paths = sorted(str(p) for p in (frames_directory / EPISODE).glob("*-rgb.png"))
+
+    for path in paths:
+        frame = store.get_frame(path, 32)
+        assert isinstance(frame.base, np.memmap)  # served from the memory map
+        np.testing.assert_array_equal(frame, decode_frame(path, 32))
+        np.testing.assert_array_equal(store.get_frame(path, 16), decode_frame(path, 16))
+
+    # smaller sizes are resized from the next larger stored size
+    assert store.get_frame(paths[0], 24).shape == decode_frame(paths[0], 24).shape
+    # larger sizes and unknown frames are not served
+    assert store.get_frame(paths[0], 64) is None
+    assert store.get_frame(str(frames_directory / EPISODE / "x-rgb.png"), 32) is None
+    assert store.hits == 2 * len(paths) + 1
+    assert store.misses == 2
+
+
+def test_stale_store_is_ignored(tmp_path, frames_directory):
+    store_directory = tmp_path / "store"
+    build_frame_store(frames_directory, store_directory, [32])
+    folder = frames_directory / EPISODE
+    path = str(folder / "00000-rgb.png")
+
+    store = FrameStore(store_directory, frames_directory)
+    assert store.get_frame(path, 32) is not None
+
+    stat = os.stat(folder)
+    os.utime(folder, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.get_frame(path, 32) is not None  # checked once per episode
+    store.release(folder)
+    assert store.get_frame(path, 32) is None
@@ -0,0 +1,84 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import time
+
+import pytest
+
+from openeqa.utils.stream_utils import StreamStats, is_answer_complete, read_stream
+
+
+@pytest.mark.parametrize(
+    "text,complete",
+    [
+        ("", False),
+        ("Q: what color is the sofa?\n", False),
+        ("A: red", False),
+        ("A: red\n", True),
+        ("The sofa is red.\nA: red\nConfidence: 5", True),
+    ],
+)
+def test_is_answer_complete(text, complete):
+    assert is_answer_complete(text) == complete
+
+
+def make_chunks(chunks, consumed, delay=0.0):
+    for chunk in chunks:
+        time.sleep(delay)
+        consumed.append(chunk)
+        yield chunk
+
+
+def test_read_stream_stops_after_answer_line():
+    chunks = ["", "Thinking.\nA: re", "d\n", "Confidence: 5", " more"]
+    consumed = []
+    latency = {}
+    start_time = time.perf_counter()
+    text = read_stream(
+        make_chunks(chunks, consumed),
+        start_time,
+        stop_fn=is_answer_complete,
+        latency=latency,
+    )
+    assert text == "Thinking.\nA: red\n"
+    assert consumed == chunks[:3]
+    assert latency["stopped_early"]
+    assert 0 <= latency["first_token_seconds"] <= latency["answer_seconds"]
+
+
+def test_read_stream_without_answer_line_reads_everything():
+    chunks = ["The sofa", " is red.\n", "It is by the window.\n"]
+    latency = {}
+    text = read_stream(
+        iter(chunks), time.perf_counter(), stop_fn=is_answer_complete, latency=latency
+    )
+    assert text == "".join(chunks)
+    assert not latency["stopped_early"]
+
+
+def test_read_stream_latency():
+    start_time = time.perf_counter()
+    latency = {}
+    read_stream(
+        make_chunks(["A:", " red", "\n"], [], delay=0.05), start_time, None, latency
+    )
+    assert latency["first_token_seconds"] >= 0.05
+    assert latency["answer_seconds"] >= 0.15
+    assert not latency["stopped_early"]
+
+    # an empty stream counts its full duration as time to first token
+    latency = {}
+    assert read_stream(iter([]), time.perf_counter(), latency=latency) == ""
+    assert latency["first_token_seconds"] == latency["answer_seconds"]
+
+
+def test_stream_stats_skip_unstreamed_requests():
+    stats = StreamStats()
+    stats.add({})
+    stats.add(
+        {"first_token_seconds": 0.5, "answer_seconds": 1.0, "stopped_early": True}
+    )
+    assert stats.answer_seconds == [1.0]
+    assert stats.num_stopped == 1